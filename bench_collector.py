@@ -0,0 +1,112 @@
+import argparse
+import os
+import tempfile
+import time
+
+from mock_reddit_api import MockRedditServer, MockRedditState, build_world
+
+
+def reset_stats(state):
+    with state.lock:
+        state.stats = {"requests": 0, "throttled": 0, "endpoints": {}}
+
+
+def run_benchmark(state, url, subreddit, workers_list, mode="pipeline"):
+    os.environ["REDDIT_API_URL"] = url
+    for key in ["BOTLOGIN", "BOTSECRET", "LOGIN", "PASSWORD"]:
+        os.environ.setdefault(key, "mock")
+
+    import gatcher_reddit_data
+
+    # Every run has to reach the server, so responses are not cached on disk
+    gatcher_reddit_data.HTTP_CACHE_FILE = None
+    gatcher_reddit_data.STEP = 10**9
+    results = []
+
+    for workers in workers_list:
+        gatcher_reddit_data.MAX_WORKERS = workers
+        gatcher_reddit_data.get_reddit.cache_clear()
+        gatcher_reddit_data.get_http_cache.cache_clear()
+        gatcher_reddit_data.get_controller.cache_clear()
+        with tempfile.TemporaryDirectory() as directory:
+            gatcher_reddit_data.FETCHED_USERS_FILE = f"{directory}/fetched_users.txt"
+            reset_stats(state)
+
+            start = time.perf_counter()
+            if mode == "pipeline":
+                posts, comments, user_df = gatcher_reddit_data.main(subreddit, set())
+                listing_seconds = None
+            else:
+                posts, comments, users = gatcher_reddit_data.get_posts_for_subreddit(
+                    subreddit
+                )
+                listing_seconds = round(time.perf_counter() - start, 2)
+                user_df, _, _ = gatcher_reddit_data.get_user_data(users, subreddit)
+            total_seconds = time.perf_counter() - start
+
+        results.append(
+            {
+                "mode": mode,
+                "workers": workers,
+                "posts": len(posts),
+                "comments": len(comments),
+                "users": len(user_df),
+                "requests": state.stats["requests"],
+                "throttled": state.stats["throttled"],
+                "submission_phase_s": listing_seconds,
+                "total_s": round(total_seconds, 2),
+                "requests_per_s": round(state.stats["requests"] / total_seconds, 1),
+                "final_limit": gatcher_reddit_data.get_controller().current_limit,
+            }
+        )
+        print(results[-1])
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the collector against the mock Reddit API."
+    )
+    parser.add_argument("--subreddit", default="funny")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Maximum concurrency for each run.",
+    )
+    parser.add_argument("--mode", choices=["pipeline", "batch"], default="pipeline")
+    parser.add_argument("--submissions", type=int, default=20)
+    parser.add_argument("--comments", type=int, default=20)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=None)
+    parser.add_argument("--quota-window", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    world = build_world(
+        args.seed,
+        subreddits=[args.subreddit],
+        submissions_per_subreddit=args.submissions,
+        comments_per_submission=args.comments,
+        num_users=args.users,
+    )
+    state = MockRedditState(
+        world,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        quota=args.quota,
+        quota_window=args.quota_window,
+        seed=args.seed,
+    )
+    with MockRedditServer(state) as server:
+        print(f"Mock Reddit API on {server.url}")
+        run_benchmark(state, server.url, args.subreddit, args.workers, args.mode)
@@ -0,0 +1,172 @@
+import argparse
+import sys
+
+# Heavy modules are imported inside the subcommand handlers so that
+# `--help` and `import cli` stay fast.
+
+
+def add_preprocessing_arguments(parser):
+    parser.add_argument("--comments", default=None, help="Merged comments CSV.")
+    parser.add_argument("--posts", default=None, help="Merged posts CSV.")
+    parser.add_argument("--users", default=None, help="Merged user data CSV.")
+    parser.add_argument("--features-file", default=None, help="Output features CSV.")
+    parser.add_argument("--labels-file", default=None, help="Output labels CSV.")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--cache-max-mb", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Compute TF-IDF similarities in float32.",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print feature cache hits, misses and time saved.",
+    )
+    parser.add_argument(
+        "--threads",
+        default=None,
+        help="Thread store directory for tree features, built if missing.",
+    )
+    parser.add_argument(
+        "--snapshots",
+        default=None,
+        help="Also write per-subreddit and per-week feature snapshots here.",
+    )
+    parser.add_argument(
+        "--tfidf-store",
+        default=None,
+        help="Persistent TF-IDF vocabulary, updated with new comments only.",
+    )
+    parser.add_argument(
+        "--label-workers",
+        type=int,
+        default=None,
+        help="Processes for labeling, each over a shard of users.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Write features and labels together to this CSV instead.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Compute features in this many worker processes, one per user shard.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Directory shared by the coordinator and the shard workers.",
+    )
+    parser.add_argument(
+        "--text-archive",
+        default=None,
+        help="Text archive the shard workers read their comments from, built if missing.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        default=None,
+        help="Compute only these feature stages (and the inputs they need).",
+    )
+    parser.add_argument(
+        "--stage-workers",
+        type=int,
+        default=None,
+        help="Threads running independent feature stages concurrently.",
+    )
+    parser.add_argument(
+        "--drift-dir",
+        default=None,
+        help="Directory for this run's feature and label sketches (data/drift).",
+    )
+    parser.add_argument("--no-drift", action="store_true")
+
+
+def collect(args):
+    import gatcher_reddit_data
+
+    gatcher_reddit_data.HTTP_CACHE_FILE = (
+        None if args.no_http_cache else args.http_cache
+    )
+    gatcher_reddit_data.run(args.subreddits or gatcher_reddit_data.SUBREDDITS)
+
+
+def refresh(args):
+    import gatcher_reddit_data
+
+    gatcher_reddit_data.HTTP_CACHE_FILE = None
+    gatcher_reddit_data.refresh_users(args.budget, args.bot_scores)
+
+
+def merge(args):
+    import merger
+
+    merger.merge(args.source_dir, args.target_dir)
+
+
+def features(args):
+    import data_preprocessing
+
+    data_preprocessing.run(args, features=True, labels=False)
+
+
+def label(args):
+    import data_preprocessing
+
+    data_preprocessing.run(args, features=False, labels=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli", description="Reddit bot detection pipeline."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    collect_parser = subparsers.add_parser("collect", help="Collect Reddit data.")
+    collect_parser.add_argument("--subreddits", nargs="+", default=None)
+    collect_parser.add_argument(
+        "--http-cache",
+        default="data/http_cache.sqlite",
+        help="SQLite cache of redditor profile and history responses.",
+    )
+    collect_parser.add_argument("--no-http-cache", action="store_true")
+    collect_parser.set_defaults(handler=collect)
+
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="Re-fetch known users within a request budget."
+    )
+    refresh_parser.add_argument("--budget", type=int, required=True)
+    refresh_parser.add_argument(
+        "--bot-scores",
+        default=None,
+        help="CSV of username and bot_score; scores near 0.5 are refreshed first.",
+    )
+    refresh_parser.set_defaults(handler=refresh)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge collected chunks.")
+    merge_parser.add_argument("--source-dir", default="amc-v2")
+    merge_parser.add_argument("--target-dir", default="data")
+    merge_parser.set_defaults(handler=merge)
+
+    features_parser = subparsers.add_parser("features", help="Create features.")
+    add_preprocessing_arguments(features_parser)
+    features_parser.set_defaults(handler=features)
+
+    label_parser = subparsers.add_parser("label", help="Label bots.")
+    add_preprocessing_arguments(label_parser)
+    label_parser.set_defaults(handler=label)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.9
+LATENCY_TOLERANCE = 2.0
+LATENCY_ALPHA = 0.2
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MAX_TRIES = 6
+
+
+# Additive-increase / multiplicative-decrease limit on in-flight requests
+class AdaptiveConcurrency:
+    def __init__(
+        self,
+        initial_limit=INITIAL_LIMIT,
+        min_limit=MIN_LIMIT,
+        max_limit=MAX_LIMIT,
+        latency_target=None,
+        seed=None,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # The starting limit has to respect the bounds too
+        self.initial_limit = min(max_limit, max(min_limit, initial_limit))
+        self.limit = float(self.initial_limit)
+        self.latency_target = latency_target
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.window_successes = 0
+        self.consecutive_throttles = 0
+        self.cooldown_until = 0.0
+        self.latency = {}
+        self.completed = 0
+        self.throttled = 0
+        self.failed = 0
+        self.decisions = []
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.cooldown_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.current_limit:
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _decide(self, new_limit, reason):
+        new_limit = min(self.max_limit, max(self.min_limit, new_limit))
+        if int(new_limit) != int(self.limit):
+            self.decisions.append(
+                {
+                    "time": time.time(),
+                    "from": self.current_limit,
+                    "to": max(self.min_limit, int(new_limit)),
+                    "reason": reason,
+                }
+            )
+        self.limit = new_limit
+        self.window_successes = 0
+        self.condition.notify_all()
+
+    def _latency_healthy(self, stats):
+        if self.latency_target is not None:
+            return stats["ewma"] <= self.latency_target
+        return stats["ewma"] <= LATENCY_TOLERANCE * stats["best"]
+
+    # Latency is tracked per kind of task, since one call may issue many requests
+    def on_success(self, latency, kind=None):
+        with self.condition:
+            self.completed += 1
+            self.consecutive_throttles = 0
+            stats = self.latency.setdefault(kind, {"ewma": latency, "best": latency})
+            stats["ewma"] += LATENCY_ALPHA * (latency - stats["ewma"])
+            stats["best"] = min(stats["best"], stats["ewma"])
+
+            # Adjust once per window of `limit` completions
+            self.window_successes += 1
+            if self.window_successes < self.current_limit:
+                return
+            if self._latency_healthy(stats):
+                self._decide(self.limit + 1, "increase")
+            elif self.limit > self.initial_limit:
+                # Slow responses alone do not push below the starting limit;
+                # only 429s do
+                self._decide(
+                    max(self.initial_limit, self.limit * LATENCY_DECREASE_FACTOR),
+                    "latency",
+                )
+            else:
+                self.window_successes = 0
+
+    def on_throttle(self):
+        with self.condition:
+            self.throttled += 1
+            self.consecutive_throttles += 1
+            # Full jitter, so workers do not retry in lockstep
+            backoff = min(
+                BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.consecutive_throttles - 1)
+            )
+            delay = self.random.uniform(0, backoff)
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self._decide(self.limit * DECREASE_FACTOR, "throttled")
+            return delay
+
+    def on_failure(self):
+        with self.condition:
+            self.failed += 1
+
+    def call(self, func, *args, retry_on=(), tries=MAX_TRIES, **kwargs):
+        kind = getattr(getattr(func, "func", func), "__name__", type(func).__name__)
+        for attempt in range(tries):
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except retry_on as e:
+                self.release()
+                delay = self.on_throttle()
+                if attempt == tries - 1:
+                    self.on_failure()
+                    raise
+                print(f"{e}, limit {self.current_limit}, cooling down {delay:.1f}s")
+                continue
+            except Exception:
+                self.release()
+                self.on_failure()
+                raise
+            self.release()
+            self.on_success(time.perf_counter() - start, kind)
+            return result
+
+    def metrics(self):
+        with self.condition:
+            return {
+                "limit": self.current_limit,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "throttled": self.throttled,
+                "failed": self.failed,
+                "latency": {
+                    kind: round(stats["ewma"], 4)
+                    for kind, stats in self.latency.items()
+                },
+                "decisions": len(self.decisions),
+            }
+
+    def print_metrics(self):
+        metrics = self.metrics()
+        print(
+            f"Concurrency: limit {metrics['limit']}, completed {metrics['completed']}, "
+            f"throttled {metrics['throttled']}, failed {metrics['failed']}, "
+            f"decisions {metrics['decisions']}, latency {metrics['latency']}"
+        )
+
+
+# Yields (item, future) as tasks finish, pacing calls through the controller
+def map_adaptive(controller, func, items, retry_on=()):
+    with ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
+        futures = {
+            executor.submit(controller.call, func, item, retry_on=retry_on): item
+            for item in items
+        }
+        for future in as_completed(futures):
+            yield futures[future], future
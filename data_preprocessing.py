@@ -1,16 +1,83 @@
+import argparse
 import re
 from datetime import datetime
+from functools import lru_cache
 from string import punctuation
 
-import emoji
+import numpy as np
 import pandas as pd
-import textstat
-from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import normalize
 from tqdm import tqdm
 
+from distributed_features import WORK_DIR, run_coordinator
+from drift_monitor import DRIFT_DIR, record_run
+from feature_cache import (
+    CACHE_DIR,
+    CACHE_MAX_BYTES,
+    FeatureCache,
+    hash_code,
+    hash_frame,
+    stage_key,
+)
+from graph_features import (
+    add_graph_features,
+    build_reply_matrix,
+    build_user_subreddit_matrix,
+    pagerank,
+    reciprocity,
+    subreddit_entropy,
+)
+from group_features import (
+    SNAPSHOT_DIR,
+    build_group_index,
+    compute_snapshots,
+    rollup,
+    save_snapshots,
+)
+from link_features import (
+    add_link_features,
+    build_domain_index,
+    domain_concentration,
+    domain_user_counts,
+    extract_domains,
+    link_documents,
+    shared_domain_share,
+)
+from ngram_lm import (
+    NgramStore,
+    add_text_predictability,
+    count_keys,
+    document_counts,
+    interpolation_weights,
+    ngram_keys,
+    tokenize,
+)
+from similarity_kernel import (
+    SimilarityKernel,
+    segment_codes,
+    segment_matrix,
+    segment_mean,
+    segment_pairwise_mean,
+)
+from stage_graph import STAGE_WORKERS, run_graph
+from temporal_features import (
+    add_temporal_features,
+    build_user_time_index,
+    hour_entropy,
+    inter_arrival_stats,
+    segment_min,
+    unique_events,
+)
+from tfidf_store import TfidfStore
+from thread_store import open_thread_store, thread_depths
+from username_families import (
+    add_username_families,
+    deletion_hashes,
+    largest_buckets,
+    shape_signatures,
+    token_patterns,
+    username_families,
+)
+
 DIR = "data"
 comments_file_path = f"{DIR}/all_comments-merged.csv"
 posts_file_path = f"{DIR}/all_posts-merged.csv"
@@ -47,15 +114,31 @@ def clean_text(text):
     return text
 
 
-def add_tfidf_vectors(comments_df):
-    comments_df["cleaned_body"] = comments_df["body"].apply(clean_text)
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(comments_df["cleaned_body"])
-    tfidf_matrix = normalize(tfidf_matrix)
-    tfidf_vectors = [vec for vec in tfidf_matrix]
-    comments_df["vector"] = tfidf_vectors
+# Returns a new frame, so stages reading comments_df concurrently are unaffected
+def add_cleaned_body(comments_df):
+    return comments_df.assign(cleaned_body=comments_df["body"].apply(clean_text))
+
+
+def user_segment_codes(comments_df):
+    return segment_codes(comments_df["username"])
 
-    return comments_df
+
+def build_similarity_kernel(comments_df, dtype=np.float64, tfidf=None):
+    return SimilarityKernel(comments_df["cleaned_body"], vectorizer=tfidf, dtype=dtype)
+
+
+# Adds comments the persistent TF-IDF store has not seen yet
+def update_tfidf_store(tfidf, comments_df):
+    keys = pd.util.hash_pandas_object(
+        comments_df[["id", "body"]], index=False
+    ).to_numpy()
+    new = tfidf.new_documents(keys)
+    if new.any():
+        texts = comments_df.loc[new, "body"].apply(clean_text)
+        tfidf.partial_fit(texts, keys[new])
+        tfidf.save()
+    print(f"TF-IDF store updated with {new.sum()} new comments.")
+    tfidf.print_stats()
 
 
 def remove_zwj(comment):
@@ -64,6 +147,8 @@ def remove_zwj(comment):
 
 
 def is_weird_comment(comments):
+    import emoji
+
     if all(
         len(comment) <= 1 or all(char in punctuation for char in comment)
         for comment in comments
@@ -93,32 +178,30 @@ def is_weird_comment(comments):
 
 
 # New features
-def add_avg_cosine_similarity(df, comments_df):
-    vectorizer = TfidfVectorizer()
-    grouped_comments = comments_df.groupby("username")["cleaned_body"].apply(list)
-    avg_cosine_similarities = {}
+def add_avg_cosine_similarity(df, comments_df, kernel=None, user_codes=None):
+    if kernel is None:
+        kernel = build_similarity_kernel(comments_df)
+    if user_codes is None:
+        user_codes = user_segment_codes(comments_df)
+    codes, usernames = user_codes
+    avg_similarity, counts = segment_pairwise_mean(
+        kernel.matrix, codes, len(usernames)
+    )
 
+    grouped_comments = comments_df.groupby("username")["cleaned_body"].apply(list)
     for username, comments in tqdm(
         grouped_comments.items(),
-        desc="Processing cosine similarities of comments",
+        desc="Checking weird comments",
         total=len(grouped_comments),
     ):
-        if is_weird_comment(comments) and len(comments) > 1:
-            avg_cosine_similarity = 1.0
-        elif len(comments) > 1:
-            tfidf_matrix = vectorizer.fit_transform(comments)
-            cosine_sim_matrix = cosine_similarity(tfidf_matrix)
-            avg_cosine_similarity = (cosine_sim_matrix.sum() - len(comments)) / (
-                len(comments) * (len(comments) - 1)
-            )
-        else:
-            avg_cosine_similarity = None
-
-        avg_cosine_similarities[username] = avg_cosine_similarity
+        if len(comments) > 1 and is_weird_comment(comments):
+            avg_similarity[usernames.get_loc(username)] = 1.0
 
     avg_cosine_similarities_df = pd.DataFrame(
-        list(avg_cosine_similarities.items()),
-        columns=["username", "avg_cosine_similarity"],
+        {
+            "username": usernames,
+            "avg_cosine_similarity": np.where(counts > 1, avg_similarity, None),
+        }
     )
     df = df.merge(avg_cosine_similarities_df, on="username", how="left")
     print("Feature avg_cosine_similarity created successfully.")
@@ -126,32 +209,44 @@ def add_avg_cosine_similarity(df, comments_df):
     return df
 
 
-def add_all_users_similarity(df, comments_df):
-    sampled_comments = comments_df["cleaned_body"].sample(n=5000, random_state=42).tolist()
-
-    vectorizer = TfidfVectorizer()
-    sampled_matrix = vectorizer.fit_transform(sampled_comments)
+def sample_positions(n_rows, sample_size=5000):
+    sample_size = min(sample_size, n_rows)
+    return (
+        pd.RangeIndex(n_rows)
+        .to_series()
+        .sample(n=sample_size, random_state=42)
+        .index.to_numpy()
+    )
 
-    grouped_comments = comments_df.groupby("username")["cleaned_body"].apply(list)
-    all_users_similarities = {}
 
-    for username, comments in tqdm(
-        grouped_comments.items(),
-        desc="Processing cosine similarities of comments",
-        total=len(grouped_comments),
-    ):
-        if len(comments) > 0:
-            user_matrix = vectorizer.transform(comments)
-            cosine_sim_matrix = cosine_similarity(user_matrix, sampled_matrix)
-            avg_cosine_similarity = cosine_sim_matrix.mean(axis=1).mean()
-        else:
-            avg_cosine_similarity = None
+# Mean similarity to the sampled comments, as mean_j x_i . y_j = x_i . mean_j y_j,
+# so no gram matrix is built. The centroid can come from outside when comments
+# are split across workers
+def comment_centroid_similarity(comments_df, kernel, sample_size=5000, centroid=None):
+    if centroid is None:
+        sampled_rows = sample_positions(len(comments_df), sample_size)
+        centroid = kernel.centroid(kernel.rows(sampled_rows))
+    return np.asarray(kernel.matrix @ centroid, dtype=np.float64).ravel()
 
-        all_users_similarities[username] = avg_cosine_similarity
 
+def add_all_users_similarity(
+    df, comments_df, kernel=None, sample_size=5000, centroid=None, user_codes=None
+):
+    if kernel is None:
+        kernel = build_similarity_kernel(comments_df)
+    comment_similarity = comment_centroid_similarity(
+        comments_df, kernel, sample_size, centroid
+    )
+    if user_codes is None:
+        user_codes = user_segment_codes(comments_df)
+    codes, usernames = user_codes
     all_users_similarities_df = pd.DataFrame(
-        list(all_users_similarities.items()),
-        columns=["username", "all_users_similarity"],
+        {
+            "username": usernames,
+            "all_users_similarity": segment_mean(
+                comment_similarity, codes, len(usernames)
+            ),
+        }
     )
     df = df.merge(all_users_similarities_df, on="username", how="left")
     print("Feature all_users_similarity created successfully.")
@@ -176,9 +271,9 @@ def add_comment_length_metrics(df, comments_df):
         max_lengths[username] = max(comment_lengths)
         min_lengths[username] = min(comment_lengths)
 
-    df["avg_comment_length"] = comments_df["username"].map(avg_lengths)
-    df["max_comment_length"] = comments_df["username"].map(max_lengths)
-    df["min_comment_length"] = comments_df["username"].map(min_lengths)
+    df["avg_comment_length"] = df["username"].map(avg_lengths)
+    df["max_comment_length"] = df["username"].map(max_lengths)
+    df["min_comment_length"] = df["username"].map(min_lengths)
 
     print(
         "Features avg_comment_length, max_comment_length, min_comment_length created successfully."
@@ -209,29 +304,27 @@ def add_comment_post_ratio(df, comments_df, posts_df):
     return df
 
 
-def add_average_thread_depth(df, comments_df):
-    comments_df_copy = comments_df.copy()
+def comment_thread_depths(comments_df):
+    parent_ids = comments_df["parent_id"].fillna("").astype(str)
+    is_comment_parent = (
+        parent_ids.str.startswith("t1_") & comments_df["post_title"].notna()
+    ).to_numpy()
+    return thread_depths(parent_positions(comments_df), is_comment_parent)
 
-    def calculate_depth(comment_id, parent_lookup):
-        depth = 0
-        while comment_id in parent_lookup and parent_lookup[comment_id].startswith(
-            "t1_"
-        ):
-            parent_id = parent_lookup[comment_id]
-            comment_id = parent_id[3:]
-            depth += 1
-        return depth
 
-    comments_df_copy["depth"] = 0
-
-    for post_title, group in comments_df_copy.groupby("post_title"):
-        parent_lookup = dict(zip(group["id"], group["parent_id"]))
-        comments_df_copy.loc[group.index, "depth"] = group["id"].apply(
-            lambda x: calculate_depth(x, parent_lookup)
+def add_average_thread_depth(df, comments_df, store=None):
+    if store is None:
+        depth = comment_thread_depths(comments_df)
+        usernames = comments_df["username"].to_numpy()
+    else:
+        depth = thread_depths(
+            np.asarray(store.parents), np.asarray(store.parent_is_comment)
         )
+        usernames = store.usernames()
 
     avg_depth_per_user = (
-        comments_df_copy.groupby("username")["depth"]
+        pd.DataFrame({"username": usernames, "depth": depth})
+        .groupby("username")["depth"]
         .mean()
         .reset_index(name="avg_thread_depth")
     )
@@ -242,40 +335,53 @@ def add_average_thread_depth(df, comments_df):
     return df
 
 
-def add_parent_child_similarity(df, comments_df):
-    comments_df_copy = comments_df.copy()
+def parent_positions(comments_df):
+    keys = pd.MultiIndex.from_arrays(
+        [comments_df["post_title"].to_numpy(), comments_df["id"].to_numpy()]
+    )
+    # Last row wins for duplicated ids, like a dict built from the group
+    last = ~keys.duplicated(keep="last")
+    lookup = keys[last]
+    positions = np.flatnonzero(last)
+
+    parent_ids = comments_df["parent_id"].fillna("").astype(str)
+    is_comment_parent = parent_ids.str.startswith("t1_").to_numpy()
+    parent_keys = pd.MultiIndex.from_arrays(
+        [comments_df["post_title"].to_numpy(), parent_ids.str[3:].to_numpy()]
+    )
+    found = lookup.get_indexer(parent_keys)
+    parents = np.where((found >= 0) & is_comment_parent, positions[found], -1)
+    return parents
 
-    def calculate_average_similarity(comment_id, parent_lookup, comment_vectors):
-        similarities = []
-        current_id = comment_id
 
-        while current_id in parent_lookup and parent_lookup[current_id].startswith(
-            "t1_"
-        ):
-            parent_id = parent_lookup[current_id]
-            current_id = parent_id[3:]
-            if current_id in comment_vectors:
-                similarity = cosine_similarity(
-                    comment_vectors[comment_id], comment_vectors[current_id]
-                )[0, 0]
-                similarities.append(similarity)
+# Mean similarity of each comment to all of its ancestors, 0 without any
+def parent_child_scores(comments_df, kernel):
+    parents = parent_positions(comments_df)
 
-        if similarities:
-            return sum(similarities) / len(similarities)
-        else:
-            return 0
+    # Walk all ancestor chains one level at a time
+    current = np.arange(len(comments_df))
+    similarity_sum = np.zeros(len(comments_df))
+    similarity_count = np.zeros(len(comments_df))
+    active = np.flatnonzero(parents >= 0)
+    depth = 0
+    while len(active) and depth < len(comments_df):
+        depth += 1
+        ancestors = parents[current[active]]
+        similarity_sum[active] += kernel.rowwise_dot(active, ancestors)
+        similarity_count[active] += 1
+        current[active] = ancestors
+        active = active[parents[ancestors] >= 0]
 
-    comments_df_copy["similarity"] = 0.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(similarity_count > 0, similarity_sum / similarity_count, 0.0)
 
-    for post_title, group in tqdm(
-        comments_df_copy.groupby("post_title"),
-        desc="Processing parent child similarity",
-    ):
-        parent_lookup = dict(zip(group["id"], group["parent_id"]))
-        comment_vectors = dict(zip(group["id"], group["vector"]))
-        comments_df_copy.loc[group.index, "similarity"] = group["id"].apply(
-            lambda x: calculate_average_similarity(x, parent_lookup, comment_vectors)
-        )
+
+def add_parent_child_similarity(df, comments_df, kernel=None):
+    if kernel is None:
+        kernel = build_similarity_kernel(comments_df)
+
+    comments_df_copy = comments_df[["username"]].copy()
+    comments_df_copy["similarity"] = parent_child_scores(comments_df, kernel)
 
     user_similarity = (
         comments_df_copy.groupby("username")["similarity"].mean().reset_index()
@@ -288,6 +394,8 @@ def add_parent_child_similarity(df, comments_df):
 
 
 def calculate_ttr(text):
+    from nltk.tokenize import word_tokenize
+
     tokens = word_tokenize(text)
     num_tokens = len(tokens)
     num_types = len(set(tokens))
@@ -296,10 +404,18 @@ def calculate_ttr(text):
     return num_types / num_tokens
 
 
-def add_average_ttr(df, comments_df):
-    comments_df["ttr"] = comments_df["cleaned_body"].apply(calculate_ttr)
+def comment_ttr(comments_df):
+    return comments_df["cleaned_body"].apply(calculate_ttr).to_numpy()
+
+
+def add_average_ttr(df, comments_df, ttr=None):
+    if ttr is None:
+        ttr = comment_ttr(comments_df)
     avg_ttr_per_user = (
-        comments_df.groupby("username")["ttr"].mean().reset_index(name="avg_ttr")
+        pd.DataFrame({"username": comments_df["username"].to_numpy(), "ttr": ttr})
+        .groupby("username")["ttr"]
+        .mean()
+        .reset_index(name="avg_ttr")
     )
     df = df.merge(avg_ttr_per_user, on="username", how="left")
     print("Feature avg_ttr created successfully.")
@@ -308,15 +424,28 @@ def add_average_ttr(df, comments_df):
 
 
 def calculate_flesch_kincaid_grade(text):
+    import textstat
+
     return textstat.flesch_kincaid_grade(text)
 
 
-def add_average_flesch_kincaid_grade(df, comments_df):
-    comments_df["flesch_kincaid_grade"] = comments_df["cleaned_body"].apply(
-        calculate_flesch_kincaid_grade
+def comment_flesch_kincaid_grades(comments_df):
+    return (
+        comments_df["cleaned_body"].apply(calculate_flesch_kincaid_grade).to_numpy()
     )
+
+
+def add_average_flesch_kincaid_grade(df, comments_df, grades=None):
+    if grades is None:
+        grades = comment_flesch_kincaid_grades(comments_df)
     avg_grade_per_user = (
-        comments_df.groupby("username")["flesch_kincaid_grade"]
+        pd.DataFrame(
+            {
+                "username": comments_df["username"].to_numpy(),
+                "flesch_kincaid_grade": grades,
+            }
+        )
+        .groupby("username")["flesch_kincaid_grade"]
         .mean()
         .reset_index(name="avg_flesch_kincaid_grade")
     )
@@ -326,45 +455,44 @@ def add_average_flesch_kincaid_grade(df, comments_df):
     return df
 
 
-def get_ngrams(text, n=2):
-    vectorizer = CountVectorizer(ngram_range=(n, n))
-    analyzer = vectorizer.build_analyzer()
-    return set(analyzer(text))
-
-
-def calculate_overlap(comments, n=2):
-    if len(comments) < 2:
-        return 0.0
-
-    all_ngrams = [get_ngrams(comment, n) for comment in comments]
-    overlap_count = 0
-    total_count = 0
-
-    for i in range(len(all_ngrams)):
-        for j in range(i + 1, len(all_ngrams)):
-            overlap_count += len(all_ngrams[i].intersection(all_ngrams[j]))
-            total_count += len(all_ngrams[i].union(all_ngrams[j]))
-
-    if total_count == 0:
-        return 0.0
-
-    return overlap_count / total_count
-
-
-def add_ngram_overlap(df, comments_df, n=2):
-    grouped_comments = comments_df.groupby("username")["cleaned_body"].apply(list)
-
-    overlap_ratios = {}
-
-    for username, comments in tqdm(
-        grouped_comments.items(),
-        desc="Calculating n-gram overlap",
-        total=len(grouped_comments),
-    ):
-        overlap_ratios[username] = calculate_overlap(comments, n)
+# Mean pairwise n-gram overlap without visiting pairs:
+# sum_{i<j} |A_i & A_j| = sum_g C(c_g, 2), where c_g counts the user's
+# comments containing n-gram g, and
+# sum_{i<j} |A_i | A_j| = (k - 1) * sum_i |A_i| - sum_{i<j} |A_i & A_j|
+def segment_ngram_overlap(texts, codes, n_segments, n=2):
+    from sklearn.feature_extraction.text import CountVectorizer
 
+    try:
+        ngrams = CountVectorizer(ngram_range=(n, n), binary=True).fit_transform(
+            texts
+        )
+    except ValueError:
+        # No comment has n tokens
+        return np.zeros(n_segments)
+
+    grouping = segment_matrix(codes, n_segments, np.int64)
+    containing = (grouping @ ngrams).tocsr()
+    rows = np.repeat(np.arange(n_segments), np.diff(containing.indptr))
+    c = containing.data.astype(np.float64)
+    intersections = np.bincount(rows, weights=c * (c - 1) / 2, minlength=n_segments)
+    sizes = grouping @ np.asarray(ngrams.sum(axis=1), dtype=np.float64).ravel()
+    counts = np.asarray(grouping.sum(axis=1)).ravel()
+    unions = (counts - 1) * sizes - intersections
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where((counts >= 2) & (unions > 0), intersections / unions, 0.0)
+
+
+def add_ngram_overlap(df, comments_df, n=2, user_codes=None):
+    if user_codes is None:
+        user_codes = user_segment_codes(comments_df)
+    codes, usernames = user_codes
     overlap_df = pd.DataFrame(
-        list(overlap_ratios.items()), columns=["username", "ngram_overlap"]
+        {
+            "username": usernames,
+            "ngram_overlap": segment_ngram_overlap(
+                comments_df["cleaned_body"], codes, len(usernames), n
+            ),
+        }
     )
 
     df = df.merge(overlap_df, on="username", how="left")
@@ -372,6 +500,7 @@ def add_ngram_overlap(df, comments_df, n=2):
 
     return df
 
+
 def average_score(df, comments_df):
     comments_df['score'] = comments_df['score'].fillna(0)
     avg_score_per_user = comments_df.groupby('username')['score'].mean().reset_index(name='avg_score')
@@ -392,92 +521,96 @@ def average_stickied(df, comments_df):
     df = df.merge(avg_stickied_per_user, on='username', how='left')
 
 # Label functions
+@lru_cache(maxsize=1)
+def single_char_emoji_pattern():
+    import emoji
+
+    # emoji.is_emoji(char) is membership in EMOJI_DATA
+    chars = sorted(e for e in emoji.EMOJI_DATA if len(e) == 1)
+    return "[" + "".join(re.escape(char) for char in chars) + "]"
+
+
 def count_slashes_and_emojis(comments_df):
     comments_df = comments_df.copy()
+    body = comments_df["body"].fillna("").astype(str)
 
-    def count_special_chars(text):
-        backslashes = text.count("/")
-        forwardslashes = text.count("/")
-        emojis = len([char for char in text if emoji.is_emoji(char)])
-        return backslashes + forwardslashes, emojis
-
-    comments_df[["slashes", "emojis"]] = comments_df["body"].apply(
-        lambda x: pd.Series(count_special_chars(x))
-    )
+    # "/" was always counted twice, once as a backslash and once as a slash
+    comments_df["slashes"] = body.str.count("/") * 2
+    comments_df["emojis"] = body.str.count(single_char_emoji_pattern())
     comments_df["slashes_emojis"] = comments_df["slashes"] + comments_df["emojis"]
 
     return comments_df
 
 
-def get_bot_usernames_from_comments(comments_df):
-    com = count_slashes_and_emojis(comments_df)
-    user_averages = (
-        com.groupby("username")
-        .agg({"emojis": "mean", "slashes": "mean", "slashes_emojis": "mean"})
-        .rename(
-            columns={
-                "emojis": "avg_emojis",
-                "slashes": "avg_slashes",
-                "slashes_emojis": "avg_slashes_emojis",
-            }
-        )
+def user_char_class_stats(comments_df):
+    com = count_slashes_and_emojis(comments_df[["username", "body"]])
+    return com.groupby("username").agg(
+        avg_emojis=("emojis", "mean"),
+        avg_slashes=("slashes", "mean"),
+        avg_slashes_emojis=("slashes_emojis", "mean"),
+        max_emojis=("emojis", "max"),
+        max_slashes=("slashes", "max"),
+        max_slashes_emojis=("slashes_emojis", "max"),
     )
 
-    filtered_users = user_averages[
-        (user_averages["avg_slashes"] > 6)
-        | (user_averages["avg_emojis"] > 5)
-        | (user_averages["avg_slashes_emojis"] > 8)
-    ]
 
-    users_with_high_slashes = com[com["slashes"] > 10]["username"].unique()
-    users_with_high_emojis = com[com["emojis"] > 10]["username"].unique()
-    users_with_high_slashes_emojis = com[com["slashes_emojis"] > 15][
-        "username"
-    ].unique()
-    unique_usernames = (
-        set(filtered_users.index)
-        | set(users_with_high_slashes)
-        | set(users_with_high_emojis)
-        | set(users_with_high_slashes_emojis)
-    )
+# Disjoint user shards, so per-shard aggregates concatenate without merging
+def user_shards(df, n_shards):
+    shard = pd.util.hash_array(df["username"].to_numpy(dtype=object)) % n_shards
+    return [df[shard == i] for i in range(n_shards)]
 
-    return list(unique_usernames)
 
+def get_bot_usernames_from_comments(comments_df, workers=1):
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
 
-def autolabel_bots(posts_df, comments_df, users_df):
-    df_combined = pd.concat(
-        [
-            posts_df[
-                ["username", "subreddit", "title", "text", "score", "upvote_ratio"]
-            ],
-            comments_df[["username", "subreddit", "body", "score"]],
-        ]
+        shards = user_shards(comments_df[["username", "body"]], workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            user_stats = pd.concat(executor.map(user_char_class_stats, shards))
+    else:
+        user_stats = user_char_class_stats(comments_df)
+
+    is_bot = (
+        (user_stats["avg_slashes"] > 6)
+        | (user_stats["avg_emojis"] > 5)
+        | (user_stats["avg_slashes_emojis"] > 8)
+        | (user_stats["max_slashes"] > 10)
+        | (user_stats["max_emojis"] > 10)
+        | (user_stats["max_slashes_emojis"] > 15)
     )
 
-    user_activity = (
-        df_combined.groupby("username")
-        .agg(
-            {
-                "title": "count",
-                "text": "count",
-                "body": "count",
-                "score": "mean",
-                "upvote_ratio": "mean",
-            }
-        )
-        .rename(
-            columns={
-                "title": "num_posts",
-                "text": "num_texts",
-                "body": "num_comments",
-                "score": "avg_score",
-                "upvote_ratio": "avg_upvote_ratio",
-            }
-        )
-        .fillna(0)
+    return list(user_stats.index[is_bot])
+
+
+def user_activity_stats(posts_df, comments_df):
+    posts = posts_df.groupby("username").agg(
+        num_posts=("title", "count"),
+        num_texts=("text", "count"),
+        post_score_sum=("score", "sum"),
+        post_score_count=("score", "count"),
+        avg_upvote_ratio=("upvote_ratio", "mean"),
+    )
+    comments = comments_df.groupby("username").agg(
+        num_comments=("body", "count"),
+        comment_score_sum=("score", "sum"),
+        comment_score_count=("score", "count"),
     )
+    user_activity = posts.join(comments, how="outer")
+    counts = user_activity[["post_score_count", "comment_score_count"]].sum(axis=1)
+    sums = user_activity[["post_score_sum", "comment_score_sum"]].sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        user_activity["avg_score"] = sums / counts.where(counts > 0)
+
+    return user_activity[
+        ["num_posts", "num_texts", "num_comments", "avg_score", "avg_upvote_ratio"]
+    ].fillna(0)
 
-    df_users = pd.merge(users_df, user_activity, on="username", how="left").fillna(0)
+
+def autolabel_bots(posts_df, comments_df, users_df):
+    user_activity = user_activity_stats(posts_df, comments_df)
+    df_users = pd.merge(
+        users_df, user_activity, left_on="username", right_index=True, how="left"
+    ).fillna(0)
 
     bot_usernames = [
         "bot",
@@ -491,62 +624,42 @@ def autolabel_bots(posts_df, comments_df, users_df):
         "info",
     ]
     username_pattern = re.compile(
-        r"\b(" + "|".join(bot_usernames) + r")\b", re.IGNORECASE
+        r"\b(?:" + "|".join(bot_usernames) + r")\b", re.IGNORECASE
     )
     username_with_digits_pattern = re.compile(
         r"[a-zA-Z]+[0-9]{5,}$"
     )  # e.g., "user123456"
 
-    def is_bot(row):
-        validaion_count = 0
-        validation_threshold = 3
-
-        # Username patterns
-        if username_pattern.search(
-            row["username"]
-        ) or username_with_digits_pattern.search(row["username"]):
-            return True
-
+    usernames = df_users["username"].astype(str)
+    activity = df_users["num_posts"] + df_users["num_comments"]
+    upvote_ratio = df_users["avg_upvote_ratio"]
+    validations = [
         # Account age with high activity
-        if row["account_age"] < 60 and row["num_posts"] + row["num_comments"] > 100:
-            validaion_count += 1
-
+        (df_users["account_age"] < 60) & (activity > 100),
         # Low karma
-        if row["link_karma"] < -30 or row["comment_karma"] < -30:
-            validaion_count += 1
-            if validaion_count > validation_threshold:
-                return True
-
+        (df_users["link_karma"] < -30) | (df_users["comment_karma"] < -30),
         # Frequent low scores indicating low engagement
-        if row["avg_score"] < 0.5 and row["num_posts"] + row["num_comments"] > 10:
-            validaion_count += 1
-            if validaion_count > validation_threshold:
-                return True
-
+        (df_users["avg_score"] < 0.5) & (activity > 10),
         # Consistent upvote ratios (either too low or too high)
-        if (row["avg_upvote_ratio"] < 0.05 or row["avg_upvote_ratio"] > 0.96) and row[
-            "avg_upvote_ratio"
-        ] != 0:
-            validaion_count += 1
-            if validaion_count > validation_threshold:
-                return True
-
+        ((upvote_ratio < 0.05) | (upvote_ratio > 0.96)) & (upvote_ratio != 0),
         # High comment-to-post ratio
-        if row["link_karma"] > 10 * row["comment_karma"]:
-            validaion_count += 1
-            if validaion_count > validation_threshold:
-                return True
-
-        return False
+        df_users["link_karma"] > 10 * df_users["comment_karma"],
+    ]
+    validation_count = sum(validation.astype(int) for validation in validations)
+    validation_threshold = 3
 
-    df_users["is_bot"] = df_users.apply(is_bot, axis=1)
+    df_users["is_bot"] = (
+        usernames.str.contains(username_pattern)
+        | usernames.str.contains(username_with_digits_pattern)
+        | (validation_count > validation_threshold)
+    )
 
     return df_users[["username", "is_bot"]]
 
 
-def mark_bots(posts_df, comments_df, users_df):
+def mark_bots(posts_df, comments_df, users_df, workers=1):
     print("Labeling bots...")
-    unique_usernames = get_bot_usernames_from_comments(comments_df)
+    unique_usernames = get_bot_usernames_from_comments(comments_df, workers)
     labeled_users = autolabel_bots(posts_df, comments_df, users_df)
 
     labeled_users.loc[labeled_users["username"].isin(unique_usernames), "is_bot"] = True
@@ -555,21 +668,459 @@ def mark_bots(posts_df, comments_df, users_df):
     return labeled_users
 
 
+# Shared intermediates, each computed once per run and only when a stage that
+# is not loaded from the cache needs it. Sources come from the caller:
+# comments, posts, dtype, tfidf, threads (thread store) and centroid.
+INTERMEDIATES = {
+    "text": {"func": add_cleaned_body, "inputs": ["comments"]},
+    "kernel": {"func": build_similarity_kernel, "inputs": ["text", "dtype", "tfidf"]},
+    "user_codes": {"func": user_segment_codes, "inputs": ["comments"]},
+    "ttr": {"func": comment_ttr, "inputs": ["text"]},
+    "flesch_kincaid_grade": {
+        "func": comment_flesch_kincaid_grades,
+        "inputs": ["text"],
+    },
+}
+# Stage argument each input is passed as; "text" is comments with cleaned_body
+STAGE_ARGUMENTS = {
+    "comments": "comments_df",
+    "text": "comments_df",
+    "posts": "posts_df",
+    "kernel": "kernel",
+    "threads": "store",
+    "centroid": "centroid",
+    "user_codes": "user_codes",
+    "ttr": "ttr",
+    "flesch_kincaid_grade": "grades",
+}
+
+# Feature stages: inputs they are computed from, feature columns they add,
+# comment/post columns they read (for cache keys), parameters and helpers
+TEXT_HELPERS = [clean_text, add_cleaned_body]
+SIMILARITY_HELPERS = TEXT_HELPERS + [
+    build_similarity_kernel,
+    SimilarityKernel,
+    segment_pairwise_mean,
+    segment_mean,
+    TfidfStore,
+]
+
+FEATURE_STAGES = [
+    {
+        "name": "avg_cosine_similarity",
+        "func": add_avg_cosine_similarity,
+        "inputs": ["text", "kernel", "user_codes"],
+        "outputs": ["avg_cosine_similarity"],
+        "comments": ["username", "body"],
+        "helpers": SIMILARITY_HELPERS + [is_weird_comment, remove_zwj],
+    },
+    {
+        "name": "all_users_similarity",
+        "func": add_all_users_similarity,
+        "inputs": ["text", "kernel", "centroid", "user_codes"],
+        "outputs": ["all_users_similarity"],
+        "comments": ["username", "body"],
+        "helpers": SIMILARITY_HELPERS
+        + [comment_centroid_similarity, sample_positions],
+    },
+    {
+        "name": "comment_length_metrics",
+        "func": add_comment_length_metrics,
+        "inputs": ["text"],
+        "outputs": ["avg_comment_length", "max_comment_length", "min_comment_length"],
+        "comments": ["username", "body"],
+        "helpers": TEXT_HELPERS,
+    },
+    {
+        "name": "comment_post_ratio",
+        "func": add_comment_post_ratio,
+        "inputs": ["comments", "posts"],
+        "outputs": ["comment_post_ratio"],
+        "comments": ["username"],
+        "posts": ["username"],
+    },
+    {
+        "name": "average_thread_depth",
+        "func": add_average_thread_depth,
+        "inputs": ["comments", "threads"],
+        "outputs": ["avg_thread_depth"],
+        "comments": ["username", "post_title", "id", "parent_id"],
+        "helpers": [comment_thread_depths, parent_positions, thread_depths],
+    },
+    {
+        "name": "parent_child_similarity",
+        "func": add_parent_child_similarity,
+        "inputs": ["text", "kernel"],
+        "outputs": ["parent_child_similarity"],
+        "comments": ["username", "post_title", "id", "parent_id", "body"],
+        "helpers": SIMILARITY_HELPERS + [parent_child_scores, parent_positions],
+    },
+    {
+        "name": "average_ttr",
+        "func": add_average_ttr,
+        "inputs": ["text", "ttr"],
+        "outputs": ["avg_ttr"],
+        "comments": ["username", "body"],
+        "helpers": TEXT_HELPERS + [comment_ttr, calculate_ttr],
+    },
+    {
+        "name": "average_flesch_kincaid_grade",
+        "func": add_average_flesch_kincaid_grade,
+        "inputs": ["text", "flesch_kincaid_grade"],
+        "outputs": ["avg_flesch_kincaid_grade"],
+        "comments": ["username", "body"],
+        "helpers": TEXT_HELPERS
+        + [comment_flesch_kincaid_grades, calculate_flesch_kincaid_grade],
+    },
+    {
+        "name": "ngram_overlap",
+        "func": add_ngram_overlap,
+        "inputs": ["text", "user_codes"],
+        "outputs": ["ngram_overlap"],
+        "comments": ["username", "body"],
+        "params": {"n": 2},
+        "helpers": TEXT_HELPERS + [segment_ngram_overlap, segment_matrix],
+    },
+    {
+        "name": "temporal_features",
+        "func": add_temporal_features,
+        "inputs": ["comments", "posts"],
+        "outputs": [
+            "mean_inter_arrival",
+            "cv_inter_arrival",
+            "hour_entropy",
+            "burst_count",
+            "min_inter_arrival",
+        ],
+        "comments": ["username", "date", "id"],
+        "posts": ["username", "date", "name"],
+        "helpers": [
+            unique_events,
+            build_user_time_index,
+            inter_arrival_stats,
+            hour_entropy,
+            segment_min,
+        ],
+    },
+    {
+        "name": "graph_features",
+        "func": add_graph_features,
+        # Needs every user's replies, so sharded runs compute it centrally
+        "global": True,
+        "inputs": ["comments"],
+        "outputs": [
+            "reply_out_degree",
+            "reply_in_degree",
+            "reply_reciprocity",
+            "subreddit_count",
+            "subreddit_entropy",
+            "reply_pagerank",
+        ],
+        "comments": ["username", "subreddit", "id", "parent_id"],
+        "helpers": [
+            build_user_subreddit_matrix,
+            build_reply_matrix,
+            subreddit_entropy,
+            reciprocity,
+            pagerank,
+        ],
+    },
+    {
+        "name": "link_features",
+        "func": add_link_features,
+        # Domain sharing is counted over all users
+        "global": True,
+        "inputs": ["comments", "posts"],
+        "outputs": ["link_rate", "domain_concentration", "shared_domain_share"],
+        "comments": ["username", "body"],
+        "posts": ["username", "text"],
+        "helpers": [
+            link_documents,
+            extract_domains,
+            build_domain_index,
+            domain_concentration,
+            domain_user_counts,
+            shared_domain_share,
+        ],
+    },
+    {
+        "name": "text_predictability",
+        "func": add_text_predictability,
+        # The n-gram counts cover the whole corpus
+        "global": True,
+        "inputs": ["text"],
+        "outputs": ["avg_log_prob", "std_log_prob"],
+        "comments": ["username", "body"],
+        "params": {"order": 3},
+        "helpers": TEXT_HELPERS
+        + [
+            NgramStore,
+            tokenize,
+            ngram_keys,
+            document_counts,
+            count_keys,
+            interpolation_weights,
+        ],
+    },
+    {
+        "name": "username_families",
+        "func": add_username_families,
+        # Families are formed across every author in the data
+        "global": True,
+        "inputs": ["comments", "posts"],
+        "outputs": [
+            "username_template_size",
+            "username_family",
+            "username_family_size",
+        ],
+        "comments": ["username"],
+        "posts": ["username"],
+        "helpers": [
+            username_families,
+            shape_signatures,
+            token_patterns,
+            deletion_hashes,
+            largest_buckets,
+        ],
+    },
+]
+
+
+def select_stages(names=None):
+    if names is None:
+        return FEATURE_STAGES
+    known = {stage["name"] for stage in FEATURE_STAGES}
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError(
+            f"Unknown feature stages {unknown}; available: {sorted(known)}"
+        )
+    return [stage for stage in FEATURE_STAGES if stage["name"] in names]
+
+
+# Per-comment values behind the mean-based features, for group snapshots
+def comment_values(comments_df, kernel, ttr=None, grades=None):
+    if ttr is None:
+        ttr = comment_ttr(comments_df)
+    if grades is None:
+        grades = comment_flesch_kincaid_grades(comments_df)
+    return {
+        "comment_length": comments_df["cleaned_body"].str.len().to_numpy(),
+        "thread_depth": comment_thread_depths(comments_df),
+        "all_users_similarity": comment_centroid_similarity(comments_df, kernel),
+        "parent_child_similarity": parent_child_scores(comments_df, kernel),
+        "ttr": ttr,
+        "flesch_kincaid_grade": grades,
+    }
+
+
+def create_feature_snapshots(
+    comments_df,
+    kernel=None,
+    dtype=np.float64,
+    path=SNAPSHOT_DIR,
+    tfidf=None,
+    ttr=None,
+    grades=None,
+):
+    if "cleaned_body" not in comments_df:
+        comments_df = add_cleaned_body(comments_df)
+    if kernel is None:
+        kernel = build_similarity_kernel(comments_df, dtype, tfidf)
+    index = build_group_index(comments_df)
+    snapshots = compute_snapshots(
+        comment_values(comments_df, kernel, ttr, grades), index
+    )
+    save_snapshots(snapshots, path)
+    print("Feature snapshots per subreddit and week created successfully.")
+
+    return snapshots
+
+
+# Stage columns that are means, minimums or maximums of the per-comment
+# values, so with snapshots they come from rolling up the partial aggregates
+ROLLUP_COLUMNS = {
+    "all_users_similarity": {"all_users_similarity": "all_users_similarity_mean"},
+    "comment_length_metrics": {
+        "avg_comment_length": "comment_length_mean",
+        "max_comment_length": "comment_length__max",
+        "min_comment_length": "comment_length__min",
+    },
+    "average_thread_depth": {"avg_thread_depth": "thread_depth_mean"},
+    "parent_child_similarity": {
+        "parent_child_similarity": "parent_child_similarity_mean"
+    },
+    "average_ttr": {"avg_ttr": "ttr_mean"},
+    "average_flesch_kincaid_grade": {
+        "avg_flesch_kincaid_grade": "flesch_kincaid_grade_mean"
+    },
+}
+
+
+# Per-user rows combined from the (user, subreddit) partials; collected
+# comments always carry their subreddit, so every comment is in one of them
+def user_rollup(snapshots):
+    return rollup(snapshots["subreddit"], by=["username"])
+
+
+def rollup_stage_node(stage, users_df):
+    columns = ROLLUP_COLUMNS[stage["name"]]
+
+    def compute(rolled_up):
+        out = users_df[["username"]].merge(
+            rolled_up[["username"] + list(columns.values())], on="username", how="left"
+        )
+        print(f"Stage {stage['name']} rolled up from snapshots.")
+        return out.rename(columns={value: key for key, value in columns.items()})[
+            ["username"] + stage["outputs"]
+        ]
+
+    return {"func": compute, "inputs": ["user_rollup"]}
+
+
+def stage_inputs(stage, resources):
+    return {
+        STAGE_ARGUMENTS[name]: resources[name]
+        for name in stage["inputs"]
+        if resources.get(name) is not None
+    }
+
+
+def stage_keys(stages, sources, users_df):
+    users_hash = hash_frame(users_df, ["username"])
+    frame_hashes = {}
+
+    def frame_hash(name, columns):
+        if (name, tuple(columns)) not in frame_hashes:
+            frame_hashes[(name, tuple(columns))] = hash_frame(sources[name], columns)
+        return frame_hashes[(name, tuple(columns))]
+
+    keys = {}
+    for stage in stages:
+        input_hashes = {
+            "users": users_hash,
+            "comments": frame_hash("comments", stage["comments"]),
+        }
+        if "posts" in stage:
+            input_hashes["posts"] = frame_hash("posts", stage["posts"])
+        if "kernel" in stage["inputs"]:
+            input_hashes["dtype"] = np.dtype(sources["dtype"]).name
+            if sources.get("tfidf") is not None:
+                input_hashes["tfidf"] = sources["tfidf"].fingerprint()
+        if "threads" in stage["inputs"] and sources.get("threads") is not None:
+            input_hashes["threads"] = sources["threads"].meta["hash"]
+        keys[stage["name"]] = stage_key(
+            stage["name"],
+            input_hashes,
+            hash_code([stage["func"]] + stage.get("helpers", [])),
+            stage.get("params", {}),
+            stage.get("version"),
+        )
+    return keys
+
+
+# Graph node of a stage: a frame of username and the stage's output columns
+def stage_node(stage, users_df, cache=None, key=None, cached=None):
+    if cached is not None:
+        # Already loaded from the cache, so no intermediates are computed for it
+        return {"func": lambda: cached, "inputs": []}
+    inputs = stage["inputs"]
+
+    def compute(*values):
+        kwargs = {
+            **stage_inputs({"inputs": inputs}, dict(zip(inputs, values))),
+            **stage.get("params", {}),
+        }
+        if cache is not None:
+            return cache.run_stage(stage["name"], stage["func"], users_df, key, **kwargs)
+        out = stage["func"](users_df[["username"]].copy(), **kwargs)
+        return out[["username"] + stage["outputs"]]
+
+    return {"func": compute, "inputs": inputs}
+
+
+def feature_nodes(stages, users_df, cache=None, keys=None, cached=None):
+    nodes = dict(INTERMEDIATES)
+    for stage in stages:
+        nodes[stage["name"]] = stage_node(
+            stage,
+            users_df,
+            cache,
+            (keys or {}).get(stage["name"]),
+            (cached or {}).get(stage["name"]),
+        )
+    return nodes
+
+
+# The single join of all stage outputs onto the users, in stage order
+def join_features(users_df, stage_frames):
+    if not stage_frames:
+        return users_df.copy()
+    features_df = users_df.set_index("username").join(
+        [frame.set_index("username") for frame in stage_frames], how="left"
+    )
+    return features_df.reset_index()[
+        list(users_df.columns)
+        + [column for frame in stage_frames for column in frame.columns[1:]]
+    ]
+
+
 # Main pipeline function
-def create_features_pipeline(posts_df, comments_df, users_df):
+def create_features_pipeline(
+    posts_df,
+    comments_df,
+    users_df,
+    cache=None,
+    dtype=np.float64,
+    store=None,
+    snapshot_dir=None,
+    tfidf=None,
+    stages=None,
+    workers=STAGE_WORKERS,
+):
     print("Creating features...")
-    comments_df = add_tfidf_vectors(comments_df)
-    features_df = users_df.copy()
-
-    features_df = add_avg_cosine_similarity(features_df, comments_df)
-    features_df = add_all_users_similarity(features_df, comments_df)
-    features_df = add_comment_length_metrics(features_df, comments_df)
-    features_df = add_comment_post_ratio(features_df, comments_df, posts_df)
-    features_df = add_average_thread_depth(features_df, comments_df)
-    features_df = add_parent_child_similarity(features_df, comments_df)
-    features_df = add_average_ttr(features_df, comments_df)
-    features_df = add_average_flesch_kincaid_grade(features_df, comments_df)
-    features_df = add_ngram_overlap(features_df, comments_df)
+    stages = select_stages(stages)
+    sources = {
+        "comments": comments_df,
+        "posts": posts_df,
+        "dtype": dtype,
+        "tfidf": tfidf,
+        "threads": store,
+        "centroid": None,
+    }
+    # With snapshots, the mean-based stages are rolled up from the same
+    # partial aggregates instead of being computed a second time
+    rolled_up = (
+        [stage for stage in stages if stage["name"] in ROLLUP_COLUMNS]
+        if snapshot_dir is not None
+        else []
+    )
+    computed = [stage for stage in stages if stage not in rolled_up]
+    keys = cached = None
+    if cache is not None:
+        keys = stage_keys(computed, sources, users_df)
+        # Only stages whose output actually loaded skip their inputs; an entry
+        # evicted or unreadable later would leave a stage without them
+        cached = {
+            stage["name"]: cache.load_stage(stage["name"], keys[stage["name"]])
+            for stage in computed
+        }
+    nodes = feature_nodes(computed, users_df, cache, keys, cached)
+    targets = [stage["name"] for stage in stages]
+    if snapshot_dir is not None:
+        nodes["snapshots"] = {
+            "func": lambda text, kernel, ttr, grades: create_feature_snapshots(
+                text, kernel, dtype, snapshot_dir, tfidf, ttr, grades
+            ),
+            "inputs": ["text", "kernel", "ttr", "flesch_kincaid_grade"],
+        }
+        nodes["user_rollup"] = {"func": user_rollup, "inputs": ["snapshots"]}
+        for stage in rolled_up:
+            nodes[stage["name"]] = rollup_stage_node(stage, users_df)
+        targets.append("snapshots")
+
+    results = run_graph(nodes, targets, sources, workers)
+    features_df = join_features(users_df, [results[stage["name"]] for stage in stages])
     # features_df = average_score(features_df, comments_df)
     # features_df = average_num_replies(features_df, comments_df)
     # features_df = average_stickied(features_df, comments_df)
@@ -589,20 +1140,125 @@ def save_data(df, file_path):
 
 # Main function
 def main(
-    comments_file_path, posts_file_path, users_file_path, x_file_path, y_file_path
+    comments_file_path,
+    posts_file_path,
+    users_file_path,
+    x_file_path,
+    y_file_path,
+    cache=None,
+    dtype=np.float64,
+    features=True,
+    labels=True,
+    threads_path=None,
+    snapshot_dir=None,
+    tfidf_path=None,
+    label_workers=1,
+    combined_file_path=None,
+    shards=None,
+    work_dir=WORK_DIR,
+    stages=None,
+    stage_workers=STAGE_WORKERS,
+    drift_dir=None,
+    text_archive_path=None,
 ):
     start = datetime.now()
     posts_df, comments_df, users_df = load_data(
         posts_file_path, comments_file_path, users_file_path
     )
-    x_df = create_features_pipeline(posts_df, comments_df, users_df)
-    y_df = mark_bots(posts_df, comments_df, users_df)
+    x_df = y_df = None
+    if features:
+        features_start = datetime.now()
+        store = None
+        if threads_path is not None:
+            store = open_thread_store(threads_path, comments_df)
+        tfidf = None
+        if tfidf_path is not None:
+            tfidf = TfidfStore(tfidf_path)
+            update_tfidf_store(tfidf, comments_df)
+        if shards:
+            x_df = run_coordinator(
+                posts_df,
+                comments_df,
+                users_df,
+                work_dir,
+                shards,
+                stages,
+                text_archive_path,
+            )
+        else:
+            x_df = create_features_pipeline(
+                posts_df,
+                comments_df,
+                users_df,
+                cache,
+                dtype,
+                store,
+                snapshot_dir,
+                tfidf,
+                stages,
+                stage_workers,
+            )
+        print("Feature time:", datetime.now() - features_start)
+        if combined_file_path is None:
+            save_data(x_df, x_file_path)
+    if labels:
+        labels_start = datetime.now()
+        y_df = mark_bots(posts_df, comments_df, users_df, label_workers)
+        print("Labeling time:", datetime.now() - labels_start)
+        if combined_file_path is None:
+            save_data(y_df, y_file_path)
+    # Features and the is_bot label in one frame, one row per user
+    if x_df is None:
+        combined_df = y_df
+    elif y_df is None:
+        combined_df = x_df
+    else:
+        combined_df = x_df.merge(y_df, on="username", how="left")
+    if combined_file_path is not None:
+        save_data(combined_df, combined_file_path)
+    if drift_dir is not None and combined_df is not None:
+        record_run(combined_df, comments_df, drift_dir)
 
-    save_data(x_df, x_file_path)
-    save_data(y_df, y_file_path)
     print("Data preprocessing completed successfully.")
     print("Time elapsed:", datetime.now() - start)
 
 
+def run(args, features=True, labels=True):
+    cache = None
+    if features and not args.no_cache:
+        cache = FeatureCache(
+            args.cache_dir or CACHE_DIR,
+            (args.cache_max_mb or CACHE_MAX_BYTES // 1024**2) * 1024**2,
+        )
+    main(
+        args.comments or comments_file_path,
+        args.posts or posts_file_path,
+        args.users or users_file_path,
+        args.features_file or x_file_path,
+        args.labels_file or y_file_path,
+        cache,
+        np.float32 if args.float32 else np.float64,
+        features,
+        labels,
+        args.threads,
+        args.snapshots,
+        args.tfidf_store,
+        args.label_workers or 1,
+        args.output,
+        args.shards,
+        args.work_dir or WORK_DIR,
+        args.stages,
+        args.stage_workers or STAGE_WORKERS,
+        None if args.no_drift else args.drift_dir or DRIFT_DIR,
+        args.text_archive,
+    )
+    if cache is not None and args.cache_stats:
+        cache.print_stats()
+
+
 if __name__ == "__main__":
-    main(comments_file_path, posts_file_path, users_file_path, x_file_path, y_file_path)
+    from cli import add_preprocessing_arguments
+
+    parser = argparse.ArgumentParser(description="Create features and labels.")
+    add_preprocessing_arguments(parser)
+    run(parser.parse_args())
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+WORK_DIR = "data/.cluster"
+SHARDS = 4
+WORKER_TIMEOUT = 24 * 3600
+PHASES = ["vocabulary", "features"]
+
+# Layout of the shared directory, which is the only channel between the
+# coordinator and the workers:
+#   manifest.json
+#   shard-<i>/users.parquet, posts.parquet
+#   shard-<i>/comments.parquet   the shard's own comments, unless the manifest
+#                                names a text archive partitioned by shard
+#   shard-<i>/context.parquet    ancestors of those comments owned by other shards
+#   shard-<i>/tfidf/             phase "vocabulary": shard document frequencies
+#   shard-<i>/features.parquet   phase "features": one row per shard user
+#   global/tfidf/, global/centroid.npy   results of the shuffle
+
+
+def shard_dir(work_dir, shard):
+    return os.path.join(work_dir, f"shard-{shard}")
+
+
+def global_dir(work_dir):
+    return os.path.join(work_dir, "global")
+
+
+def shard_of(usernames, n_shards):
+    return pd.util.hash_array(np.asarray(usernames, dtype=object)) % n_shards
+
+
+# Rows needed to walk every ancestor chain that starts in `rows`
+def ancestor_closure(parents, rows):
+    included = np.zeros(len(parents), dtype=bool)
+    included[rows] = True
+    frontier = np.asarray(rows)
+    while len(frontier):
+        ancestors = parents[frontier]
+        ancestors = np.unique(ancestors[ancestors >= 0])
+        frontier = ancestors[~included[ancestors]]
+        included[frontier] = True
+    return included
+
+
+# Coordinator
+def write_shards(posts_df, comments_df, users_df, work_dir, n_shards, text_archive_path=None):
+    from data_preprocessing import parent_positions
+
+    comments_df = comments_df.reset_index(drop=True)
+    comments_df["row"] = np.arange(len(comments_df))
+    users_df = users_df.reset_index(drop=True)
+    users_df["row"] = np.arange(len(users_df))
+    if text_archive_path is not None:
+        from text_archive import open_text_archive
+
+        # Partition i of the archive holds exactly the comments of shard i
+        open_text_archive(text_archive_path, comments_df, n_shards).close()
+
+    parents = parent_positions(comments_df)
+    comment_shards = shard_of(comments_df["username"], n_shards)
+    post_shards = shard_of(posts_df["username"], n_shards)
+    user_shards = shard_of(users_df["username"], n_shards)
+
+    for shard in range(n_shards):
+        path = shard_dir(work_dir, shard)
+        os.makedirs(path, exist_ok=True)
+        own = comment_shards == shard
+        context = ancestor_closure(parents, np.flatnonzero(own)) & ~own
+        users_df[user_shards == shard].to_parquet(os.path.join(path, "users.parquet"))
+        posts_df[post_shards == shard].to_parquet(os.path.join(path, "posts.parquet"))
+        if text_archive_path is None:
+            comments_df[own].to_parquet(os.path.join(path, "comments.parquet"))
+        comments_df[context].to_parquet(os.path.join(path, "context.parquet"))
+        print(
+            f"Shard {shard}: {(user_shards == shard).sum()} users, "
+            f"{own.sum()} comments, {context.sum()} context comments"
+        )
+
+
+def run_workers(work_dir, n_shards, phase):
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "worker",
+                work_dir,
+                str(shard),
+                phase,
+            ]
+        )
+        for shard in range(n_shards)
+    ]
+    deadline = time.monotonic() + WORKER_TIMEOUT
+    failed = []
+    for shard, process in enumerate(processes):
+        try:
+            code = process.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            code = None
+        if code != 0:
+            failed.append(shard)
+    if failed:
+        raise RuntimeError(f"Phase {phase} failed on shards {failed}")
+
+
+# Global pieces: merged document frequencies and the corpus sample centroid
+def shuffle(comments_df, work_dir, n_shards):
+    from data_preprocessing import clean_text, sample_positions
+    from similarity_kernel import SimilarityKernel
+    from tfidf_store import TfidfStore
+
+    tfidf = TfidfStore(os.path.join(shard_dir(work_dir, 0), "tfidf"))
+    for shard in range(1, n_shards):
+        tfidf.merge(TfidfStore(os.path.join(shard_dir(work_dir, shard), "tfidf")))
+    tfidf.save(os.path.join(global_dir(work_dir), "tfidf"))
+    tfidf.print_stats()
+
+    sample = comments_df["body"].iloc[sample_positions(len(comments_df))]
+    kernel = SimilarityKernel(sample.apply(clean_text), vectorizer=tfidf)
+    np.save(
+        os.path.join(global_dir(work_dir), "centroid.npy"),
+        kernel.centroid(kernel.matrix),
+    )
+
+
+def read_manifest(work_dir):
+    with open(os.path.join(work_dir, "manifest.json"), "r") as file:
+        return json.load(file)
+
+
+def merge_features(posts_df, comments_df, work_dir, n_shards):
+    from data_preprocessing import feature_nodes, join_features, select_stages
+    from stage_graph import run_graph
+
+    features_df = pd.concat(
+        [
+            pd.read_parquet(os.path.join(shard_dir(work_dir, shard), "features.parquet"))
+            for shard in range(n_shards)
+        ]
+    )
+    features_df = features_df.sort_values("row").drop(columns="row")
+    features_df = features_df.reset_index(drop=True)
+
+    stages = [
+        stage
+        for stage in select_stages(read_manifest(work_dir)["stages"])
+        if stage.get("global")
+    ]
+    results = run_graph(
+        feature_nodes(stages, features_df),
+        [stage["name"] for stage in stages],
+        {"comments": comments_df, "posts": posts_df, "dtype": np.float64, "tfidf": None},
+    )
+    return join_features(features_df, [results[stage["name"]] for stage in stages])
+
+
+def run_coordinator(
+    posts_df,
+    comments_df,
+    users_df,
+    work_dir=WORK_DIR,
+    n_shards=SHARDS,
+    stages=None,
+    text_archive_path=None,
+):
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(global_dir(work_dir))
+    if text_archive_path is not None:
+        text_archive_path = os.path.abspath(text_archive_path)
+    with open(os.path.join(work_dir, "manifest.json"), "w") as file:
+        json.dump(
+            {
+                "shards": n_shards,
+                "stages": stages,
+                "text_archive": text_archive_path,
+                "created": datetime.now().isoformat(),
+            },
+            file,
+        )
+
+    start = datetime.now()
+    write_shards(posts_df, comments_df, users_df, work_dir, n_shards, text_archive_path)
+    print("Partition time:", datetime.now() - start)
+    for phase in PHASES:
+        start = datetime.now()
+        run_workers(work_dir, n_shards, phase)
+        if phase == "vocabulary":
+            shuffle(comments_df, work_dir, n_shards)
+        print(f"Phase {phase} time:", datetime.now() - start)
+
+    features_df = merge_features(posts_df, comments_df, work_dir, n_shards)
+    print("All features created successfully.\n")
+    return features_df.where(pd.notnull(features_df), None)
+
+
+# Worker
+def read_own_comments(work_dir, shard):
+    text_archive_path = read_manifest(work_dir).get("text_archive")
+    if text_archive_path is None:
+        return pd.read_parquet(os.path.join(shard_dir(work_dir, shard), "comments.parquet"))
+    from text_archive import TextArchive
+
+    # Only the blocks of the shard's partition are decompressed
+    archive = TextArchive(text_archive_path)
+    try:
+        return archive.read(partition=shard)
+    finally:
+        archive.close()
+
+
+def run_vocabulary(work_dir, shard):
+    from data_preprocessing import clean_text
+    from tfidf_store import TfidfStore
+
+    path = shard_dir(work_dir, shard)
+    comments_df = read_own_comments(work_dir, shard)
+    tfidf = TfidfStore()
+    tfidf.partial_fit(comments_df["body"].apply(clean_text))
+    tfidf.save(os.path.join(path, "tfidf"))
+
+
+def run_features(work_dir, shard):
+    from data_preprocessing import feature_nodes, join_features, select_stages
+    from stage_graph import run_graph
+    from tfidf_store import TfidfStore
+
+    path = shard_dir(work_dir, shard)
+    users_df = pd.read_parquet(os.path.join(path, "users.parquet"))
+    posts_df = pd.read_parquet(os.path.join(path, "posts.parquet"))
+    own_df = read_own_comments(work_dir, shard)
+    context_df = pd.read_parquet(os.path.join(path, "context.parquet"))
+    tfidf = TfidfStore(os.path.join(global_dir(work_dir), "tfidf"))
+    centroid = np.load(os.path.join(global_dir(work_dir), "centroid.npy"))
+
+    # Context rows only complete thread trees; they belong to users of other
+    # shards, so the per-user merges leave them out of the shard's features
+    comments_df = pd.concat([own_df, context_df]).sort_values("row")
+    stages = [
+        stage
+        for stage in select_stages(read_manifest(work_dir)["stages"])
+        if not stage.get("global")
+    ]
+    results = run_graph(
+        feature_nodes(stages, users_df),
+        [stage["name"] for stage in stages],
+        {
+            "comments": comments_df.reset_index(drop=True),
+            "posts": posts_df,
+            "dtype": np.float64,
+            "tfidf": tfidf,
+            "threads": None,
+            "centroid": centroid,
+        },
+    )
+    features_df = join_features(users_df, [results[stage["name"]] for stage in stages])
+    features_df.to_parquet(os.path.join(path, "features.parquet"))
+
+
+def run_worker(work_dir, shard, phase):
+    start = datetime.now()
+    if phase == "vocabulary":
+        run_vocabulary(work_dir, shard)
+    else:
+        run_features(work_dir, shard)
+    print(f"Shard {shard} finished phase {phase} in {datetime.now() - start}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Sharded feature computation over a shared directory."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run one shard of a phase.")
+    worker_parser.add_argument("work_dir")
+    worker_parser.add_argument("shard", type=int)
+    worker_parser.add_argument("phase", choices=PHASES)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_worker(args.work_dir, args.shard, args.phase)
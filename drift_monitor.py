@@ -0,0 +1,414 @@
+import argparse
+import base64
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+DRIFT_DIR = "data/drift"
+# Quantile buckets grow geometrically, so any quantile is known to within 1%
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# Values closer to zero than this share the zero bucket
+MIN_MAGNITUDE = 1e-9
+KEY_OFFSET = int(np.ceil(-np.log(MIN_MAGNITUDE) / np.log(GAMMA))) + 1
+# HyperLogLog with 2**10 registers, about 3% error on distinct counts
+HLL_PRECISION = 10
+# Set bits of each byte value, for counting bits without np.bitwise_count
+# (NumPy 2 only)
+BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+PSI_BINS = 10
+PSI_EPSILON = 1e-4
+# Usual PSI reading: below 0.1 stable, up to 0.25 moderate, above major
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+
+
+# Bucket key of each value: 0 for (near) zero, otherwise sign * index of its
+# logarithmic bucket, so keys are ordered like the values
+def bucket_keys(values):
+    magnitude = np.abs(values)
+    index = np.ceil(
+        np.log(np.maximum(magnitude, MIN_MAGNITUDE)) / np.log(GAMMA)
+    ).astype(np.int64) + KEY_OFFSET
+    return np.where(magnitude < MIN_MAGNITUDE, 0, np.sign(values).astype(np.int64) * index)
+
+
+def bucket_values(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    # Midpoint of the bucket (GAMMA^(i-1), GAMMA^i] in relative terms
+    magnitude = 2 * GAMMA ** (np.abs(keys) - KEY_OFFSET) / (GAMMA + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+
+# HyperLogLog registers: the first bits of each hash pick a register, which
+# keeps the longest run of leading zeros seen in the remaining bits
+def hll_registers(values):
+    registers = np.zeros(2**HLL_PRECISION, dtype=np.uint8)
+    if len(values) == 0:
+        return registers
+    hashes = pd.util.hash_array(np.asarray(values))
+    index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    # A set bit below the remaining bits caps the run at 64 - HLL_PRECISION
+    rest = (hashes << np.uint64(HLL_PRECISION)) | np.uint64(1 << (HLL_PRECISION - 1))
+    for shift in (1, 2, 4, 8, 16, 32):
+        rest |= rest >> np.uint64(shift)
+    set_bits = BYTE_POPCOUNT[rest.view(np.uint8)].reshape(len(rest), 8).sum(axis=1)
+    leading = 64 - set_bits.astype(np.int64)
+    np.maximum.at(registers, index, (leading + 1).astype(np.uint8))
+    return registers
+
+
+def hll_estimate(registers):
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m**2 / np.sum(2.0 ** -registers.astype(np.float64))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros > 0:
+        # Linear counting is more accurate for small cardinalities
+        estimate = m * np.log(m / zeros)
+    return float(estimate)
+
+
+def encode_array(values, dtype):
+    return base64.b64encode(zlib.compress(np.asarray(values, dtype=dtype).tobytes())).decode(
+        "ascii"
+    )
+
+
+def decode_array(text, dtype):
+    return np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=dtype)
+
+
+# Stored form of a sketch: arrays as compressed base64, bucket keys as
+# differences, which are mostly 1
+def encode_sketch(sketch):
+    return {
+        **sketch,
+        "keys": encode_array(np.diff(sketch["keys"], prepend=0), np.int32),
+        "counts": encode_array(sketch["counts"], np.int32),
+        "hll": encode_array(sketch["hll"], np.uint8),
+    }
+
+
+def decode_sketch(stored):
+    return {
+        **stored,
+        "keys": np.cumsum(decode_array(stored["keys"], np.int32), dtype=np.int64),
+        "counts": decode_array(stored["counts"], np.int32).astype(np.int64),
+        "hll": decode_array(stored["hll"], np.uint8),
+    }
+
+
+# Mergeable summary of one column: counts, moments, extremes, sparse
+# quantile buckets and distinct-count registers
+def column_sketch(values):
+    values = np.asarray(values, dtype=np.float64)
+    present = values[~np.isnan(values)]
+    keys, counts = np.unique(bucket_keys(present), return_counts=True)
+    return {
+        "count": int(len(present)),
+        "nulls": int(len(values) - len(present)),
+        "sum": float(present.sum()),
+        "min": float(present.min()) if len(present) else None,
+        "max": float(present.max()) if len(present) else None,
+        "keys": keys,
+        "counts": counts,
+        "hll": hll_registers(present),
+    }
+
+
+def merge_sketches(sketches):
+    sketches = list(sketches)
+    keys, inverse = np.unique(
+        np.concatenate([s["keys"] for s in sketches]), return_inverse=True
+    )
+    counts = np.bincount(
+        inverse, weights=np.concatenate([s["counts"] for s in sketches]), minlength=len(keys)
+    )
+    extremes = [s for s in sketches if s["count"]]
+    return {
+        "count": sum(s["count"] for s in sketches),
+        "nulls": sum(s["nulls"] for s in sketches),
+        "sum": sum(s["sum"] for s in sketches),
+        "min": min((s["min"] for s in extremes), default=None),
+        "max": max((s["max"] for s in extremes), default=None),
+        "keys": keys,
+        "counts": counts.astype(np.int64),
+        "hll": np.maximum.reduce([s["hll"] for s in sketches]),
+    }
+
+
+def sketch_quantiles(sketch, quantiles):
+    counts = sketch["counts"]
+    if counts.sum() == 0:
+        return np.full(len(quantiles), np.nan)
+    position = np.searchsorted(np.cumsum(counts), np.asarray(quantiles) * counts.sum())
+    position = np.minimum(position, len(counts) - 1)
+    # Bucket midpoints can fall just outside the values seen
+    return np.clip(bucket_values(sketch["keys"][position]), sketch["min"], sketch["max"])
+
+
+# Share of values in buckets up to and including each key
+def sketch_cdf(sketch, keys):
+    counts = sketch["counts"]
+    if counts.sum() == 0:
+        return np.zeros(len(keys))
+    cumulative = np.concatenate([[0], np.cumsum(counts)]) / counts.sum()
+    return cumulative[np.searchsorted(sketch["keys"], keys, side="right")]
+
+
+# Kolmogorov-Smirnov distance at bucket resolution
+def ks_statistic(baseline, current):
+    keys = np.union1d(baseline["keys"], current["keys"])
+    if len(keys) == 0:
+        return np.nan
+    return float(np.max(np.abs(sketch_cdf(baseline, keys) - sketch_cdf(current, keys))))
+
+
+# Population stability index over the baseline's deciles, with missing
+# values as one more bin
+def psi(baseline, current, bins=PSI_BINS):
+    if baseline["count"] == 0:
+        return np.nan
+    edges = np.unique(
+        bucket_keys(sketch_quantiles(baseline, np.arange(1, bins) / bins))
+    )
+    shares = []
+    for sketch in (baseline, current):
+        total = sketch["count"] + sketch["nulls"]
+        if total == 0:
+            return np.nan
+        cdf = np.concatenate([[0.0], sketch_cdf(sketch, edges), [1.0]])
+        shares.append(
+            np.append(np.diff(cdf) * sketch["count"], sketch["nulls"]) / total
+        )
+    expected, actual = (np.maximum(share, PSI_EPSILON) for share in shares)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+# Each user falls into the subreddit they comment in most
+def main_subreddits(comments_df):
+    counts = comments_df.groupby(["username", "subreddit"]).size().reset_index(name="n")
+    counts = counts.sort_values(["username", "n"], ascending=[True, False])
+    return counts.drop_duplicates("username").set_index("username")["subreddit"]
+
+
+# Feature frames hold None for missing values, so columns may be object
+def numeric_frame(df):
+    numeric = df.drop(columns="username").apply(pd.to_numeric, errors="coerce")
+    columns = [
+        column
+        for column in numeric.columns
+        if pd.api.types.is_numeric_dtype(df[column]) or numeric[column].notna().any()
+    ]
+    return numeric[columns].astype(np.float64)
+
+
+def sketch_run(df, comments_df=None):
+    values = numeric_frame(df)
+    groups = {"all": values}
+    if comments_df is not None:
+        subreddits = df["username"].map(main_subreddits(comments_df))
+        for subreddit, group in values.groupby(subreddits.to_numpy(), sort=True):
+            groups[f"subreddit={subreddit}"] = group
+    return {
+        name: {
+            column: encode_sketch(column_sketch(group[column])) for column in group.columns
+        }
+        for name, group in groups.items()
+    }
+
+
+def run_path(path, run_id):
+    return os.path.join(path, f"{run_id}.json")
+
+
+def list_runs(path=DRIFT_DIR):
+    if not os.path.isdir(path):
+        return []
+    return sorted(name[: -len(".json")] for name in os.listdir(path) if name.endswith(".json"))
+
+
+def record_run(df, comments_df=None, path=DRIFT_DIR, run_id=None):
+    created = datetime.now(timezone.utc)
+    run_id = run_id or created.strftime("%Y%m%dT%H%M%S")
+    run = {
+        "run": run_id,
+        "created": created.isoformat(),
+        "rows": len(df),
+        "groups": sketch_run(df, comments_df),
+    }
+    os.makedirs(path, exist_ok=True)
+    tmp_path = run_path(path, run_id) + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(run, file, separators=(",", ":"))
+    os.replace(tmp_path, run_path(path, run_id))
+    print(f"Drift sketches for run {run_id} saved to {path}")
+    return run_id
+
+
+def load_run(run_id, path=DRIFT_DIR):
+    with open(run_path(path, run_id), "r") as file:
+        return json.load(file)
+
+
+# Several runs combined into one, e.g. as a baseline; only the given groups
+# are decoded
+def merge_runs(runs, groups=None):
+    merged = {}
+    for run in runs:
+        for group, columns in run["groups"].items():
+            if groups is not None and group not in groups:
+                continue
+            for column, sketch in columns.items():
+                merged.setdefault(group, {}).setdefault(column, []).append(
+                    decode_sketch(sketch)
+                )
+    return {
+        group: {
+            column: merge_sketches(sketches) if len(sketches) > 1 else sketches[0]
+            for column, sketches in columns.items()
+        }
+        for group, columns in merged.items()
+    }
+
+
+def sketch_mean(sketch):
+    return sketch["sum"] / sketch["count"] if sketch["count"] else np.nan
+
+
+def null_rate(sketch):
+    total = sketch["count"] + sketch["nulls"]
+    return sketch["nulls"] / total if total else np.nan
+
+
+def compare_runs(baseline_groups, current_groups):
+    rows = []
+    for group in sorted(current_groups):
+        if group not in baseline_groups:
+            continue
+        for column, current in current_groups[group].items():
+            baseline = baseline_groups[group].get(column)
+            if baseline is None:
+                continue
+            rows.append(
+                {
+                    "group": group,
+                    "column": column,
+                    "psi": psi(baseline, current),
+                    "ks": ks_statistic(baseline, current),
+                    "baseline_mean": sketch_mean(baseline),
+                    "current_mean": sketch_mean(current),
+                    "baseline_nulls": null_rate(baseline),
+                    "current_nulls": null_rate(current),
+                    "baseline_distinct": hll_estimate(baseline["hll"]),
+                    "current_distinct": hll_estimate(current["hll"]),
+                    "current_count": current["count"],
+                }
+            )
+    drift_df = pd.DataFrame(rows)
+    if len(drift_df):
+        drift_df["status"] = np.select(
+            [drift_df["psi"] >= PSI_MAJOR, drift_df["psi"] >= PSI_MODERATE],
+            ["major", "moderate"],
+            "stable",
+        )
+        drift_df = drift_df.sort_values("psi", ascending=False, ignore_index=True)
+    return drift_df
+
+
+# Current run against the merge of the runs before it (the previous one by
+# default)
+def compare(path=DRIFT_DIR, current=None, baselines=None, last=1, groups=None):
+    runs = list_runs(path)
+    current = current or (runs[-1] if runs else None)
+    if current is None:
+        raise ValueError(f"No drift sketches in {path}")
+    if baselines is None:
+        earlier = [run for run in runs if run < current]
+        baselines = earlier[-last:]
+    if not baselines:
+        raise ValueError(f"No run before {current} to compare with")
+    baseline_groups = merge_runs((load_run(run, path) for run in baselines), groups)
+    current_groups = merge_runs([load_run(current, path)], groups)
+    return compare_runs(baseline_groups, current_groups), current, baselines
+
+
+def print_drift(drift_df, current, baselines, limit=30):
+    print(f"Drift of run {current} against {', '.join(baselines)}")
+    if drift_df.empty:
+        print("No columns in common.")
+        return
+    counts = drift_df["status"].value_counts()
+    print(
+        f"{len(drift_df)} columns compared: {counts.get('major', 0)} major, "
+        f"{counts.get('moderate', 0)} moderate"
+    )
+    columns = [
+        "group",
+        "column",
+        "psi",
+        "ks",
+        "baseline_mean",
+        "current_mean",
+        "current_nulls",
+        "status",
+    ]
+    print(
+        drift_df[columns]
+        .head(limit)
+        .to_string(index=False, float_format="{:.4g}".format)
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Feature and label drift between runs.")
+    parser.add_argument("--dir", default=DRIFT_DIR, help="Directory of run sketches.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="List recorded runs.")
+
+    record_parser = subparsers.add_parser(
+        "record", help="Sketch an existing features (or combined) CSV."
+    )
+    record_parser.add_argument("features_file")
+    record_parser.add_argument("--labels-file", default=None)
+    record_parser.add_argument(
+        "--comments", default=None, help="Comments CSV, for per-subreddit sketches."
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two runs.")
+    compare_parser.add_argument("--current", default=None, help="Run id, latest if unset.")
+    compare_parser.add_argument("--baseline", nargs="+", default=None, help="Run ids.")
+    compare_parser.add_argument(
+        "--last", type=int, default=1, help="Merge this many earlier runs as baseline."
+    )
+    compare_parser.add_argument("--groups", nargs="+", default=None)
+    compare_parser.add_argument("--limit", type=int, default=30)
+    compare_parser.add_argument("--output", default=None, help="Write all rows to CSV.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "list":
+        for run_id in list_runs(args.dir):
+            print(run_id)
+    elif args.command == "record":
+        df = pd.read_csv(args.features_file)
+        if args.labels_file is not None:
+            df = df.merge(pd.read_csv(args.labels_file), on="username", how="left")
+        comments_df = None
+        if args.comments is not None:
+            comments_df = pd.read_csv(args.comments, usecols=["username", "subreddit"])
+        record_run(df, comments_df, args.dir)
+    else:
+        drift_df, current, baselines = compare(
+            args.dir, args.current, args.baseline, args.last, args.groups
+        )
+        print_drift(drift_df, current, baselines, args.limit)
+        if args.output is not None:
+            drift_df.to_csv(args.output, index=False)
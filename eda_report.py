@@ -0,0 +1,599 @@
+import argparse
+import html
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from drift_monitor import (
+    bucket_keys,
+    column_sketch,
+    hll_estimate,
+    ks_statistic,
+    merge_sketches,
+    numeric_frame,
+    sketch_cdf,
+    sketch_quantiles,
+)
+from feature_cache import hash_code, stage_key
+
+FEATURES_FILE = "data/features.csv"
+REPORT_FILE = "data/eda_stream_report.html"
+EDA_CACHE_DIR = "data/.eda_cache"
+CHUNK_SIZE = 500_000
+# Rows kept per class for the scatter plots
+SAMPLE_PER_CLASS = 1000
+HISTOGRAM_BINS = 30
+# Features with the largest bot/human separation get scatter plots
+SCATTER_FEATURES = 4
+TARGET = "is_bot"
+SEED = 42
+CLASS_COLORS = {
+    "human": "#ff9999",
+    "bot": "#66b3ff",
+    "unlabelled": "#bbbbbb",
+    "all": "#66b3ff",
+}
+CLASSES = {True: "bot", False: "human", "True": "bot", "False": "human"}
+
+
+# Arrow parses CSV blocks on all cores. Column types come from the first rows,
+# so a column that starts empty is not typed as null for the whole file.
+def read_csv_chunks(path, chunk_size=CHUNK_SIZE):
+    import pyarrow as pa
+    from pyarrow import csv
+
+    sniff = pd.read_csv(path, nrows=10_000)
+    column_types = {
+        column: pa.from_numpy_dtype(dtype)
+        if pd.api.types.is_numeric_dtype(dtype)
+        else pa.string()
+        for column, dtype in sniff.dtypes.items()
+    }
+    reader = csv.open_csv(
+        path,
+        read_options=csv.ReadOptions(block_size=64 * 1024**2),
+        convert_options=csv.ConvertOptions(column_types=column_types),
+    )
+    batches = []
+    rows = 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_size:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+# Feature chunks with the label joined on; labels are two columns per user,
+# so they are read in full
+def read_chunks(features_file, labels_file=None, chunk_size=CHUNK_SIZE):
+    labels = None
+    if labels_file is not None:
+        labels = (
+            pd.read_csv(labels_file, usecols=["username", TARGET])
+            .drop_duplicates("username")
+            .set_index("username")[TARGET]
+        )
+    for chunk in read_csv_chunks(features_file, chunk_size):
+        if labels is not None:
+            chunk[TARGET] = chunk["username"].map(labels)
+        yield chunk
+
+
+def class_names(chunk):
+    if TARGET not in chunk:
+        return np.full(len(chunk), "all", dtype=object)
+    return chunk[TARGET].map(CLASSES).fillna("unlabelled").to_numpy(dtype=object)
+
+
+# Everything the report needs, accumulated chunk by chunk: quantile sketches
+# and moments per class and column, pairwise co-moments for correlations,
+# and a class-stratified random sample
+class ReportStats:
+    def __init__(self, sample_size=SAMPLE_PER_CLASS, seed=SEED):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.columns = None
+        self.rows = 0
+        self.class_rows = {}
+        self.sketches = {}
+        self.moments = {}
+        self.comoments = None
+        self.sample = None
+
+    def update(self, chunk):
+        values = numeric_frame(chunk)
+        if self.columns is None:
+            self.columns = list(values.columns)
+        values = values.reindex(columns=self.columns)
+        matrix = values.to_numpy(dtype=np.float64)
+        present = ~np.isnan(matrix)
+        filled = np.where(present, matrix, 0.0)
+        weights = present.astype(np.float64)
+        # Sums over the rows where both columns of a pair are present
+        comoments = {
+            "n": weights.T @ weights,
+            "sx": filled.T @ weights,
+            "sxx": (filled**2).T @ weights,
+            "sxy": filled.T @ filled,
+        }
+        if self.comoments is None:
+            self.comoments = comoments
+        else:
+            self.comoments = {
+                name: self.comoments[name] + comoments[name] for name in comoments
+            }
+
+        classes = class_names(chunk)
+        for name in np.unique(classes):
+            rows = classes == name
+            self.class_rows[name] = self.class_rows.get(name, 0) + int(rows.sum())
+            moments = np.stack(
+                [
+                    weights[rows].sum(axis=0),
+                    filled[rows].sum(axis=0),
+                    (filled[rows] ** 2).sum(axis=0),
+                ]
+            )
+            self.moments[name] = self.moments.get(name, 0) + moments
+            sketches = self.sketches.setdefault(name, {})
+            for i, column in enumerate(self.columns):
+                sketch = column_sketch(matrix[rows, i])
+                if column in sketches:
+                    sketch = merge_sketches([sketches[column], sketch])
+                sketches[column] = sketch
+
+        # The rows with the smallest random priorities in each class are a
+        # uniform sample of it, however the table is chunked
+        candidates = values.assign(
+            _class=classes, _priority=self.rng.random(len(values))
+        )
+        if self.sample is not None:
+            candidates = pd.concat([self.sample, candidates], ignore_index=True)
+        self.sample = (
+            candidates.sort_values("_priority", kind="stable")
+            .groupby("_class", sort=False)
+            .head(self.sample_size)
+            .reset_index(drop=True)
+        )
+        self.rows += len(chunk)
+
+    @property
+    def features(self):
+        return [column for column in self.columns if column != TARGET]
+
+    def total_sketch(self, column):
+        return merge_sketches(sketches[column] for sketches in self.sketches.values())
+
+    def class_moments(self, name):
+        count, total, squares = self.moments[name]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            std = np.sqrt(np.maximum(squares / count - mean**2, 0))
+        return pd.DataFrame(
+            {"count": count, "mean": mean, "std": std}, index=self.columns
+        )
+
+    # Pearson correlation of each pair over the rows where both are present
+    def correlations(self):
+        n, sx, sxx, sxy = (self.comoments[name] for name in ["n", "sx", "sxx", "sxy"])
+        variance = n * sxx - sx**2
+        # Constant columns leave only rounding error in the variance
+        variance = np.where(variance > 1e-12 * n * sxx, variance, np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation = (n * sxy - sx * sx.T) / np.sqrt(variance * variance.T)
+        return pd.DataFrame(
+            np.clip(correlation, -1, 1), index=self.columns, columns=self.columns
+        )
+
+
+def compute_stats(
+    features_file, labels_file=None, chunk_size=CHUNK_SIZE, sample_size=SAMPLE_PER_CLASS
+):
+    stats = ReportStats(sample_size)
+    for chunk in read_chunks(features_file, labels_file, chunk_size):
+        stats.update(chunk)
+    return stats
+
+
+# Formatting helpers
+def format_number(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (int, np.integer)) or float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:.4g}"
+
+
+def html_table(df):
+    header = "".join(f"<th>{html.escape(str(column))}</th>" for column in df.columns)
+    rows = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{html.escape(value) if isinstance(value, str) else format_number(value)}</td>"
+            for value in row
+        )
+        + "</tr>"
+        for row in df.itertuples(index=False)
+    )
+    return f"<table><tr>{header}</tr>{rows}</table>"
+
+
+# Heavy-tailed counts (karma, ages, gaps in seconds) are plotted on log1p axes
+def uses_log_scale(sketch):
+    return sketch["min"] is not None and sketch["min"] >= 0 and sketch["max"] > 1000
+
+
+def histogram_edges(sketch, bins=HISTOGRAM_BINS):
+    low, high = sketch_quantiles(sketch, [0.005, 0.995])
+    if uses_log_scale(sketch):
+        return np.expm1(np.linspace(np.log1p(low), np.log1p(high), bins + 1))
+    if high <= low:
+        high = low + 1
+    return np.linspace(low, high, bins + 1)
+
+
+# Share of each class in each bin, read from the sketches at bucket
+# resolution; values outside the edges count in the outer bins
+def histogram_shares(sketch, edges):
+    if sketch["count"] == 0:
+        return np.zeros(len(edges) - 1)
+    cdf = sketch_cdf(sketch, bucket_keys(edges[1:-1]))
+    return np.diff(np.concatenate([[0.0], cdf, [1.0]]))
+
+
+def svg_histogram(edges, shares, log_scale=False, width=360, height=120):
+    top = max((values.max() for values in shares.values()), default=0) or 1
+    bar = width / (len(edges) - 1)
+    bars = []
+    for name, values in shares.items():
+        for i, value in enumerate(values):
+            bar_height = value / top * (height - 4)
+            bars.append(
+                f'<rect x="{i * bar:.1f}" y="{height - bar_height:.1f}" '
+                f'width="{bar:.1f}" height="{bar_height:.1f}" '
+                f'fill="{CLASS_COLORS.get(name, "#999999")}" fill-opacity="0.6"/>'
+            )
+    axis = f"{format_number(edges[0])} … {format_number(edges[-1])}" + (
+        " (log scale)" if log_scale else ""
+    )
+    return (
+        f'<svg width="{width}" height="{height + 16}">{"".join(bars)}'
+        f'<text x="0" y="{height + 13}" font-size="11">{html.escape(axis)}</text></svg>'
+    )
+
+
+def svg_scatter(sample, x, y, log_x=False, log_y=False, size=280):
+    def scaled(values, log_scale):
+        values = values.to_numpy(dtype=np.float64)
+        if log_scale:
+            values = np.log1p(np.maximum(values, 0))
+        low, high = np.nanquantile(values, [0.01, 0.99]) if np.isfinite(values).any() else (0, 1)
+        if high <= low:
+            high = low + 1
+        return np.clip((values - low) / (high - low), 0, 1) * (size - 8) + 4
+
+    points = sample[[x, y, "_class"]].dropna()
+    xs, ys = scaled(points[x], log_x), size - scaled(points[y], log_y)
+    circles = "".join(
+        f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="2" '
+        f'fill="{CLASS_COLORS.get(name, "#999999")}" fill-opacity="0.5"/>'
+        for cx, cy, name in zip(xs, ys, points["_class"])
+    )
+    return (
+        f'<figure><svg width="{size}" height="{size}" style="border:1px solid #ddd">'
+        f"{circles}</svg><figcaption>{html.escape(x)} × {html.escape(y)}"
+        f"</figcaption></figure>"
+    )
+
+
+# Report sections: each renders one block of HTML from the statistics
+def render_overview(stats):
+    classes = pd.DataFrame(
+        {
+            "class": list(stats.class_rows),
+            "rows": list(stats.class_rows.values()),
+        }
+    ).sort_values("class")
+    classes["share"] = classes["rows"] / stats.rows
+    legend = " ".join(
+        f'<span style="color:{CLASS_COLORS.get(name, "#999999")}">■ {name}</span>'
+        for name in classes["class"]
+    )
+    return (
+        f"<p>{stats.rows:,} rows, {len(stats.features)} numeric features.</p>"
+        f"{html_table(classes)}<p>{legend}</p>"
+    )
+
+
+def render_columns(stats, bins=HISTOGRAM_BINS):
+    blocks = []
+    for column in stats.features:
+        sketch = stats.total_sketch(column)
+        summary = pd.DataFrame(
+            [
+                {
+                    "count": sketch["count"],
+                    "missing": sketch["nulls"] / max(sketch["count"] + sketch["nulls"], 1),
+                    "distinct ≈": round(hll_estimate(sketch["hll"])),
+                    "min": sketch["min"],
+                    **dict(
+                        zip(
+                            ["p5", "median", "p95"],
+                            sketch_quantiles(sketch, [0.05, 0.5, 0.95]),
+                        )
+                    ),
+                    "max": sketch["max"],
+                }
+            ]
+        )
+        histogram = ""
+        if sketch["count"]:
+            edges = histogram_edges(sketch, bins)
+            shares = {
+                name: histogram_shares(sketches[column], edges)
+                for name, sketches in sorted(stats.sketches.items())
+            }
+            histogram = svg_histogram(edges, shares, uses_log_scale(sketch))
+        blocks.append(
+            f'<div class="column"><h3>{html.escape(column)}</h3>'
+            f"{html_table(summary)}{histogram}</div>"
+        )
+    return "".join(blocks)
+
+
+# Bot/human separation per feature, largest first
+def class_separation(stats):
+    if "bot" not in stats.sketches or "human" not in stats.sketches:
+        return pd.Series(dtype=np.float64)
+    return pd.Series(
+        {
+            column: ks_statistic(
+                stats.sketches["human"][column], stats.sketches["bot"][column]
+            )
+            for column in stats.features
+        }
+    ).sort_values(ascending=False)
+
+
+def render_classes(stats):
+    separation = class_separation(stats)
+    columns = list(separation.index) or stats.features
+    table = pd.DataFrame({"feature": columns})
+    if len(separation):
+        table["KS bot vs human"] = separation.to_numpy()
+    for name in sorted(stats.sketches):
+        moments = stats.class_moments(name).loc[columns]
+        table[f"{name} mean"] = moments["mean"].to_numpy()
+        table[f"{name} median"] = [
+            sketch_quantiles(stats.sketches[name][column], [0.5])[0] for column in columns
+        ]
+        table[f"{name} std"] = moments["std"].to_numpy()
+    return html_table(table)
+
+
+def correlation_color(value):
+    if np.isnan(value):
+        return "#ffffff"
+    channel = int(255 * (1 - min(abs(value), 1)))
+    return f"rgb(255,{channel},{channel})" if value > 0 else f"rgb({channel},{channel},255)"
+
+
+def render_correlations(stats):
+    correlation = stats.correlations()
+    blocks = []
+    if TARGET in correlation:
+        target = correlation[TARGET].drop(TARGET)
+        ranked = target.reindex(target.abs().sort_values(ascending=False).index)
+        blocks.append(
+            f"<h3>Correlation with {TARGET}</h3>"
+            + html_table(
+                pd.DataFrame({"feature": ranked.index, "pearson": ranked.to_numpy()})
+            )
+        )
+    header = "".join(
+        f'<th class="rotate"><div>{html.escape(column)}</div></th>'
+        for column in correlation.columns
+    )
+    rows = "".join(
+        f"<tr><th>{html.escape(row)}</th>"
+        + "".join(
+            f'<td style="background:{correlation_color(value)}" '
+            f'title="{html.escape(row)} × {html.escape(column)}: '
+            f'{format_number(value) or "n/a"}"></td>'
+            for column, value in correlation.loc[row].items()
+        )
+        + "</tr>"
+        for row in correlation.index
+    )
+    blocks.append(
+        '<h3>Pairwise correlations</h3><table class="heatmap">'
+        f"<tr><th></th>{header}</tr>{rows}</table>"
+    )
+    return "".join(blocks)
+
+
+def render_samples(stats, features=SCATTER_FEATURES):
+    separation = class_separation(stats)
+    columns = list(separation.index[:features]) or stats.features[:features]
+    sample_sizes = stats.sample["_class"].value_counts().sort_index()
+    plots = []
+    for x, y in zip(columns[::2], columns[1::2]):
+        plots.append(
+            svg_scatter(
+                stats.sample,
+                x,
+                y,
+                uses_log_scale(stats.total_sketch(x)),
+                uses_log_scale(stats.total_sketch(y)),
+            )
+        )
+    counts = ", ".join(f"{count:,} {name}" for name, count in sample_sizes.items())
+    return f"<p>Stratified sample: {counts}.</p>" + "".join(plots)
+
+
+SECTIONS = [
+    {"name": "overview", "title": "Overview", "func": render_overview},
+    {
+        "name": "columns",
+        "title": "Feature distributions",
+        "func": render_columns,
+        "params": {"bins": HISTOGRAM_BINS},
+        "helpers": [histogram_edges, histogram_shares, svg_histogram, uses_log_scale],
+    },
+    {
+        "name": "classes",
+        "title": "Per-class statistics",
+        "func": render_classes,
+        "helpers": [class_separation],
+    },
+    {"name": "correlations", "title": "Correlations", "func": render_correlations},
+    {
+        "name": "samples",
+        "title": "Sampled scatter plots",
+        "func": render_samples,
+        "params": {"features": SCATTER_FEATURES},
+        "helpers": [class_separation, svg_scatter, uses_log_scale],
+    },
+]
+STYLE = """
+body { font-family: sans-serif; margin: 2em; color: #222; }
+table { border-collapse: collapse; font-size: 12px; margin: 0.5em 0; }
+td, th { border: 1px solid #ddd; padding: 2px 6px; text-align: right; }
+.column { display: inline-block; vertical-align: top; margin: 0 1.5em 1.5em 0; }
+.heatmap td { width: 14px; height: 14px; padding: 0; }
+th.rotate { height: 140px; white-space: nowrap; vertical-align: bottom; }
+th.rotate div { transform: rotate(-60deg); width: 14px; }
+figure { display: inline-block; margin: 0 1em 1em 0; font-size: 12px; }
+"""
+
+
+def input_fingerprint(paths):
+    return [
+        [os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+        for path in paths
+        if path is not None
+    ]
+
+
+def read_cached(path):
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def write_cached(path, data):
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+# Sections are cached by the input files, their code and parameters; the
+# statistics are only streamed when some section is not cached
+def build_report(
+    features_file=FEATURES_FILE,
+    labels_file=None,
+    output=REPORT_FILE,
+    cache_dir=EDA_CACHE_DIR,
+    chunk_size=CHUNK_SIZE,
+    sample_size=SAMPLE_PER_CLASS,
+):
+    start = time.perf_counter()
+    inputs = {"files": input_fingerprint([features_file, labels_file])}
+    stats_key = stage_key(
+        "eda_stats",
+        inputs,
+        hash_code([ReportStats, read_chunks, class_names, numeric_frame, column_sketch]),
+        {"sample_size": sample_size, "seed": SEED},
+    )
+
+    def cache_path(key, extension):
+        return None if cache_dir is None else os.path.join(cache_dir, f"{key}.{extension}")
+
+    stats = None
+
+    def load_stats():
+        nonlocal stats
+        if stats is None:
+            cached = read_cached(cache_path(stats_key, "pkl"))
+            if cached is not None:
+                stats = pickle.loads(cached)
+            else:
+                stats_start = time.perf_counter()
+                stats = compute_stats(features_file, labels_file, chunk_size, sample_size)
+                print(
+                    f"Streamed {stats.rows:,} rows in "
+                    f"{time.perf_counter() - stats_start:.2f}s"
+                )
+                write_cached(cache_path(stats_key, "pkl"), pickle.dumps(stats))
+        return stats
+
+    blocks = []
+    for section in SECTIONS:
+        params = section.get("params", {})
+        key = stage_key(
+            section["name"],
+            {"stats": stats_key},
+            hash_code([section["func"]] + section.get("helpers", [])),
+            params,
+        )
+        cached = read_cached(cache_path(key, "html"))
+        section_start = time.perf_counter()
+        if cached is None:
+            body = section["func"](load_stats(), **params)
+            write_cached(cache_path(key, "html"), body.encode())
+        else:
+            body = cached.decode()
+        print(
+            f"Section {section['name']}: {'cached' if cached is not None else 'built'} "
+            f"in {time.perf_counter() - section_start:.2f}s"
+        )
+        blocks.append(f'<h2>{section["title"]}</h2>{body}')
+
+    report = (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>EDA report</title>"
+        f"<style>{STYLE}</style></head><body><h1>EDA report: "
+        f"{html.escape(os.path.basename(features_file))}</h1>{''.join(blocks)}"
+        "</body></html>"
+    )
+    write_cached(output, report.encode())
+    print(f"EDA report saved to {output} in {time.perf_counter() - start:.2f}s")
+    return output
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render a static EDA report.")
+    parser.add_argument("features_file", nargs="?", default=FEATURES_FILE)
+    parser.add_argument(
+        "--labels-file", default=None, help="Labels CSV, unless is_bot is a column."
+    )
+    parser.add_argument("--output", default=REPORT_FILE)
+    parser.add_argument("--cache-dir", default=EDA_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--sample-size", type=int, default=SAMPLE_PER_CLASS, help="Rows per class."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_report(
+        args.features_file,
+        args.labels_file,
+        args.output,
+        None if args.no_cache else args.cache_dir,
+        args.chunk_size,
+        args.sample_size,
+    )
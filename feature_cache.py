@@ -0,0 +1,185 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+CACHE_DIR = "data/.feature_cache"
+CACHE_MAX_BYTES = 2 * 1024**3
+INDEX_FILE = "index.json"
+
+
+# Hashing helpers
+def hash_frame(df, columns=None):
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    digest = hashlib.sha256()
+    digest.update(",".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def hash_code(funcs):
+    digest = hashlib.sha256()
+    for func in funcs:
+        try:
+            digest.update(inspect.getsource(func).encode())
+        except (OSError, TypeError):
+            digest.update(func.__qualname__.encode())
+    return digest.hexdigest()
+
+
+def stage_key(name, input_hashes, code_hash, params, version=None):
+    payload = json.dumps(
+        {
+            "stage": name,
+            "inputs": input_hashes,
+            "code": code_hash,
+            "version": version,
+            "params": params,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FeatureCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+        self.time_spent = 0.0
+        self.stage_stats = {}
+        # Stages run in threads share the index
+        self.lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key):
+        with self.lock:
+            entry = self.index.get(key)
+            path = self._path(key)
+            if entry is None or not os.path.isfile(path):
+                return None
+            try:
+                df = pd.read_parquet(path)
+            except Exception:
+                self._remove(key)
+                return None
+            entry["last_used"] = time.time()
+            self._save_index()
+            return df
+
+    def put(self, key, df, stage, seconds):
+        path = self._path(key)
+        df.to_parquet(path, index=False)
+        with self.lock:
+            self.index[key] = {
+                "stage": stage,
+                "bytes": os.path.getsize(path),
+                "seconds": seconds,
+                "last_used": time.time(),
+            }
+            self._evict()
+            self._save_index()
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        path = self._path(key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def _evict(self):
+        total = sum(entry["bytes"] for entry in self.index.values())
+        for key, entry in sorted(
+            self.index.items(), key=lambda item: item[1]["last_used"]
+        ):
+            if total <= self.max_bytes:
+                break
+            total -= entry["bytes"]
+            self._remove(key)
+
+    def _record(self, stage, hit, seconds):
+        with self.lock:
+            stats = self.stage_stats.setdefault(
+                stage, {"hits": 0, "misses": 0, "seconds": 0.0}
+            )
+            if hit:
+                self.hits += 1
+                self.time_saved += seconds
+                stats["hits"] += 1
+            else:
+                self.misses += 1
+                self.time_spent += seconds
+                stats["misses"] += 1
+            stats["seconds"] += seconds
+
+    # A stage's cached output columns, or None when the entry is missing
+    def load_stage(self, name, key):
+        cached = self.get(key)
+        if cached is None:
+            return None
+        with self.lock:
+            seconds = self.index[key]["seconds"]
+        self._record(name, True, seconds)
+        print(f"Stage {name} loaded from cache.")
+        return cached
+
+    # Run a stage or load its output columns from the cache
+    def run_stage(self, name, func, df, key, **kwargs):
+        cached = self.load_stage(name, key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        out = func(df[["username"]].copy(), **kwargs)
+        seconds = time.perf_counter() - start
+
+        new_columns = [column for column in out.columns if column != "username"]
+        result = out[["username"] + new_columns].reset_index(drop=True)
+        self.put(key, result, name, seconds)
+        self._record(name, False, seconds)
+
+        return result
+
+    def size(self):
+        return sum(entry["bytes"] for entry in self.index.values())
+
+    def print_stats(self):
+        print("Feature cache statistics:")
+        print(f"  Cache directory: {self.cache_dir}")
+        print(
+            f"  Entries: {len(self.index)} ({self.size() / 1024**2:.1f} MB"
+            f" of {self.max_bytes / 1024**2:.0f} MB)"
+        )
+        for stage, stats in self.stage_stats.items():
+            status = "hit" if stats["hits"] else "miss"
+            print(f"  {stage}: {status} ({stats['seconds']:.2f}s)")
+        print(f"  Hits: {self.hits}, misses: {self.misses}")
+        print(f"  Time spent computing: {self.time_spent:.2f}s")
+        print(f"  Time saved by cache: {self.time_saved:.2f}s\n")
@@ -2,56 +2,100 @@ import configparser
 import csv
 import functools
 import os
+import queue
+import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import pandas as pd
-import praw
 from prawcore.exceptions import TooManyRequests
 from tqdm import tqdm
-from dotenv import load_dotenv
-
-import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 
-load_dotenv(override=True)
+from concurrency import AdaptiveConcurrency, map_adaptive
 
 # config = configparser.ConfigParser()
 # config.read("config.ini")
 
-reddit = praw.Reddit(
-    client_id=os.getenv('BOTLOGIN'),
-    client_secret=os.getenv('BOTSECRET'), 
-    password=os.getenv('PASSWORD'),
-    user_agent='lab7',
-    username=os.getenv('LOGIN'),
-)
-
 DIRECTORY = "data"
 TIME_FILTER = "month"
 STEP = 999
 LIMIT = 1000
 FETCHED_SUBREDDITS_FILE = f"{DIRECTORY}/fetched_subreddits.txt"
 FETCHED_USERS_FILE = f"{DIRECTORY}/fetched_users.txt"
+REFETCH_STATE_FILE = f"{DIRECTORY}/refetch_state.csv"
+# Profiles and histories of redditors are cached here across runs, None disables it
+HTTP_CACHE_FILE = f"{DIRECTORY}/http_cache.sqlite"
+QUEUE_SIZE = 1000
+DONE = object()
 
-MAX_WORKERS = os.cpu_count()
-print(f"Max workers: {MAX_WORKERS}")
+# Worker concurrency is adapted to API latency and 429s, between these bounds
+INITIAL_WORKERS = 4
+MAX_WORKERS = 64
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 SERVICE_ACCOUNT_FILE = 'amc-data-apikey.json'
 DRIVE_FOLDER_URL = 'https://drive.google.com/drive/folders/1ZpvINF1r_vgOk8IAsWoVIt_yhWChKpCA'
 DRIVE_FOLDER_ID = re.search(r'/folders/([a-zA-Z0-9_-]+)', DRIVE_FOLDER_URL).group(1)
 
-if not os.path.exists(SERVICE_ACCOUNT_FILE):
-    print('Please download the API key file from Google Cloud Console and save it as amc-data-apikey.json')
-    exit()
+SUBREDDITS = [
+    "funny",
+    "AskReddit",
+    "gaming",
+    "worldnews",
+    "todayilearned",
+]
+
+
+# Clients are built on first use so importing this module has no side effects
+@functools.lru_cache(maxsize=None)
+def get_reddit():
+    import praw
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+    # REDDIT_API_URL points the collector at a local stand-in (mock_reddit_api.py)
+    api_url = os.getenv('REDDIT_API_URL')
+    endpoints = {'oauth_url': api_url, 'reddit_url': api_url} if api_url else {}
+    session = get_http_cache()
+    if session is not None:
+        endpoints['requestor_kwargs'] = {'session': session}
+    return praw.Reddit(
+        client_id=os.getenv('BOTLOGIN'),
+        client_secret=os.getenv('BOTSECRET'),
+        password=os.getenv('PASSWORD'),
+        user_agent='lab7',
+        username=os.getenv('LOGIN'),
+        **endpoints,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_cache():
+    from http_cache import CachedSession
+
+    if HTTP_CACHE_FILE is None:
+        return None
+    return CachedSession(HTTP_CACHE_FILE)
+
+
+@functools.lru_cache(maxsize=None)
+def get_controller():
+    return AdaptiveConcurrency(INITIAL_WORKERS, max_limit=MAX_WORKERS)
+
+
+@functools.lru_cache(maxsize=None)
+def get_drive_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    if not os.path.exists(SERVICE_ACCOUNT_FILE):
+        raise SystemExit('Please download the API key file from Google Cloud Console and save it as amc-data-apikey.json')
+
+    credentials = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    return build('drive', 'v3', credentials=credentials)
 
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('drive', 'v3', credentials=credentials)
 
 I = 0
 
@@ -76,7 +120,6 @@ def retry(exceptions, tries=4, delay=3, backoff=2):
     return decorator_retry
 
 
-@retry(TooManyRequests)
 def process_submission(submission, subreddit):
     
     post_data = {
@@ -118,9 +161,8 @@ def process_submission(submission, subreddit):
     return post_data, comments, users
 
 
-@retry(TooManyRequests)
 def process_user(username):
-    user = reddit.redditor(username)
+    user = get_reddit().redditor(username)
     try:
         user_data = {
             "username": username,
@@ -131,6 +173,8 @@ def process_user(username):
             ).days,
             "is_verified": user.has_verified_email,
         }
+    except TooManyRequests:
+        raise
     except:
         user_data = {
             "username": username,
@@ -142,9 +186,8 @@ def process_user(username):
     return user_data
 
 
-@retry(TooManyRequests)
 def fetch_user_activity(username):
-    user = reddit.redditor(username)
+    user = get_reddit().redditor(username)
     submissions = []
     comments = []
 
@@ -200,39 +243,40 @@ def get_posts_for_subreddit(subreddit: str):
     users = []
 
     submissions = list(
-        reddit.subreddit(subreddit).top(time_filter=TIME_FILTER, limit=LIMIT)
+        get_reddit().subreddit(subreddit).top(time_filter=TIME_FILTER, limit=LIMIT)
     )
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(process_submission, submission, subreddit)
-            for submission in submissions
-        ]
-
-        counter = 0
-
-        for future in tqdm(
-            as_completed(futures),
-            total=len(futures),
-            desc=f"Processing submissions for {subreddit}",
-        ):
-            post_data, comment_data, users_list = future.result()
-            posts.append(post_data)
-            comments.extend(comment_data)
-            users.extend(users_list)
-            counter += 1
-            
-
-            if counter % STEP == 0:
-                posts_df = pd.DataFrame(posts)
-                comments_df = pd.DataFrame(comments)
-                save_data(posts_df, comments_df, None, DIRECTORY, subreddit)
-
-                posts = []
-                comments = []
-                posts_df = None
-                comments_df = None
-
+    controller = get_controller()
+    counter = 0
+
+    for _, future in tqdm(
+        map_adaptive(
+            controller,
+            functools.partial(process_submission, subreddit=subreddit),
+            submissions,
+            TooManyRequests,
+        ),
+        total=len(submissions),
+        desc=f"Processing submissions for {subreddit}",
+    ):
+        post_data, comment_data, users_list = future.result()
+        posts.append(post_data)
+        comments.extend(comment_data)
+        users.extend(users_list)
+        counter += 1
+        
+
+        if counter % STEP == 0:
+            posts_df = pd.DataFrame(posts)
+            comments_df = pd.DataFrame(comments)
+            save_data(posts_df, comments_df, None, DIRECTORY, subreddit)
+
+            posts = []
+            comments = []
+            posts_df = None
+            comments_df = None
+
+    controller.print_metrics()
     return posts, comments, users
 
 
@@ -259,80 +303,259 @@ def mark_user_as_fetched(username):
         file.write(f"{username}\n")
 
 
-def get_user_data(users): # posts, comments
+# With a scheduler, users is a refetch plan and already fetched users are
+# fetched again; each fetch is recorded against the run's budget
+def get_user_data(users, subreddit, scheduler=None, budget=None): # posts, comments
     fetched_users = get_fetched_users()
     # users = get_users_from_data(posts, comments)
     users = set(users)
-    users_to_fetch = users - fetched_users
+    users_to_fetch = users if scheduler is not None else users - fetched_users
+    profiles = {}
+    activity_counts = {}
 
     user_data = []
     user_posts = []
     user_comments = []
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_user, user) for user in users_to_fetch]
-
-        counter = 0
-
-        for future in tqdm(
-            as_completed(futures), total=len(futures), desc="Processing user data"
-        ):
-            user_data.append(future.result())
-
-            counter += 1
+    # Both phases share one controller, so the second starts at the learned limit
+    controller = get_controller()
+    counter = 0
+
+    for user, future in tqdm(
+        map_adaptive(controller, process_user, users_to_fetch, TooManyRequests),
+        total=len(users_to_fetch),
+        desc="Processing user data",
+    ):
+        user_data.append(future.result())
+        profiles[user] = user_data[-1]
+
+        counter += 1
+
+        if counter % STEP == 0:
+            user_df = pd.DataFrame(user_data)
+            save_data(None, None, user_df, DIRECTORY, subreddit)
+
+            user_data = []
+            user_df = None
+
+    counter = 0
+
+    for user, future in tqdm(
+        map_adaptive(controller, fetch_user_activity, users_to_fetch, TooManyRequests),
+        total=len(users_to_fetch),
+        desc="Fetching user activity",
+    ):
+        user_submissions, user_comments_data = future.result()
+        activity_counts[user] = (len(user_submissions), len(user_comments_data))
+        user_posts.extend(user_submissions)
+        user_comments.extend(user_comments_data)
+
+        counter += 1
+
+        if counter % STEP == 0:
+            posts_df = pd.DataFrame(user_posts)
+            comments_df = pd.DataFrame(user_comments)
+            save_data(posts_df, comments_df, None, DIRECTORY, subreddit)
+
+            user_posts = []
+            user_comments = []
+            posts_df = None
+            comments_df = None
+
+    controller.print_metrics()
+
+    if scheduler is not None:
+        for user, counts in activity_counts.items():
+            scheduler.record(profiles[user], *counts, budget)
+        if scheduler.path is not None:
+            scheduler.save()
+        if budget is not None:
+            budget.print_summary()
 
-            if counter % STEP == 0:
-                user_df = pd.DataFrame(user_data)
-                save_data(None, None, user_df, DIRECTORY, subreddit)
+    user_df = pd.DataFrame(user_data)
+    user_posts_df = pd.DataFrame(user_posts)
+    user_comments_df = pd.DataFrame(user_comments)
 
-                user_data = []
-                user_df = None
+    # Refreshed users are already in the file
+    for user in users_to_fetch - fetched_users:
+        mark_user_as_fetched(user)
 
-        futures = [
-            executor.submit(fetch_user_activity, user) for user in users_to_fetch
-        ]
+    return user_df, user_posts_df, user_comments_df
 
-        counter = 0
 
-        for future in tqdm(
-            as_completed(futures), total=len(futures), desc="Fetching user activity"
-        ):
-            user_submissions, user_comments_data = future.result()
-            user_posts.extend(user_submissions)
-            user_comments.extend(user_comments_data)
+def list_submissions(subreddit, submissions_queue, controller):
+    seen_ids = set()
+    while True:
+        try:
+            # Pages are handed on as PRAW fetches them
+            for submission in get_reddit().subreddit(subreddit).top(
+                time_filter=TIME_FILTER, limit=LIMIT
+            ):
+                if submission.id not in seen_ids:
+                    seen_ids.add(submission.id)
+                    submissions_queue.put(submission)
+            return
+        except TooManyRequests as e:
+            delay = controller.on_throttle()
+            print(f"{e}, listing restarts in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def process_submissions(subreddit, submissions_queue, users_queue, results_queue, seen_users, seen_lock, controller, errors):
+    while True:
+        submission = submissions_queue.get()
+        if submission is DONE:
+            return
+        try:
+            post_data, comment_data, users_list = controller.call(
+                process_submission, submission, subreddit, retry_on=TooManyRequests
+            )
+        except Exception as e:
+            print(f"Skipping submission {submission.id}: {e}")
+            errors.append(e)
+            continue
+        results_queue.put(("submission", (post_data, comment_data)))
+
+        # Authors are queued for fetching as soon as they are first seen
+        for user in users_list:
+            with seen_lock:
+                if user in seen_users:
+                    continue
+                seen_users.add(user)
+            users_queue.put(user)
+
+
+def process_users(users_queue, results_queue, controller, errors):
+    while True:
+        user = users_queue.get()
+        if user is DONE:
+            return
+        try:
+            user_data = controller.call(process_user, user, retry_on=TooManyRequests)
+            activity = controller.call(fetch_user_activity, user, retry_on=TooManyRequests)
+        except Exception as e:
+            # Not marked as fetched, so it is retried on the next run
+            print(f"Skipping user {user}: {e}")
+            errors.append(e)
+            continue
+        results_queue.put(("user", (user, user_data, activity)))
+
+
+def run_stage(target, args, workers, on_finish, errors):
+    def worker():
+        try:
+            target(*args)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    def finish():
+        for thread in threads:
+            thread.join()
+        on_finish()
+
+    finisher = threading.Thread(target=finish, daemon=True)
+    finisher.start()
+    return finisher
+
+
+def main(subreddit: str, seen_users=None, scheduler=None):
+    if seen_users is None:
+        seen_users = get_fetched_users()
+    controller = get_controller()
+    seen_lock = threading.Lock()
+    errors = []
+
+    submissions_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    users_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    results_queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    # listing -> comment trees -> user profiles and histories
+    run_stage(
+        list_submissions,
+        (subreddit, submissions_queue, controller),
+        1,
+        lambda: [submissions_queue.put(DONE) for _ in range(MAX_WORKERS)],
+        errors,
+    )
+    run_stage(
+        process_submissions,
+        (subreddit, submissions_queue, users_queue, results_queue, seen_users, seen_lock, controller, errors),
+        MAX_WORKERS,
+        lambda: [users_queue.put(DONE) for _ in range(MAX_WORKERS)],
+        errors,
+    )
+    run_stage(
+        process_users,
+        (users_queue, results_queue, controller, errors),
+        MAX_WORKERS,
+        lambda: results_queue.put(DONE),
+        errors,
+    )
 
-            counter += 1
+    posts = []
+    comments = []
+    user_data = []
+    user_posts = []
+    user_comments = []
+    counters = {"submission": 0, "user": 0}
+    progress = tqdm(desc=f"Collecting {subreddit}", unit="item")
+
+    while True:
+        item = results_queue.get()
+        if item is DONE:
+            break
+        kind, result = item
+        counters[kind] += 1
+        progress.update()
+        progress.set_postfix(
+            submissions=counters["submission"],
+            users=counters["user"],
+            limit=controller.current_limit,
+        )
 
-            if counter % STEP == 0:
-                posts_df = pd.DataFrame(user_posts)
-                comments_df = pd.DataFrame(user_comments)
-                save_data(posts_df, comments_df, None, DIRECTORY, subreddit)
+        if kind == "submission":
+            post_data, comment_data = result
+            posts.append(post_data)
+            comments.extend(comment_data)
 
+            if counters[kind] % STEP == 0:
+                save_data(pd.DataFrame(posts), pd.DataFrame(comments), None, DIRECTORY, subreddit)
+                posts = []
+                comments = []
+        else:
+            user, data, (submissions_data, comments_data) = result
+            user_data.append(data)
+            user_posts.extend(submissions_data)
+            user_comments.extend(comments_data)
+            mark_user_as_fetched(user)
+            if scheduler is not None:
+                scheduler.record(data, len(submissions_data), len(comments_data))
+
+            if counters[kind] % STEP == 0:
+                save_data(pd.DataFrame(user_posts), pd.DataFrame(user_comments), pd.DataFrame(user_data), DIRECTORY, subreddit)
+                user_data = []
                 user_posts = []
                 user_comments = []
-                posts_df = None
-                comments_df = None
-
-    user_df = pd.DataFrame(user_data)
-    user_posts_df = pd.DataFrame(user_posts)
-    user_comments_df = pd.DataFrame(user_comments)
-
-    for user in users_to_fetch:
-        mark_user_as_fetched(user)
 
-    return user_df, user_posts_df, user_comments_df
-
-
-def main(subreddit: str):
-    posts, comments, users = get_posts_for_subreddit(subreddit)
+    progress.close()
+    if scheduler is not None:
+        scheduler.save()
+    if errors:
+        print(f"{len(errors)} items failed and were skipped")
+    controller.print_metrics()
     print(
-        f"Found {len(posts)} posts and {len(comments)} comments for subreddit {subreddit}\n"
+        f"Found {counters['submission']} posts and {counters['user']} new users for subreddit {subreddit}\n"
     )
 
     posts_df = pd.DataFrame(posts)
     comments_df = pd.DataFrame(comments)
-
-    user_df, user_posts_df, user_comments_df = get_user_data(users)
+    user_df = pd.DataFrame(user_data)
+    user_posts_df = pd.DataFrame(user_posts)
+    user_comments_df = pd.DataFrame(user_comments)
 
     combined_posts_df = pd.concat([posts_df, user_posts_df]).drop_duplicates(
         subset=["name"]
@@ -348,8 +571,10 @@ def upload_csv_to_drive(file_path, folder_id):
         'name': os.path.basename(file_path),
         'parents': [folder_id]
     }
+    from googleapiclient.http import MediaFileUpload
+
     media = MediaFileUpload(file_path, mimetype='text/csv')
-    file = service.files().create(
+    file = get_drive_service().files().create(
         body=file_metadata,
         media_body=media,
         fields='id'
@@ -405,33 +630,55 @@ def get_fetched_subreddits():
         return set(line.strip() for line in file)
 
 
-if __name__ == "__main__":
+def run(subreddits=SUBREDDITS):
     start = datetime.now()
+    print(f"Workers: {INITIAL_WORKERS} initial, {MAX_WORKERS} max")
+    get_drive_service()
 
     if not os.path.isdir(DIRECTORY):
         os.mkdir(DIRECTORY)
         print(f"Directory {DIRECTORY} created")
 
-    fetched_subreddits = get_fetched_subreddits()
+    from refetch_scheduler import RefetchScheduler
 
-    subreddits = [
-        "funny",
-        "AskReddit",
-        "gaming",
-        "worldnews",
-        "todayilearned",
-    ]
+    fetched_subreddits = get_fetched_subreddits()
+    seen_users = get_fetched_users()
+    scheduler = RefetchScheduler(REFETCH_STATE_FILE)
 
     for subreddit in subreddits:
         if subreddit in fetched_subreddits:
             print(f"Subreddit {subreddit} already fetched. Skipping.")
             continue
 
-        posts_df, comments_df, user_df = main(subreddit)
+        posts_df, comments_df, user_df = main(subreddit, seen_users, scheduler)
         save_data(posts_df, comments_df, user_df, DIRECTORY, subreddit)
         mark_subreddit_as_fetched(subreddit)
         print(f"Data processed for subreddit {subreddit}\n")
         print(f"Time elapsed for subreddit {subreddit}: {datetime.now() - start}")
 
     print("All data saved successfully\n")
+    if get_http_cache() is not None:
+        get_http_cache().print_stats()
     print(f"Time elapsed (final): {datetime.now() - start}")
+
+
+# Spends a request budget on re-fetching known users, most valuable first
+def refresh_users(budget, bot_scores_file=None):
+    from refetch_scheduler import Budget, RefetchScheduler
+
+    start = datetime.now()
+    scheduler = RefetchScheduler(REFETCH_STATE_FILE)
+    if bot_scores_file is not None:
+        bot_scores = pd.read_csv(bot_scores_file)
+        scheduler.set_bot_scores(bot_scores.set_index("username")["bot_score"])
+    budget = Budget(budget)
+    users = scheduler.plan(set(scheduler.users()) | get_fetched_users(), budget)
+    print(f"Refreshing {len(users)} users")
+
+    user_df, posts_df, comments_df = get_user_data(users, "refresh", scheduler, budget)
+    save_data(posts_df, comments_df, user_df, DIRECTORY, "refresh")
+    print(f"Time elapsed (refresh): {datetime.now() - start}")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,7 +1,8 @@
 import configparser
-import functools
+import csv
 import os
-import time
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
@@ -10,6 +11,8 @@ import praw
 from prawcore.exceptions import TooManyRequests
 from tqdm import tqdm
 
+from concurrency import AdaptiveConcurrency
+
 config = configparser.ConfigParser()
 config.read("config.ini")
 
@@ -25,29 +28,23 @@ DIRECTORY = "data"
 TIME_FILTER = "month"
 LIMIT = None
 FETCHED_SUBREDDITS_FILE = f"{DIRECTORY}\\fetched_subreddits.txt"
+WORKERS = 16
+QUEUE_SIZE = 1000
+DONE = object()
+
+# Listing endpoint and its arguments; all are read concurrently
+LISTINGS = [
+    ("top", {"time_filter": "year"}),
+    ("controversial", {"time_filter": "year"}),
+    ("top", {"time_filter": "month"}),
+    ("controversial", {"time_filter": "month"}),
+    ("top", {"time_filter": "week"}),
+    ("new", {}),
+    ("hot", {}),
+    ("rising", {}),
+]
 
 
-def retry(exceptions, tries=4, delay=3, backoff=2):
-    def decorator_retry(func):
-        @functools.wraps(func)
-        def wrapper_retry(*args, **kwargs):
-            _tries, _delay = tries, delay
-            while _tries > 1:
-                try:
-                    return func(*args, **kwargs)
-                except exceptions as e:
-                    print(f"{e}, Retrying in {_delay} seconds...")
-                    time.sleep(_delay)
-                    _tries -= 1
-                    _delay *= backoff
-            return func(*args, **kwargs)
-
-        return wrapper_retry
-
-    return decorator_retry
-
-
-@retry(TooManyRequests)
 def process_submission(submission, subreddit):
     post_data = {
         "subreddit": subreddit,
@@ -89,14 +86,78 @@ def process_submission(submission, subreddit):
     return post_data, comments
 
 
-def remove_duplicates(submissions):
-    seen = set()
-    unique_submissions = []
-    for submission in tqdm(submissions, desc="Removing duplicates"):
-        if submission.id not in seen:
-            unique_submissions.append(submission)
+def listing_name(method, kwargs):
+    return "_".join([method] + list(kwargs.values()))
+
+
+def next_listing_item(iterator):
+    # A throttled page request leaves the listing where it was, so it is retried
+    return next(iterator, None)
+
+
+# Whether the next item needs a new page from the API; a PRAW listing yields
+# the rest of the current page from memory
+def listing_page_pending(listing):
+    page = getattr(listing, "_listing", None)
+    if page is not None and getattr(listing, "_list_index", 0) < len(page):
+        return False
+    return not getattr(listing, "_exhausted", False)
+
+
+def stream_listing(subreddit, method, kwargs, controller, submissions_queue, seen, seen_lock, listing_ids):
+    listing = getattr(reddit.subreddit(subreddit), method)(limit=LIMIT, **kwargs)
+    iterator = iter(listing)
+    while True:
+        # Only page requests go through the controller, so in-memory items do
+        # not count as fast completions
+        if listing_page_pending(listing):
+            submission = controller.call(next_listing_item, iterator, retry_on=TooManyRequests)
+        else:
+            submission = next_listing_item(iterator)
+        if submission is None:
+            return
+        listing_ids.add(submission.id)
+        # Deduplicated as they arrive, so each submission is processed once
+        with seen_lock:
+            if submission.id in seen:
+                continue
             seen.add(submission.id)
-    return unique_submissions
+        submissions_queue.put(submission)
+
+
+def process_submissions(subreddit, submissions_queue, posts, comments, results_lock, controller, progress, errors):
+    while True:
+        submission = submissions_queue.get()
+        if submission is DONE:
+            return
+        try:
+            post_data, comment_data = controller.call(
+                process_submission, submission, subreddit, retry_on=TooManyRequests
+            )
+        except Exception as e:
+            print(f"Skipping submission {submission.id}: {e}")
+            errors.append(e)
+            continue
+        with results_lock:
+            posts.append(post_data)
+            comments.extend(comment_data)
+        progress.update()
+
+
+# Share of each listing's submissions that other listings also returned
+def listing_overlap(listing_ids):
+    rows = []
+    for name, ids in listing_ids.items():
+        others = set().union(*(other for key, other in listing_ids.items() if key != name))
+        rows.append(
+            {
+                "listing": name,
+                "submissions": len(ids),
+                "unique": len(ids - others),
+                "overlap_ratio": len(ids & others) / len(ids) if ids else 0.0,
+            }
+        )
+    return pd.DataFrame(rows)
 
 
 def get_posts_for_subreddit(subreddit: str):
@@ -104,35 +165,63 @@ def get_posts_for_subreddit(subreddit: str):
     posts = []
     comments = []
 
-    submissions = list(
-        reddit.subreddit(subreddit).top(time_filter=TIME_FILTER, limit=LIMIT)
-    )
-    top1_submissions = list(reddit.subreddit(subreddit).top(time_filter="year", limit=LIMIT))
-    top2_submissions = list(reddit.subreddit(subreddit).controversial(time_filter="year", limit=LIMIT))
-    top3_submissions = list(reddit.subreddit(subreddit).top(time_filter="month", limit=LIMIT))
-    top4_submissions = list(reddit.subreddit(subreddit).controversial(time_filter="month", limit=LIMIT))
-    top5_submissions = list(reddit.subreddit(subreddit).top(time_filter="week", limit=LIMIT))
-    new_submissions = list(reddit.subreddit(subreddit).new(limit=LIMIT))
-    hot_submissions = list(reddit.subreddit(subreddit).hot(limit=LIMIT))
-    rising_submissions = list(reddit.subreddit(subreddit).rising(limit=LIMIT))
-
-    all_submissions = top1_submissions + top2_submissions + top3_submissions + top4_submissions + top5_submissions + new_submissions + hot_submissions + rising_submissions
-    submissions = remove_duplicates(all_submissions)
-
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_submission, submission, subreddit)
-            for submission in submissions
+    # One limiter paces listing pages and comment trees alike
+    controller = AdaptiveConcurrency(max_limit=WORKERS)
+    submissions_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    seen = set()
+    seen_lock = threading.Lock()
+    results_lock = threading.Lock()
+    listing_ids = {listing_name(method, kwargs): set() for method, kwargs in LISTINGS}
+    errors = []
+    progress = tqdm(desc=f"Processing submissions for {subreddit}", unit="post")
+
+    with ThreadPoolExecutor(max_workers=len(LISTINGS) + WORKERS) as executor:
+        listings = {
+            executor.submit(
+                stream_listing,
+                subreddit,
+                method,
+                kwargs,
+                controller,
+                submissions_queue,
+                seen,
+                seen_lock,
+                listing_ids[listing_name(method, kwargs)],
+            ): listing_name(method, kwargs)
+            for method, kwargs in LISTINGS
+        }
+        workers = [
+            executor.submit(
+                process_submissions,
+                subreddit,
+                submissions_queue,
+                posts,
+                comments,
+                results_lock,
+                controller,
+                progress,
+                errors,
+            )
+            for _ in range(WORKERS)
         ]
 
-        for future in tqdm(
-            as_completed(futures),
-            total=len(futures),
-            desc=f"Processing submissions for {subreddit}",
-        ):
-            post_data, comment_data = future.result()
-            posts.append(post_data)
-            comments.extend(comment_data)
+        for future in as_completed(listings):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Listing {listings[future]} stopped early: {e}")
+                errors.append(e)
+        for _ in workers:
+            submissions_queue.put(DONE)
+        for future in workers:
+            future.result()
+
+    progress.close()
+    if errors:
+        print(f"{len(errors)} items failed and were skipped")
+    controller.print_metrics()
+    print(f"Listing overlap for subreddit {subreddit}:")
+    print(listing_overlap(listing_ids).to_string(index=False))
 
     return posts, comments
 
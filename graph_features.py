@@ -0,0 +1,178 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from feature_cache import hash_frame
+
+GRAPH_CACHE_DIR = "data/.graph_cache"
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOL = 1e-8
+PAGERANK_MAX_ITER = 100
+
+
+# Adjacency matrices
+def build_user_subreddit_matrix(comments_df, user_index):
+    from scipy import sparse
+
+    df = comments_df[["username", "subreddit"]].dropna()
+    rows = user_index.get_indexer(df["username"])
+    cols, subreddits = pd.factorize(df["subreddit"])
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(user_index), len(subreddits)),
+    )
+    matrix.sum_duplicates()
+    return matrix, np.asarray(subreddits, dtype=object)
+
+
+def build_reply_matrix(comments_df, user_index):
+    from scipy import sparse
+
+    df = comments_df[["username", "id", "parent_id"]].dropna()
+    df = df[df["parent_id"].str.startswith("t1_")]
+    authors = comments_df[["id", "username"]].dropna().drop_duplicates(subset="id")
+    author_lookup = pd.Series(authors["username"].to_numpy(), index=authors["id"])
+
+    parent_authors = author_lookup.reindex(df["parent_id"].str[3:]).to_numpy()
+    known = pd.notna(parent_authors)
+    rows = user_index.get_indexer(df["username"].to_numpy()[known])
+    cols = user_index.get_indexer(parent_authors[known])
+
+    # Edge child author -> parent author, self-replies dropped
+    keep = rows != cols
+    matrix = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.float32), (rows[keep], cols[keep])),
+        shape=(len(user_index), len(user_index)),
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+def build_graph(comments_df, cache_dir=GRAPH_CACHE_DIR):
+    key = hash_frame(
+        comments_df, ["username", "subreddit", "id", "parent_id"]
+    )[:32]
+    path = os.path.join(cache_dir, f"graph-{key}.npz")
+    if os.path.isfile(path):
+        print(f"Loading cached activity graph from {path}")
+        return load_graph(path)
+
+    usernames = pd.Index(comments_df["username"].dropna().unique())
+    user_subreddit, subreddits = build_user_subreddit_matrix(comments_df, usernames)
+    replies = build_reply_matrix(comments_df, usernames)
+    graph = {
+        "usernames": np.asarray(usernames, dtype=object),
+        "subreddits": subreddits,
+        "user_subreddit": user_subreddit,
+        "replies": replies,
+    }
+
+    os.makedirs(cache_dir, exist_ok=True)
+    save_graph(graph, path)
+    return graph
+
+
+def save_graph(graph, path):
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        usernames=graph["usernames"].astype(str),
+        subreddits=graph["subreddits"].astype(str),
+        **{
+            f"{name}_{part}": getattr(graph[name], part)
+            for name in ["user_subreddit", "replies"]
+            for part in ["data", "indices", "indptr"]
+        },
+        user_subreddit_shape=graph["user_subreddit"].shape,
+        replies_shape=graph["replies"].shape,
+    )
+    os.replace(tmp_path, path)
+
+
+def load_graph(path):
+    from scipy import sparse
+
+    with np.load(path) as data:
+        graph = {
+            "usernames": data["usernames"].astype(object),
+            "subreddits": data["subreddits"].astype(object),
+        }
+        for name in ["user_subreddit", "replies"]:
+            graph[name] = sparse.csr_matrix(
+                (
+                    data[f"{name}_data"],
+                    data[f"{name}_indices"],
+                    data[f"{name}_indptr"],
+                ),
+                shape=tuple(data[f"{name}_shape"]),
+            )
+    return graph
+
+
+# Graph metrics
+def subreddit_entropy(user_subreddit):
+    totals = np.asarray(user_subreddit.sum(axis=1)).ravel()
+    p = user_subreddit.multiply(1 / np.maximum(totals, 1)[:, None]).tocsr()
+    p.data = -p.data * np.log2(p.data)
+    return np.asarray(p.sum(axis=1)).ravel()
+
+
+def reciprocity(replies):
+    binary = (replies > 0).astype(np.float32)
+    mutual = np.asarray(binary.multiply(binary.T).sum(axis=1)).ravel()
+    out_degree = np.asarray(binary.sum(axis=1)).ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(out_degree > 0, mutual / out_degree, np.nan)
+
+
+def pagerank(
+    adjacency,
+    damping=PAGERANK_DAMPING,
+    tol=PAGERANK_TOL,
+    max_iter=PAGERANK_MAX_ITER,
+):
+    from scipy import sparse
+
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inv_out = np.where(dangling, 0, 1 / np.where(dangling, 1, out_weight))
+    transition_t = (sparse.diags(inv_out) @ adjacency).T.tocsr()
+
+    rank = np.full(n, 1 / n)
+    for _ in range(max_iter):
+        new_rank = damping * (transition_t @ rank + rank[dangling].sum() / n)
+        new_rank += (1 - damping) / n
+        converged = np.abs(new_rank - rank).sum() < tol
+        rank = new_rank
+        if converged:
+            break
+    return rank
+
+
+def add_graph_features(df, comments_df):
+    graph = build_graph(comments_df)
+    replies = graph["replies"]
+    binary = replies > 0
+
+    graph_df = pd.DataFrame(
+        {
+            "username": graph["usernames"],
+            "reply_out_degree": np.asarray(binary.sum(axis=1)).ravel(),
+            "reply_in_degree": np.asarray(binary.sum(axis=0)).ravel(),
+            "reply_reciprocity": reciprocity(replies),
+            "subreddit_count": np.diff(graph["user_subreddit"].indptr),
+            "subreddit_entropy": subreddit_entropy(graph["user_subreddit"]),
+            "reply_pagerank": pagerank(replies) * len(graph["usernames"]),
+        }
+    )
+    df = df.merge(graph_df, on="username", how="left")
+    print(
+        "Features reply_out_degree, reply_in_degree, reply_reciprocity, "
+        "subreddit_count, subreddit_entropy, reply_pagerank created successfully."
+    )
+
+    return df
@@ -0,0 +1,124 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_DIR = "data/feature_snapshots"
+GROUPINGS = ["subreddit", "week"]
+# Partial aggregates kept per group; all of them combine by sum, min or max
+PARTIALS = ["count", "sum", "sum_sq", "min", "max"]
+
+
+# Shared group indexes: one factorisation per key, reused by every value
+def week_starts(dates):
+    dates = pd.to_datetime(dates, errors="coerce", utc=True).dt.tz_localize(None)
+    return dates.dt.to_period("W-SUN").dt.start_time.dt.strftime("%Y-%m-%d")
+
+
+def build_group_index(comments_df):
+    user_codes, usernames = pd.factorize(comments_df["username"])
+    keys = {
+        "subreddit": comments_df["subreddit"],
+        "week": week_starts(comments_df["date"]),
+    }
+    index = {"username": (user_codes, np.asarray(usernames, dtype=object))}
+    for grouping in GROUPINGS:
+        key_codes, key_values = pd.factorize(keys[grouping])
+        valid = (user_codes >= 0) & (key_codes >= 0)
+        pair_codes = np.where(
+            valid, user_codes.astype(np.int64) * len(key_values) + key_codes, -1
+        )
+        codes, pairs = pd.factorize(pair_codes[valid])
+        group_codes = np.full(len(comments_df), -1, dtype=np.int64)
+        group_codes[valid] = codes
+        groups = pd.DataFrame(
+            {
+                "username": np.asarray(usernames, dtype=object)[
+                    pairs // len(key_values)
+                ],
+                grouping: np.asarray(key_values, dtype=object)[pairs % len(key_values)],
+            }
+        )
+        index[grouping] = (group_codes, groups)
+    return index
+
+
+# Partial aggregates
+def segment_partials(values, codes, n_segments):
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    minimum = np.full(n_segments, np.inf)
+    maximum = np.full(n_segments, -np.inf)
+    np.minimum.at(minimum, codes, values)
+    np.maximum.at(maximum, codes, values)
+    count = np.bincount(codes, minlength=n_segments)
+    return {
+        "count": count,
+        "sum": np.bincount(codes, weights=values, minlength=n_segments),
+        "sum_sq": np.bincount(codes, weights=values**2, minlength=n_segments),
+        "min": np.where(count > 0, minimum, np.nan),
+        "max": np.where(count > 0, maximum, np.nan),
+    }
+
+
+def group_partials(values, codes, groups):
+    partials = groups.copy()
+    partials["num_comments"] = np.bincount(codes[codes >= 0], minlength=len(groups))
+    for name, column in values.items():
+        for part, result in segment_partials(
+            np.asarray(column, dtype=np.float64), codes, len(groups)
+        ).items():
+            partials[f"{name}__{part}"] = result
+    return partials
+
+
+def value_names(partials):
+    return [column[: -len("__count")] for column in partials if column.endswith("__count")]
+
+
+def finalize(partials):
+    features = partials.copy()
+    for name in value_names(partials):
+        count = partials[f"{name}__count"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = partials[f"{name}__sum"] / count
+            variance = np.maximum(partials[f"{name}__sum_sq"] / count - mean**2, 0)
+        features[f"{name}_mean"] = mean
+        features[f"{name}_std"] = np.sqrt(variance)
+    return features
+
+
+# Coarser levels come from combining partial aggregates, not from the comments
+def rollup(partials, by=("username",)):
+    by = list(by)
+    aggregations = {"num_comments": "sum"}
+    for name in value_names(partials):
+        aggregations.update(
+            {
+                f"{name}__count": "sum",
+                f"{name}__sum": "sum",
+                f"{name}__sum_sq": "sum",
+                f"{name}__min": "min",
+                f"{name}__max": "max",
+            }
+        )
+    partials = partials.groupby(by, sort=False).agg(aggregations).reset_index()
+    return finalize(partials)
+
+
+def compute_snapshots(values, index):
+    return {
+        grouping: finalize(group_partials(values, *index[grouping]))
+        for grouping in GROUPINGS
+    }
+
+
+# Partitioned table: <path>/by_<grouping>/<grouping>=<value>/part-*.parquet
+def save_snapshots(snapshots, path=SNAPSHOT_DIR):
+    for grouping, table in snapshots.items():
+        grouping_path = os.path.join(path, f"by_{grouping}")
+        shutil.rmtree(grouping_path, ignore_errors=True)
+        table.to_parquet(grouping_path, partition_cols=[grouping], index=False)
+    print(f"Feature snapshots saved to {path}")
+
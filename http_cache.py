@@ -0,0 +1,222 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+
+HTTP_CACHE_FILE = "data/http_cache.sqlite"
+HTTP_CACHE_MAX_BYTES = 1024**3
+DAY = 24 * 3600
+
+# Resources worth caching, by URL path, and how long a response stays fresh.
+# Profiles carry karma and account age, so they are refreshed more often
+# than the comment and submission histories.
+RESOURCE_PATTERNS = [
+    ("profile", re.compile(r"/user/[^/]+/about/?(\.json)?$")),
+    ("history", re.compile(r"/user/[^/]+/(comments|submitted)/?(\.json)?$")),
+]
+RESOURCE_TTLS = {"profile": 1 * DAY, "history": 7 * DAY}
+RATELIMIT_HEADERS = ["x-ratelimit-remaining", "x-ratelimit-used", "x-ratelimit-reset"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    resource TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def resource_of(url):
+    path = url.split("?", 1)[0]
+    for resource, pattern in RESOURCE_PATTERNS:
+        if pattern.search(path):
+            return resource
+    return None
+
+
+def request_key(method, url, params):
+    items = sorted((params or {}).items())
+    return f"{method.upper()} {url}?{urlencode(items)}"
+
+
+# requests.Session that answers cacheable GETs from SQLite. prawcore takes
+# it as the session of its Requestor, so it sits below PRAW's own rate
+# limiter and OAuth handling, and 429s are never cached.
+class CachedSession(requests.Session):
+    def __init__(
+        self, path=HTTP_CACHE_FILE, max_bytes=HTTP_CACHE_MAX_BYTES, ttls=None
+    ):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(RESOURCE_TTLS, **(ttls or {}))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.total_bytes = self.db.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM responses"
+        ).fetchone()[0]
+        self.ratelimit = None
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        resource = resource_of(url) if method.upper() == "GET" else None
+        if resource is None or self.ttls.get(resource, 0) <= 0:
+            return self._send(method, url, params=params, headers=headers, **kwargs)
+
+        key = request_key(method, url, params)
+        entry = self.lookup(key)
+        now = time.time()
+        if entry is not None and now - entry["fetched_at"] < self.ttls[resource]:
+            self.stats["hits"] += 1
+            self.touch(key, now)
+            return self.cached_response(entry, url)
+
+        # Stale entries are revalidated when the server gave us validators
+        headers = dict(headers or {})
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self._send(method, url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.stats["revalidated"] += 1
+            self.touch(key, now, fetched=True)
+            return self.cached_response(entry, url)
+        self.stats["misses"] += 1
+        if response.status_code == 200:
+            self.store(key, resource, response, now)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        if "x-ratelimit-remaining" in response.headers:
+            self.ratelimit = (
+                {name: response.headers[name] for name in RATELIMIT_HEADERS},
+                time.monotonic(),
+            )
+        return response
+
+    # Storage
+    def lookup(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, headers, body, etag, last_modified, fetched_at "
+                "FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            zip(["status", "headers", "body", "etag", "last_modified", "fetched_at"], row)
+        )
+
+    def touch(self, key, now, fetched=False):
+        with self.lock:
+            if fetched:
+                self.db.execute(
+                    "UPDATE responses SET last_used = ?, fetched_at = ? WHERE key = ?",
+                    (now, now, key),
+                )
+            else:
+                self.db.execute(
+                    "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+                )
+            self.db.commit()
+
+    def store(self, key, resource, response, now):
+        body = response.content
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() not in RATELIMIT_HEADERS
+        }
+        with self.lock:
+            old = self.db.execute(
+                "SELECT bytes FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    resource,
+                    response.status_code,
+                    json.dumps(headers),
+                    body,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    now,
+                    now,
+                    len(body),
+                ),
+            )
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self._evict()
+            self.db.commit()
+        self.stats["stored"] += 1
+
+    # Least recently used entries go first
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        rows = self.db.execute(
+            "SELECT key, bytes FROM responses ORDER BY last_used"
+        ).fetchall()
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.stats["evicted"] += 1
+
+    def cached_response(self, entry, url):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response._content = entry["body"]
+        response.headers.update(json.loads(entry["headers"]))
+        # Repeat the latest real rate limit state so a hit does not count
+        # against the quota in prawcore's limiter
+        if self.ratelimit is not None:
+            values, seen_at = self.ratelimit
+            elapsed = int(time.monotonic() - seen_at)
+            response.headers.update(values)
+            response.headers["x-ratelimit-reset"] = str(
+                max(0, int(float(values["x-ratelimit-reset"])) - elapsed)
+            )
+        response.url = url
+        response.encoding = "utf-8"
+        return response
+
+    def size(self):
+        return self.total_bytes
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"HTTP cache: {stats['hits']} hits, {stats['revalidated']} revalidated, "
+            f"{stats['misses']} misses, {stats['stored']} stored, "
+            f"{stats['evicted']} evicted, {self.total_bytes / 1024**2:.1f} MB"
+        )
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,104 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Scheme or www. prefix followed by a host; the host is the capture group
+URL_PATTERN = r"(?:https?://|www\.)(?:www\.)?((?:[a-z0-9-]+\.)+[a-z]{2,})"
+# A domain is widely shared when at least this many other users link to it
+SHARED_DOMAIN_USERS = 10
+
+
+# Every comment body and post text with its author, one row per document
+def link_documents(comments_df, posts_df=None):
+    frames = [comments_df[["username", "body"]].rename(columns={"body": "text"})]
+    if posts_df is not None:
+        frames.append(posts_df[["username", "text"]])
+    documents = pd.concat(frames, ignore_index=True)
+    documents = documents[documents["username"].notna()].reset_index(drop=True)
+    return documents["username"].to_numpy(), documents["text"].fillna("").astype(str)
+
+
+def extract_domains(texts):
+    matches = texts.str.extractall(URL_PATTERN, flags=re.IGNORECASE)[0]
+    rows = matches.index.get_level_values(0).to_numpy(dtype=np.int64)
+    return rows, matches.str.lower().to_numpy()
+
+
+# Inverted index: sparse domain x user matrix of link counts
+def build_domain_index(usernames, texts):
+    from scipy import sparse
+
+    user_codes, users = pd.factorize(usernames)
+    rows, domains = extract_domains(texts)
+    domain_codes, domain_names = pd.factorize(domains)
+    domain_users = sparse.csr_matrix(
+        (
+            np.ones(len(rows), dtype=np.float64),
+            (domain_codes, user_codes[rows]),
+        ),
+        shape=(len(domain_names), len(users)),
+    )
+    domain_users.sum_duplicates()
+    return {
+        "usernames": np.asarray(users, dtype=object),
+        "domains": np.asarray(domain_names, dtype=object),
+        "domain_users": domain_users,
+        "documents": np.bincount(user_codes, minlength=len(users)),
+        "linked_documents": np.bincount(
+            user_codes[np.unique(rows)], minlength=len(users)
+        ),
+    }
+
+
+def domain_user_counts(index):
+    return np.diff(index["domain_users"].indptr)
+
+
+# Herfindahl index of the user's links over domains, 1 for a single domain
+def domain_concentration(user_domains):
+    totals = np.asarray(user_domains.sum(axis=1)).ravel()
+    squares = np.asarray(user_domains.multiply(user_domains).sum(axis=1)).ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, squares / totals**2, np.nan)
+
+
+# Share of the user's distinct domains that many other users also link to
+def shared_domain_share(user_domains, users_per_domain, min_users=SHARED_DOMAIN_USERS):
+    shared = (users_per_domain[user_domains.indices] - 1 >= min_users).astype(
+        np.float64
+    )
+    rows = np.repeat(np.arange(user_domains.shape[0]), np.diff(user_domains.indptr))
+    distinct = np.diff(user_domains.indptr)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(
+            distinct > 0,
+            np.bincount(rows, weights=shared, minlength=user_domains.shape[0])
+            / distinct,
+            np.nan,
+        )
+
+
+def add_link_features(df, comments_df, posts_df=None, min_users=SHARED_DOMAIN_USERS):
+    index = build_domain_index(*link_documents(comments_df, posts_df))
+    user_domains = index["domain_users"].T.tocsr()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        link_rate = index["linked_documents"] / index["documents"]
+    link_df = pd.DataFrame(
+        {
+            "username": index["usernames"],
+            "link_rate": link_rate,
+            "domain_concentration": domain_concentration(user_domains),
+            "shared_domain_share": shared_domain_share(
+                user_domains, domain_user_counts(index), min_users
+            ),
+        }
+    )
+    df = df.merge(link_df, on="username", how="left")
+    print(
+        "Features link_rate, domain_concentration, shared_domain_share "
+        "created successfully."
+    )
+
+    return df
@@ -1,17 +1,24 @@
-import pandas as pd
 import os
 
-files = os.listdir('amc-v2')
+import pandas as pd
+
+SOURCE_DIR = 'amc-v2'
+TARGET_DIR = 'data'
+
 
+def merge(source_dir=SOURCE_DIR, target_dir=TARGET_DIR):
+    files = os.listdir(source_dir)
 
-# pd.concat([pd.read_csv('amc/' + f) for f in files if f.startswith('user_data')], ignore_index=True).to_csv('amc-v2/user_data-todayilearned.csv', index=False)
+    # pd.concat([pd.read_csv('amc/' + f) for f in files if f.startswith('user_data')], ignore_index=True).to_csv('amc-v2/user_data-todayilearned.csv', index=False)
 
+    for prefix in ['user_data', 'all_comments', 'all_posts']:
+        merged_file = f'{target_dir}/{prefix}-merged.csv'
+        pd.concat([pd.read_csv(f'{source_dir}/' + f) for f in files if f.startswith(prefix)], ignore_index=True).to_csv(merged_file, index=False)
 
-pd.concat([pd.read_csv('amc-v2/' + f) for f in files if f.startswith('user_data')], ignore_index=True).to_csv('data/user_data-merged.csv', index=False)
-pd.concat([pd.read_csv('amc-v2/' + f) for f in files if f.startswith('all_comments')], ignore_index=True).to_csv('data/all_comments-merged.csv', index=False)
-pd.concat([pd.read_csv('amc-v2/' + f) for f in files if f.startswith('all_posts')], ignore_index=True).to_csv('data/all_posts-merged.csv', index=False)
+    for prefix in ['user_data', 'all_comments', 'all_posts']:
+        merged_file = f'{target_dir}/{prefix}-merged.csv'
+        print([pd.read_csv(f'{source_dir}/' + f).shape for f in files if f.startswith(prefix)], pd.read_csv(merged_file).shape)
 
-print([pd.read_csv('amc-v2/' + f).shape for f in files if f.startswith('user_data')], pd.read_csv('data/user_data-merged.csv').shape)
-print([pd.read_csv('amc-v2/' + f).shape for f in files if f.startswith('all_comments')], pd.read_csv('data/all_comments-merged.csv').shape)
-print([pd.read_csv('amc-v2/' + f).shape for f in files if f.startswith('all_posts')], pd.read_csv('data/all_posts-merged.csv').shape)
 
+if __name__ == '__main__':
+    merge()
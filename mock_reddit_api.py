@@ -0,0 +1,428 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+HOST = "127.0.0.1"
+PORT = 8765
+SUBREDDITS = ["funny", "AskReddit", "gaming", "worldnews", "todayilearned"]
+SUBMISSIONS_PER_SUBREDDIT = 50
+COMMENTS_PER_SUBMISSION = 30
+HISTORY_PER_USER = 20
+NUM_USERS = 2000
+BASE_TIME = 1_700_000_000
+WORDS = (
+    "the bot said hello world news great post agree link check this out "
+    "reddit game fun thanks lol really good point source"
+).split()
+
+
+# Synthetic Reddit data, generated once from a seed
+def build_world(
+    seed=42,
+    subreddits=SUBREDDITS,
+    submissions_per_subreddit=SUBMISSIONS_PER_SUBREDDIT,
+    comments_per_submission=COMMENTS_PER_SUBMISSION,
+    num_users=NUM_USERS,
+    history_per_user=HISTORY_PER_USER,
+):
+    rng = random.Random(seed)
+    users = {
+        f"mock_user_{i}": {
+            "name": f"mock_user_{i}",
+            "id": f"u{i:x}",
+            "link_karma": rng.randint(-50, 50_000),
+            "comment_karma": rng.randint(-50, 100_000),
+            "created_utc": BASE_TIME - rng.randint(1, 4000) * 86400,
+            "has_verified_email": rng.random() < 0.8,
+        }
+        for i in range(num_users)
+    }
+    usernames = list(users)
+    world = {
+        "users": users,
+        "listings": {},
+        "submissions": {},
+        "comments": {},
+        "user_submissions": {name: [] for name in usernames},
+        "user_comments": {name: [] for name in usernames},
+    }
+
+    def text(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    next_id = 0
+    for subreddit in subreddits:
+        listing = []
+        for _ in range(submissions_per_subreddit):
+            next_id += 1
+            submission_id = f"s{next_id:x}"
+            author = rng.choice(usernames)
+            world["submissions"][submission_id] = {
+                "id": submission_id,
+                "name": f"t3_{submission_id}",
+                "title": text(6),
+                "selftext": text(rng.randint(0, 30)),
+                "author": author,
+                "subreddit": subreddit,
+                "is_original_content": False,
+                "num_comments": comments_per_submission,
+                "score": rng.randint(0, 50_000),
+                "upvote_ratio": round(rng.uniform(0.5, 1.0), 2),
+                "created_utc": BASE_TIME - rng.randint(0, 30 * 86400),
+                "permalink": f"/r/{subreddit}/comments/{submission_id}/",
+                "stickied": False,
+            }
+            listing.append(submission_id)
+            world["user_submissions"][author].append(submission_id)
+
+            comment_ids = []
+            for _ in range(comments_per_submission):
+                next_id += 1
+                comment_id = f"c{next_id:x}"
+                parent = rng.choice(comment_ids) if comment_ids and rng.random() < 0.6 else None
+                author = rng.choice(usernames)
+                world["comments"][comment_id] = {
+                    "id": comment_id,
+                    "name": f"t1_{comment_id}",
+                    "parent_id": f"t1_{parent}" if parent else f"t3_{submission_id}",
+                    "link_id": f"t3_{submission_id}",
+                    "body": text(rng.randint(1, 40)),
+                    "author": author,
+                    "subreddit": subreddit,
+                    "score": rng.randint(-10, 5000),
+                    "is_submitter": False,
+                    "stickied": False,
+                    "created_utc": BASE_TIME - rng.randint(0, 30 * 86400),
+                    "children": [],
+                }
+                if parent:
+                    world["comments"][parent]["children"].append(comment_id)
+                comment_ids.append(comment_id)
+                world["user_comments"][author].append(comment_id)
+            world["submissions"][submission_id]["comment_ids"] = comment_ids
+        world["listings"][subreddit] = listing
+
+    for name in usernames:
+        world["user_comments"][name] = world["user_comments"][name][:history_per_user]
+        world["user_submissions"][name] = world["user_submissions"][name][
+            :history_per_user
+        ]
+    return world
+
+
+def load_fixtures(path):
+    fixtures = {}
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                fixtures[record["path"].strip("/")] = record["body"]
+    return fixtures
+
+
+# JSON in the shape the Reddit API returns
+def listing(children, after=None):
+    return {
+        "kind": "Listing",
+        "data": {
+            "after": after,
+            "before": None,
+            "dist": len(children),
+            "children": children,
+        },
+    }
+
+
+def submission_thing(world, submission_id):
+    data = {
+        key: value
+        for key, value in world["submissions"][submission_id].items()
+        if key != "comment_ids"
+    }
+    return {"kind": "t3", "data": data}
+
+
+def comment_thing(world, comment_id, depth=True):
+    comment = world["comments"][comment_id]
+    data = {key: value for key, value in comment.items() if key != "children"}
+    if depth and comment["children"]:
+        data["replies"] = listing(
+            [comment_thing(world, child) for child in comment["children"]]
+        )
+    else:
+        data["replies"] = ""
+    return {"kind": "t1", "data": data}
+
+
+def paginate(ids, query):
+    limit = int(query.get("limit", ["100"])[0] or 100)
+    after = query.get("after", [None])[0]
+    start = 0
+    if after and after.split("_", 1)[-1] in ids:
+        start = ids.index(after.split("_", 1)[-1]) + 1
+    page = ids[start : start + limit]
+    return page, start + limit < len(ids)
+
+
+class MockRedditState:
+    def __init__(
+        self,
+        world,
+        fixtures=None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        quota=None,
+        quota_window=60.0,
+        seed=0,
+    ):
+        self.world = world
+        self.fixtures = fixtures or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota = quota
+        self.quota_window = quota_window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_used = 0
+        self.stats = {"requests": 0, "throttled": 0, "endpoints": {}}
+
+    # Returns remaining quota, or None when the request should get a 429
+    def admit(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if now - self.window_start >= self.quota_window:
+                self.window_start = now
+                self.window_used = 0
+            reset = self.quota_window - (now - self.window_start)
+            if self.random.random() < self.error_rate or (
+                self.quota is not None and self.window_used >= self.quota
+            ):
+                self.stats["throttled"] += 1
+                return None, reset
+            self.window_used += 1
+            if self.quota is None:
+                return 10**6, reset
+            remaining = self.quota - self.window_used
+            return remaining, reset
+
+    def delay(self):
+        with self.lock:
+            seconds = self.latency + self.random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def record(self, endpoint):
+        with self.lock:
+            endpoints = self.stats["endpoints"]
+            endpoints[endpoint] = endpoints.get(endpoint, 0) + 1
+
+    def route(self, path, query):
+        path = path.strip("/")
+        if path.endswith(".json"):
+            path = path[: -len(".json")]
+        if path in self.fixtures:
+            return "fixture", self.fixtures[path]
+        parts = path.split("/")
+        world = self.world
+
+        if len(parts) == 3 and parts[0] == "r" and parts[2] in {
+            "top",
+            "controversial",
+            "new",
+            "hot",
+            "rising",
+        }:
+            ids = world["listings"].get(parts[1], [])
+            page, more = paginate(ids, query)
+            children = [submission_thing(world, i) for i in page]
+            after = f"t3_{page[-1]}" if more and page else None
+            return "listing", listing(children, after)
+
+        if parts[0] == "comments" and len(parts) >= 2:
+            submission_id = parts[1]
+            if submission_id not in world["submissions"]:
+                return "comments", None
+            submission = world["submissions"][submission_id]
+            top_level = [
+                comment_id
+                for comment_id in submission["comment_ids"]
+                if world["comments"][comment_id]["parent_id"].startswith("t3_")
+            ]
+            return "comments", [
+                listing([submission_thing(world, submission_id)]),
+                listing([comment_thing(world, i) for i in top_level]),
+            ]
+
+        if parts[0] == "user" and len(parts) >= 3:
+            name = parts[1]
+            if name not in world["users"]:
+                return "user", None
+            if parts[2] == "about":
+                return "user_about", {"kind": "t2", "data": world["users"][name]}
+            if parts[2] in {"comments", "submitted"}:
+                kind = "user_comments" if parts[2] == "comments" else "user_submissions"
+                page, more = paginate(world[kind][name], query)
+                if kind == "user_comments":
+                    children = [comment_thing(world, i, depth=False) for i in page]
+                    prefix = "t1"
+                else:
+                    children = [submission_thing(world, i) for i in page]
+                    prefix = "t3"
+                after = f"{prefix}_{page[-1]}" if more and page else None
+                return kind, listing(children, after)
+
+        return "unknown", None
+
+
+class MockRedditHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path.rstrip("/") == "/api/v1/access_token":
+            self.send_json(
+                200,
+                {
+                    "access_token": "mock-token",
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                    "scope": "*",
+                },
+            )
+        else:
+            self.send_json(404, {"message": "Not Found", "error": 404})
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            self.send_json(200, state.stats)
+            return
+
+        state.delay()
+        remaining, reset = state.admit()
+        headers = {
+            "x-ratelimit-remaining": str(max(remaining or 0, 0)),
+            "x-ratelimit-used": str(state.window_used),
+            "x-ratelimit-reset": str(int(reset) + 1),
+        }
+        if remaining is None:
+            self.send_json(429, {"message": "Too Many Requests", "error": 429}, headers)
+            return
+
+        endpoint, body = state.route(url.path, parse_qs(url.query))
+        state.record(endpoint)
+        if body is None:
+            self.send_json(404, {"message": "Not Found", "error": 404}, headers)
+        else:
+            self.send_json(200, body, headers)
+
+
+class MockRedditServer:
+    def __init__(self, state, host=HOST, port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockRedditHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = state
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def make_reddit(url):
+    import praw
+
+    return praw.Reddit(
+        client_id="mock",
+        client_secret="mock",
+        username="mock",
+        password="mock",
+        user_agent="mock-benchmark",
+        oauth_url=url,
+        reddit_url=url,
+        short_url=url,
+        check_for_updates=False,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local Reddit API stand-in.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fixtures", default=None, help="JSON lines of path/body.")
+    parser.add_argument("--submissions", type=int, default=SUBMISSIONS_PER_SUBREDDIT)
+    parser.add_argument("--comments", type=int, default=COMMENTS_PER_SUBMISSION)
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 rate.")
+    parser.add_argument("--quota", type=int, default=None, help="Requests/window.")
+    parser.add_argument("--quota-window", type=float, default=60.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    world = build_world(
+        args.seed,
+        submissions_per_subreddit=args.submissions,
+        comments_per_submission=args.comments,
+        num_users=args.users,
+    )
+    state = MockRedditState(
+        world,
+        load_fixtures(args.fixtures) if args.fixtures else None,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.quota,
+        args.quota_window,
+        args.seed,
+    )
+    server = MockRedditServer(state, args.host, args.port)
+    print(f"Mock Reddit API listening on {server.url}")
+    print(f"Set REDDIT_API_URL={server.url} to point the collector at it")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
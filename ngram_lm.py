@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+ORDER = 3
+CHUNK_SIZE = 200_000
+SORTED_LOOKUP_MIN = 2**20
+MIX = np.uint64(0x9E3779B97F4A7C15)
+ROW_MIX = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+# Token hashes of a chunk of texts, flattened, with document offsets
+def tokenize(texts):
+    tokens = pd.Series(texts, dtype=object).fillna("").astype(str).str.split()
+    lengths = tokens.str.len().to_numpy(dtype=np.int64)
+    flat = tokens.explode().dropna().to_numpy(dtype=object)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return pd.util.hash_array(flat), offsets
+
+
+# Keys of the n-grams ending at each token; valid where the n-gram fits
+# inside its document
+def ngram_keys(hashes, offsets, order):
+    lengths = np.diff(offsets)
+    position = np.arange(len(hashes)) - np.repeat(offsets[:-1], lengths)
+    keys = [hashes]
+    valid = [np.ones(len(hashes), dtype=bool)]
+    for n in range(2, order + 1):
+        previous = np.empty_like(hashes)
+        previous[1:] = keys[-1][:-1]
+        previous[:1] = 0
+        with np.errstate(over="ignore"):
+            keys.append((previous * MIX) ^ hashes)
+        valid.append(position >= n - 1)
+    return keys, valid
+
+
+# Occurrences of each key within its own document, 0 where not valid.
+# Keys are salted with their row so one sort counts (row, key) pairs
+def document_counts(keys, valid, lengths):
+    rows = np.repeat(np.arange(len(lengths), dtype=np.uint64), lengths)
+    with np.errstate(over="ignore"):
+        pairs = keys[valid] ^ ((rows[valid] + np.uint64(1)) * ROW_MIX)
+    _, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+    within = np.zeros(len(keys), dtype=np.int64)
+    within[valid] = counts[inverse.ravel()]
+    return within
+
+
+def count_keys(keys, counts=None):
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(unique))
+    return unique, counts.astype(np.uint32)
+
+
+# Interpolation weights, doubling with each order: 1/7, 2/7, 4/7 for trigrams
+def interpolation_weights(order):
+    weights = 2.0 ** np.arange(order)
+    return weights / weights.sum()
+
+
+# Corpus-wide word n-gram counts as sorted hashed keys with parallel count
+# arrays, one pair per order; lookups are binary searches
+class NgramStore:
+    def __init__(self, path=None, order=ORDER):
+        self.path = path
+        self.order = order
+        self.keys = [np.zeros(0, dtype=np.uint64) for _ in range(order)]
+        self.counts = [np.zeros(0, dtype=np.uint32) for _ in range(order)]
+        self.n_tokens = 0
+        if path is not None and os.path.isfile(os.path.join(path, "meta.json")):
+            self.load()
+
+    @property
+    def vocabulary_size(self):
+        return len(self.keys[0])
+
+    def _merge(self, n, pending):
+        self.keys[n], self.counts[n] = count_keys(
+            np.concatenate([self.keys[n]] + [keys for keys, _ in pending]),
+            np.concatenate([self.counts[n]] + [counts for _, counts in pending]),
+        )
+        pending.clear()
+
+    def partial_fit(self, texts, chunk_size=CHUNK_SIZE):
+        texts = list(texts)
+        pending = [[] for _ in range(self.order)]
+        for start in range(0, len(texts), chunk_size):
+            hashes, offsets = tokenize(texts[start : start + chunk_size])
+            keys, valid = ngram_keys(hashes, offsets, self.order)
+            for n in range(self.order):
+                pending[n].append(count_keys(keys[n][valid[n]]))
+                # Merging once pending counts outgrow the table keeps the
+                # total sorting work at O(N log N)
+                if sum(len(unique) for unique, _ in pending[n]) > len(self.keys[n]):
+                    self._merge(n, pending[n])
+            self.n_tokens += len(hashes)
+        for n in range(self.order):
+            if pending[n]:
+                self._merge(n, pending[n])
+        return self
+
+    def lookup(self, n, keys):
+        table = self.keys[n]
+        counts = np.zeros(len(keys), dtype=np.int64)
+        if len(table) == 0:
+            return counts
+        # Sorted probes walk a large table in order instead of at random
+        order = np.argsort(keys) if len(table) > SORTED_LOOKUP_MIN else slice(None)
+        probes = keys[order]
+        index = np.minimum(np.searchsorted(table, probes), len(table) - 1)
+        counts[order] = np.where(table[index] == probes, self.counts[n][index], 0)
+        return counts
+
+    # Mean log-probability per token of each text under the interpolated
+    # model. With leave_one_out every occurrence of the text's own n-grams is
+    # taken out of the counts, so texts from the corpus are scored as if
+    # unseen, and repeating a phrase does not raise its own probability.
+    def score(self, texts, leave_one_out=False, chunk_size=CHUNK_SIZE):
+        texts = list(texts)
+        scores = np.full(len(texts), np.nan)
+        own = 1 if leave_one_out else 0
+        lambdas = interpolation_weights(self.order)
+        for start in range(0, len(texts), chunk_size):
+            hashes, offsets = tokenize(texts[start : start + chunk_size])
+            if len(hashes) == 0:
+                continue
+            keys, valid = ngram_keys(hashes, offsets, self.order)
+            lengths = np.diff(offsets)
+            n_tokens = np.repeat(self.n_tokens - own * lengths, lengths)
+
+            counts = [self.lookup(n, keys[n]) for n in range(self.order)]
+            if leave_one_out:
+                counts = [
+                    np.maximum(counts[n] - document_counts(keys[n], valid[n], lengths), 0)
+                    for n in range(self.order)
+                ]
+            probability = lambdas[0] * (counts[0] + 1) / (
+                n_tokens + self.vocabulary_size + 1
+            )
+            weight = np.full(len(hashes), lambdas[0])
+            for n in range(1, self.order):
+                # The context of an n-gram is the (n-1)-gram ending one token
+                # earlier
+                context = np.zeros(len(hashes), dtype=np.int64)
+                context[1:] = counts[n - 1][:-1]
+                usable = valid[n] & (context > 0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    estimate = np.where(usable, counts[n] / context, 0.0)
+                probability += lambdas[n] * estimate
+                weight += np.where(valid[n], lambdas[n], 0.0)
+            log_probability = np.log(probability / weight)
+
+            rows = np.repeat(np.arange(len(lengths)), lengths)
+            sums = np.bincount(rows, weights=log_probability, minlength=len(lengths))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                scores[start : start + len(lengths)] = np.where(
+                    lengths > 0, sums / lengths, np.nan
+                )
+        return scores
+
+    # Drops n-grams seen fewer than min_count times, except unigrams
+    def prune(self, min_count):
+        for n in range(1, self.order):
+            keep = self.counts[n] >= min_count
+            self.keys[n] = self.keys[n][keep]
+            self.counts[n] = self.counts[n][keep]
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        for n in range(self.order):
+            for name, values in [("keys", self.keys[n]), ("counts", self.counts[n])]:
+                tmp_path = os.path.join(path, f"{name}{n + 1}.tmp.npy")
+                np.save(tmp_path, values)
+                os.replace(tmp_path, os.path.join(path, f"{name}{n + 1}.npy"))
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump({"order": self.order, "n_tokens": self.n_tokens}, file)
+
+    # Tables are memory-mapped, so a large store is paged in on demand
+    def load(self, path=None):
+        path = path or self.path
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            meta = json.load(file)
+        self.order = meta["order"]
+        self.n_tokens = meta["n_tokens"]
+        self.keys = [
+            np.load(os.path.join(path, f"keys{n + 1}.npy"), mmap_mode="r")
+            for n in range(self.order)
+        ]
+        self.counts = [
+            np.load(os.path.join(path, f"counts{n + 1}.npy"), mmap_mode="r")
+            for n in range(self.order)
+        ]
+
+    def nbytes(self):
+        return sum(keys.nbytes + counts.nbytes for keys, counts in zip(self.keys, self.counts))
+
+    def print_stats(self):
+        sizes = ", ".join(f"{len(keys)} {n + 1}-grams" for n, keys in enumerate(self.keys))
+        print(
+            f"N-gram store: {self.n_tokens} tokens, {sizes}, "
+            f"{self.nbytes() / 1024**2:.1f} MB"
+        )
+
+
+def add_text_predictability(df, comments_df, order=ORDER):
+    store = NgramStore(order=order).partial_fit(comments_df["cleaned_body"])
+    store.print_stats()
+    scores = store.score(comments_df["cleaned_body"], leave_one_out=True)
+
+    predictability_df = (
+        pd.DataFrame({"username": comments_df["username"].to_numpy(), "score": scores})
+        .groupby("username")["score"]
+        .agg(["mean", "std"])
+        .reset_index()
+    )
+    predictability_df.columns = ["username", "avg_log_prob", "std_log_prob"]
+    df = df.merge(predictability_df, on="username", how="left")
+    print("Features avg_log_prob, std_log_prob created successfully.")
+
+    return df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build an n-gram count store.")
+    parser.add_argument("comments_file", help="Comments CSV.")
+    parser.add_argument("path", help="Output directory.")
+    parser.add_argument("--order", type=int, default=ORDER)
+    parser.add_argument(
+        "--prune", type=int, default=None, help="Drop n-grams with a lower count."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from data_preprocessing import clean_text
+
+    args = parse_args()
+    comments_df = pd.read_csv(args.comments_file).dropna(subset=["body"])
+    store = NgramStore(order=args.order)
+    store.partial_fit(comments_df["body"].apply(clean_text))
+    if args.prune is not None:
+        store.prune(args.prune)
+    store.save(args.path)
+    store.print_stats()
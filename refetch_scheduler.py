@@ -0,0 +1,313 @@
+import argparse
+import heapq
+import math
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+REFETCH_STATE_FILE = "data/refetch_state.csv"
+STATE_COLUMNS = [
+    "username",
+    "last_fetched",
+    "activity",
+    "account_age",
+    "cost",
+    "bot_score",
+]
+DAY = 24 * 3600
+STALE_AFTER = 7 * DAY
+YOUNG_ACCOUNT_DAYS = 30
+PAGE_SIZE = 100
+LIMIT = 1000
+# Requests for a user whose history has not been fetched yet
+DEFAULT_COST = 25
+WEIGHTS = {"activity": 1.0, "youth": 1.0, "uncertainty": 2.0}
+
+
+def listing_pages(n_items):
+    return min(n_items // PAGE_SIZE + 1, LIMIT // PAGE_SIZE)
+
+
+# Requests process_user and fetch_user_activity make for one user: the
+# profile, pages of both listings, and one lazy submission load per comment
+# for its title
+def request_cost(n_submissions, n_comments):
+    return 1 + listing_pages(n_submissions) + listing_pages(n_comments) + n_comments
+
+
+class Budget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.planned = 0
+        self.spent = 0
+        self.users = 0
+
+    @property
+    def remaining(self):
+        return self.limit - self.planned
+
+    def reserve(self, cost):
+        if cost > self.remaining:
+            return False
+        self.planned += cost
+        return True
+
+    def spend(self, cost):
+        self.spent += cost
+        self.users += 1
+
+    def print_summary(self):
+        print(
+            f"Request budget: {self.limit}, planned {self.planned}, "
+            f"spent {self.spent} on {self.users} users"
+        )
+
+
+# Priority queue of users to refresh under a request quota. A user's priority
+# grows with staleness and is higher for heavy posters, young accounts and
+# bot scores near the decision boundary.
+class RefetchScheduler:
+    def __init__(self, path=REFETCH_STATE_FILE, weights=None, clock=time.time):
+        self.path = path
+        self.weights = dict(WEIGHTS, **(weights or {}))
+        self.clock = clock
+        if path is not None and os.path.isfile(path):
+            self.state = pd.read_csv(path, index_col="username")
+        else:
+            self.state = pd.DataFrame(columns=STATE_COLUMNS).set_index("username")
+        # Fetches recorded since the state was last updated
+        self.pending = []
+
+    def users(self):
+        self.flush()
+        return list(self.state.index)
+
+    def set_bot_scores(self, scores):
+        self.flush()
+        scores = pd.Series(scores, dtype=np.float64)
+        self.state = self.state.reindex(self.state.index.union(scores.index))
+        self.state.loc[scores.index, "bot_score"] = scores
+
+    def priorities(self, users):
+        self.flush()
+        state = self.state.reindex(pd.Index(list(users), name="username"))
+        now = self.clock()
+        age = now - state["last_fetched"].astype(np.float64)
+        staleness = (age / STALE_AFTER).clip(0, 1).fillna(1.0)
+
+        activity = np.log1p(state["activity"].astype(np.float64))
+        activity = (activity / math.log1p(2 * LIMIT)).clip(0, 1).fillna(0.5)
+        youth = (
+            YOUNG_ACCOUNT_DAYS
+            / (YOUNG_ACCOUNT_DAYS + state["account_age"].astype(np.float64).clip(0))
+        ).fillna(0.5)
+        # 1 at a score of 0.5, 0 for confident predictions
+        uncertainty = (1 - (2 * state["bot_score"].astype(np.float64) - 1).abs()).fillna(1.0)
+
+        weights = self.weights
+        value = (
+            weights["activity"] * activity
+            + weights["youth"] * youth
+            + weights["uncertainty"] * uncertainty
+        )
+        return staleness * value / sum(weights.values())
+
+    def estimated_costs(self, users):
+        self.flush()
+        costs = self.state["cost"].reindex(list(users)).astype(np.float64)
+        default = self.state["cost"].median() if self.state["cost"].notna().any() else None
+        return costs.fillna(default if default is not None else DEFAULT_COST).astype(int)
+
+    # Users to fetch this run, highest priority first, within the budget
+    def plan(self, users, budget):
+        users = list(dict.fromkeys(users))
+        priorities = self.priorities(users).to_numpy()
+        costs = self.estimated_costs(users).to_numpy()
+        heap = [
+            (-priority, i) for i, priority in enumerate(priorities) if priority > 0
+        ]
+        heapq.heapify(heap)
+        planned = []
+        while heap and budget.remaining > 0:
+            _, i = heapq.heappop(heap)
+            # Users that do not fit are skipped in favour of cheaper ones
+            if budget.reserve(int(costs[i])):
+                planned.append(users[i])
+        return planned
+
+    # Buffered, since growing the state one row at a time copies it each time
+    def record(self, user_data, n_submissions, n_comments, budget=None):
+        cost = request_cost(n_submissions, n_comments)
+        self.pending.append(
+            {
+                "username": user_data["username"],
+                "last_fetched": self.clock(),
+                "activity": n_submissions + n_comments,
+                "account_age": user_data.get("account_age"),
+                "cost": cost,
+            }
+        )
+        if budget is not None:
+            budget.spend(cost)
+
+    # Applies the buffered fetches to the state in one step
+    def flush(self):
+        if not self.pending:
+            return
+        records = pd.DataFrame(self.pending).drop_duplicates("username", keep="last")
+        records = records.set_index("username")
+        self.pending = []
+        self.state = self.state.reindex(self.state.index.union(records.index))
+        self.state.loc[records.index, records.columns] = records
+
+    def save(self, path=None):
+        self.flush()
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        self.state.reindex(columns=STATE_COLUMNS[1:]).to_csv(tmp_path)
+        os.replace(tmp_path, path)
+
+
+# Simulation against the mock API
+def mutate_world(world, rng, activity, round_index, change_rate):
+    # Users change with probability proportional to their activity
+    mean_activity = np.mean(list(activity.values())) or 1
+    comment_ids = list(world["comments"])
+    changed = []
+    for name, n_items in activity.items():
+        if rng.random() >= min(1.0, change_rate * n_items / mean_activity):
+            continue
+        template = world["comments"][rng.choice(comment_ids)]
+        comment_id = f"r{round_index:x}{name.rsplit('_', 1)[-1]}"
+        world["comments"][comment_id] = dict(
+            template, id=comment_id, name=f"t1_{comment_id}", author=name, children=[]
+        )
+        world["user_comments"][name].insert(0, comment_id)
+        world["users"][name]["comment_karma"] += rng.randint(1, 100)
+        changed.append(name)
+    return changed
+
+
+def simulate(
+    policy,
+    rounds=10,
+    budget=300,
+    num_users=200,
+    change_rate=0.2,
+    seed=42,
+):
+    from mock_reddit_api import MockRedditServer, MockRedditState, build_world
+
+    import gatcher_reddit_data
+
+    rng = random.Random(seed)
+    order_rng = random.Random(seed + 1)
+    world = build_world(
+        seed,
+        subreddits=["funny"],
+        submissions_per_subreddit=20,
+        comments_per_submission=20,
+        num_users=num_users,
+    )
+    usernames = list(world["users"])
+    activity = {
+        name: len(world["user_comments"][name]) + len(world["user_submissions"][name])
+        for name in usernames
+    }
+    bot_scores = pd.Series({name: rng.betavariate(0.5, 0.5) for name in usernames})
+    uncertainty = 1 - (2 * bot_scores - 1).abs()
+
+    for key in ["BOTLOGIN", "BOTSECRET", "LOGIN", "PASSWORD"]:
+        os.environ.setdefault(key, "mock")
+    gatcher_reddit_data.HTTP_CACHE_FILE = None
+    gatcher_reddit_data.STEP = 10**9
+
+    clock = {"now": 0.0}
+    changed_at = pd.Series(0, index=usernames)
+    fetched_at = pd.Series(-1, index=usernames)
+    results = []
+    state = MockRedditState(world, seed=seed)
+    with MockRedditServer(state) as server, tempfile.TemporaryDirectory() as directory:
+        os.environ["REDDIT_API_URL"] = server.url
+        gatcher_reddit_data.get_reddit.cache_clear()
+        gatcher_reddit_data.get_http_cache.cache_clear()
+        gatcher_reddit_data.FETCHED_USERS_FILE = f"{directory}/fetched_users.txt"
+        scheduler = RefetchScheduler(None, clock=lambda: clock["now"])
+        scheduler.set_bot_scores(bot_scores)
+        spent = 0
+
+        for round_index in range(1, rounds + 1):
+            clock["now"] = round_index * DAY
+            changed = mutate_world(world, rng, activity, round_index, change_rate)
+            changed_at[changed] = round_index
+
+            before = state.stats["requests"]
+            run_budget = Budget(budget)
+            if policy == "priority":
+                users = scheduler.plan(usernames, run_budget)
+            else:
+                # Arbitrary order, as get_user_data iterates its set
+                users = []
+                costs = scheduler.estimated_costs(usernames)
+                for name in order_rng.sample(usernames, len(usernames)):
+                    if run_budget.reserve(int(costs[name])):
+                        users.append(name)
+            gatcher_reddit_data.get_user_data(
+                users, "simulation", scheduler=scheduler, budget=run_budget
+            )
+            fetched_at[users] = round_index
+            spent += state.stats["requests"] - before
+
+            fresh = fetched_at >= changed_at
+            results.append(
+                {
+                    "policy": policy,
+                    "round": round_index,
+                    "changed": len(changed),
+                    "fetched": len(users),
+                    "requests": state.stats["requests"] - before,
+                    "accounted": run_budget.spent,
+                    "freshness": round(fresh.mean(), 3),
+                    "detection_freshness": round(
+                        (fresh * uncertainty).sum() / uncertainty.sum(), 3
+                    ),
+                    "freshness_per_1k_requests": round(1000 * fresh.mean() / spent, 3),
+                }
+            )
+    return pd.DataFrame(results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate budgeted user re-fetching against the mock Reddit API."
+    )
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--budget", type=int, default=300, help="Requests per run.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--change-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = pd.concat(
+        [
+            simulate(policy, args.rounds, args.budget, args.users, args.change_rate, args.seed)
+            for policy in ["arbitrary", "priority"]
+        ]
+    )
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(results.to_string(index=False))
+        print(
+            results.groupby("policy")[
+                ["requests", "freshness", "detection_freshness"]
+            ].mean()
+        )
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+MEMORY_BUDGET = 256 * 1024**2
+
+
+# TF-IDF rows over one fitted vocabulary, L2-normalised so dot = cosine
+class SimilarityKernel:
+    def __init__(
+        self, texts=None, vectorizer=None, dtype=np.float64, memory_budget=MEMORY_BUDGET
+    ):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.dtype = dtype
+        self.memory_budget = memory_budget
+        self.vectorizer = vectorizer or TfidfVectorizer(dtype=dtype)
+        self.matrix = None
+        if texts is not None:
+            self.matrix = self.transform(texts, fit=vectorizer is None)
+
+    def transform(self, texts, fit=False):
+        from sklearn.preprocessing import normalize
+
+        if fit:
+            matrix = self.vectorizer.fit_transform(texts)
+        else:
+            matrix = self.vectorizer.transform(texts)
+        return normalize(matrix.astype(self.dtype)).tocsr()
+
+    def rows(self, index=None):
+        return self.matrix if index is None else self.matrix[index]
+
+    def centroid(self, rows):
+        return np.asarray(rows.mean(axis=0)).ravel()
+
+    def rowwise_dot(self, left_index, right_index):
+        result = np.empty(len(left_index), dtype=np.float64)
+        itemsize = np.dtype(self.dtype).itemsize
+        row_nnz = max(1, self.matrix.nnz // max(1, self.matrix.shape[0]))
+        # Two sliced operands plus their elementwise product per row
+        block_rows = max(1, self.memory_budget // (3 * row_nnz * (itemsize + 4)))
+        for start in range(0, len(left_index), block_rows):
+            stop = start + block_rows
+            left = self.matrix[left_index[start:stop]]
+            right = self.matrix[right_index[start:stop]]
+            result[start:stop] = np.asarray(left.multiply(right).sum(axis=1)).ravel()
+        return result
+
+
+# Segment reductions by user
+def segment_codes(keys):
+    codes, uniques = pd.factorize(keys)
+    return codes, uniques
+
+
+def segment_matrix(codes, n_segments, dtype=np.float64):
+    from scipy import sparse
+
+    valid = codes >= 0
+    return sparse.csr_matrix(
+        (
+            np.ones(valid.sum(), dtype=dtype),
+            (codes[valid], np.flatnonzero(valid)),
+        ),
+        shape=(n_segments, len(codes)),
+    )
+
+
+def segment_mean(values, codes, n_segments):
+    valid = codes >= 0
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=n_segments)
+    counts = np.bincount(codes[valid], minlength=n_segments)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+# Mean cosine over all pairs i != j in a segment:
+# sum_{i != j} x_i . x_j = ||sum_i x_i||^2 - sum_i ||x_i||^2
+def segment_pairwise_mean(matrix, codes, n_segments):
+    grouping = segment_matrix(codes, n_segments, matrix.dtype)
+    sums = grouping @ matrix
+    sum_sq = np.asarray(sums.multiply(sums).sum(axis=1)).ravel()
+    self_sq = grouping @ np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    counts = np.asarray(grouping.sum(axis=1)).ravel()
+    pairs = counts * (counts - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(pairs > 0, (sum_sq - self_sq) / pairs, np.nan), counts
@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+STAGE_WORKERS = 4
+
+
+# Nodes map a name to {"func": ..., "inputs": [names]}; func is called with
+# the results of its inputs in order. Sources are results known up front.
+def upstream(nodes, targets, sources=()):
+    needed = []
+    state = {}
+
+    def visit(name, path):
+        if name in sources or state.get(name) == "done":
+            return
+        if name not in nodes:
+            raise ValueError(f"Unknown stage or input {name!r} (needed by {path[-1]!r})")
+        if state.get(name) == "visiting":
+            raise ValueError(f"Cycle in stage graph: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dependency in nodes[name]["inputs"]:
+            visit(dependency, path + [name])
+        state[name] = "done"
+        needed.append(name)
+
+    for target in targets:
+        visit(target, ["<targets>"])
+    # Dependencies come before their dependents
+    return needed
+
+
+def run_graph(nodes, targets, sources=None, workers=STAGE_WORKERS):
+    results = dict(sources or {})
+    order = upstream(nodes, targets, results)
+    # Intermediates are dropped once their last consumer has finished
+    consumers = {name: 0 for name in order}
+    for name in order:
+        for dependency in nodes[name]["inputs"]:
+            if dependency in consumers:
+                consumers[dependency] += 1
+    waiting = {
+        name: {dependency for dependency in nodes[name]["inputs"] if dependency in consumers}
+        for name in order
+    }
+    seconds = {}
+
+    def execute(name):
+        start = time.perf_counter()
+        result = nodes[name]["func"](*[results[dependency] for dependency in nodes[name]["inputs"]])
+        seconds[name] = time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        running = {}
+
+        def submit_ready():
+            for name in [name for name in order if not waiting.get(name, True)]:
+                del waiting[name]
+                running[executor.submit(execute, name)] = name
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except BaseException:
+                    for pending in running:
+                        pending.cancel()
+                    raise
+                for dependency in nodes[name]["inputs"]:
+                    if dependency in consumers:
+                        consumers[dependency] -= 1
+                        if consumers[dependency] == 0 and dependency not in targets:
+                            del results[dependency]
+                for other in waiting:
+                    waiting[other].discard(name)
+            submit_ready()
+
+    print(
+        f"Stage graph: {len(order)} nodes in {time.perf_counter() - start:.2f}s "
+        f"({sum(seconds.values()):.2f}s of stage time, {workers} workers)"
+    )
+    return {name: results[name] for name in targets}
@@ -0,0 +1,441 @@
+import argparse
+import bisect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+
+DIRECTORY = "data"
+LOG_DIR = f"{DIRECTORY}/stream_log"
+STATE_FILE = f"{LOG_DIR}/user_state.json"
+SEGMENT_MAX_EVENTS = 100_000
+INDEX_INTERVAL = 1000
+QUEUE_SIZE = 10_000
+CHECKPOINT_EVERY = 5000
+BURST_SECONDS = 60
+
+SUBREDDITS = [
+    "funny",
+    "AskReddit",
+    "gaming",
+    "worldnews",
+    "todayilearned",
+]
+
+
+def get_reddit():
+    import praw
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+    return praw.Reddit(
+        client_id=os.getenv("BOTLOGIN"),
+        client_secret=os.getenv("BOTSECRET"),
+        password=os.getenv("PASSWORD"),
+        user_agent="lab7",
+        username=os.getenv("LOGIN"),
+    )
+
+
+# Events
+def comment_event(comment, subreddit):
+    return {
+        "kind": "comment",
+        "subreddit": subreddit,
+        "username": comment.author.name if comment.author else None,
+        "body": str(comment.body).replace("\n", " "),
+        "id": comment.id,
+        "parent_id": comment.parent_id,
+        "link_id": comment.link_id,
+        "score": comment.score,
+        "stickied": comment.stickied,
+        "created_utc": comment.created_utc,
+    }
+
+
+def submission_event(submission, subreddit):
+    return {
+        "kind": "submission",
+        "subreddit": subreddit,
+        "username": submission.author.name if submission.author else None,
+        "name": submission.name,
+        "title": str(submission.title).replace("\n", " "),
+        "text": str(submission.selftext).replace("\n", " "),
+        "score": submission.score,
+        "upvote_ratio": submission.upvote_ratio,
+        "created_utc": submission.created_utc,
+    }
+
+
+# Rolling on-disk event log
+class EventLog:
+    def __init__(self, log_dir=LOG_DIR, segment_max_events=SEGMENT_MAX_EVENTS):
+        self.log_dir = log_dir
+        self.segment_max_events = segment_max_events
+        os.makedirs(log_dir, exist_ok=True)
+        self.segments = sorted(
+            int(name.split(".")[0])
+            for name in os.listdir(log_dir)
+            if name.endswith(".log")
+        )
+        self.file = None
+        self.index_file = None
+        self.next_offset = self._recover_next_offset()
+
+    def _segment_path(self, base_offset, ext="log"):
+        return os.path.join(self.log_dir, f"{base_offset:020d}.{ext}")
+
+    def _recover_next_offset(self):
+        if not self.segments:
+            return 0
+        base_offset = self.segments[-1]
+        with open(self._segment_path(base_offset), "rb") as file:
+            count = sum(1 for line in file if line.endswith(b"\n"))
+        return base_offset + count
+
+    def _open_segment(self, base_offset):
+        self.close()
+        if base_offset not in self.segments:
+            self.segments.append(base_offset)
+        self.segment_base = base_offset
+        self.file = open(self._segment_path(base_offset), "ab")
+        self.index_file = open(self._segment_path(base_offset, "index"), "a")
+
+    def append(self, event):
+        if (
+            self.file is None
+            or self.next_offset - self.segment_base >= self.segment_max_events
+        ):
+            self._open_segment(self.next_offset)
+
+        offset = self.next_offset
+        if (offset - self.segment_base) % INDEX_INTERVAL == 0:
+            self.index_file.write(f"{offset},{self.file.tell()}\n")
+        event = dict(event, offset=offset)
+        self.file.write(json.dumps(event).encode() + b"\n")
+        self.next_offset += 1
+        return offset
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            self.index_file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.index_file.close()
+            self.file = None
+            self.index_file = None
+
+    def _seek_position(self, base_offset, offset):
+        position = 0
+        index_path = self._segment_path(base_offset, "index")
+        if os.path.isfile(index_path):
+            with open(index_path, "r") as file:
+                for line in file:
+                    entry_offset, entry_position = map(int, line.split(","))
+                    if entry_offset > offset:
+                        break
+                    position = entry_position
+        return position
+
+    # Replay events starting at a global offset
+    def replay(self, offset=0):
+        self.flush()
+        start = max(bisect.bisect_right(self.segments, offset) - 1, 0)
+        for base_offset in self.segments[start:]:
+            with open(self._segment_path(base_offset), "rb") as file:
+                file.seek(self._seek_position(base_offset, offset))
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    event = json.loads(line)
+                    if event["offset"] >= offset:
+                        yield event
+
+
+# Incremental per-user feature state
+def new_user_state():
+    return {
+        "num_comments": 0,
+        "num_posts": 0,
+        "total_length": 0,
+        "last_time": None,
+        "num_gaps": 0,
+        "gap_sum": 0.0,
+        "gap_sq_sum": 0.0,
+        "min_gap": None,
+        "burst_count": 0,
+        "hours": [0] * 24,
+        "subreddits": {},
+    }
+
+
+def update_user_state(user_state, event):
+    username = event.get("username")
+    if not username:
+        return
+    state = user_state.setdefault(username, new_user_state())
+
+    if event["kind"] == "comment":
+        state["num_comments"] += 1
+        state["total_length"] += len(event["body"])
+    else:
+        state["num_posts"] += 1
+
+    created = int(event["created_utc"])
+    if state["last_time"] is not None:
+        gap = max(created - state["last_time"], 0)
+        state["num_gaps"] += 1
+        state["gap_sum"] += gap
+        state["gap_sq_sum"] += gap * gap
+        state["min_gap"] = gap if state["min_gap"] is None else min(state["min_gap"], gap)
+        state["burst_count"] += gap <= BURST_SECONDS
+    state["last_time"] = max(created, state["last_time"] or created)
+    state["hours"][(created // 3600) % 24] += 1
+    subreddits = state["subreddits"]
+    subreddits[event["subreddit"]] = subreddits.get(event["subreddit"], 0) + 1
+
+
+def user_state_to_df(user_state):
+    rows = []
+    for username, state in user_state.items():
+        num_gaps = state["num_gaps"]
+        mean_gap = state["gap_sum"] / num_gaps if num_gaps else None
+        rows.append(
+            {
+                "username": username,
+                "num_comments": state["num_comments"],
+                "num_posts": state["num_posts"],
+                "avg_comment_length": (
+                    state["total_length"] / state["num_comments"]
+                    if state["num_comments"]
+                    else None
+                ),
+                "mean_inter_arrival": mean_gap,
+                "min_inter_arrival": state["min_gap"],
+                "burst_count": state["burst_count"],
+                "subreddit_count": len(state["subreddits"]),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def load_state(state_file=STATE_FILE):
+    if not os.path.isfile(state_file):
+        return {}, 0
+    with open(state_file, "r") as file:
+        checkpoint = json.load(file)
+    return checkpoint["users"], checkpoint["offset"]
+
+
+def save_state(user_state, offset, state_file=STATE_FILE):
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"offset": offset, "users": user_state}, file)
+    os.replace(tmp_path, state_file)
+
+
+# Stream readers (producers)
+def follow_stream(reddit, subreddit, kind, events, stop, stats):
+    stream = reddit.subreddit(subreddit).stream
+    items = stream.comments if kind == "comment" else stream.submissions
+    to_event = comment_event if kind == "comment" else submission_event
+
+    for item in items(skip_existing=True, pause_after=0):
+        if stop.is_set():
+            break
+        if item is None:
+            continue
+        event = to_event(item, subreddit)
+        # Blocks when the writer falls behind (backpressure)
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                events.put(event, timeout=1)
+                break
+            except queue.Full:
+                continue
+        stats["blocked_seconds"] += time.perf_counter() - start
+
+
+def run_stream(
+    reddit,
+    subreddits,
+    log,
+    user_state,
+    max_events=None,
+    queue_size=QUEUE_SIZE,
+    state_file=STATE_FILE,
+):
+    events = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stats = {"blocked_seconds": 0.0, "events": 0}
+    threads = [
+        threading.Thread(
+            target=follow_stream,
+            args=(reddit, subreddit, kind, events, stop, stats),
+            daemon=True,
+        )
+        for subreddit in subreddits
+        for kind in ["comment", "submission"]
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while max_events is None or stats["events"] < max_events:
+            try:
+                event = events.get(timeout=1)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in threads):
+                    break
+                continue
+            log.append(event)
+            update_user_state(user_state, event)
+            stats["events"] += 1
+
+            if stats["events"] % CHECKPOINT_EVERY == 0:
+                log.flush()
+                save_state(user_state, log.next_offset, state_file)
+                print(
+                    f"Events: {stats['events']}, queue: {events.qsize()}, "
+                    f"blocked: {stats['blocked_seconds']:.1f}s"
+                )
+    except KeyboardInterrupt:
+        print("Stopping stream...")
+    finally:
+        stop.set()
+        log.flush()
+        save_state(user_state, log.next_offset, state_file)
+
+    return stats
+
+
+def replay_log(log, user_state, offset):
+    count = 0
+    for event in log.replay(offset):
+        update_user_state(user_state, event)
+        count += 1
+    print(f"Replayed {count} events from offset {offset}")
+    return count
+
+
+# Local fake stream generator
+class FakeStream:
+    def __init__(self, subreddit, rate, seed, users):
+        self.subreddit = subreddit
+        self.rate = rate
+        self.random = random.Random(seed)
+        self.users = users
+        self.next_id = 0
+
+    def _author(self):
+        return SimpleNamespace(name=self.random.choice(self.users))
+
+    def _pause(self):
+        if self.rate:
+            time.sleep(self.random.expovariate(self.rate))
+
+    def comments(self, skip_existing=True, pause_after=None):
+        while True:
+            self._pause()
+            self.next_id += 1
+            yield SimpleNamespace(
+                author=self._author(),
+                body=f"fake comment {self.next_id} in {self.subreddit}",
+                id=f"{self.subreddit[:3]}{self.next_id:x}",
+                parent_id=f"t3_{self.subreddit[:3]}",
+                link_id=f"t3_{self.subreddit[:3]}",
+                score=self.random.randint(-5, 100),
+                stickied=False,
+                created_utc=time.time(),
+            )
+
+    def submissions(self, skip_existing=True, pause_after=None):
+        while True:
+            self._pause()
+            self._pause()
+            self.next_id += 1
+            yield SimpleNamespace(
+                author=self._author(),
+                name=f"t3_{self.subreddit[:3]}{self.next_id:x}",
+                title=f"fake post {self.next_id}",
+                selftext="",
+                score=self.random.randint(0, 1000),
+                upvote_ratio=self.random.random(),
+                created_utc=time.time(),
+            )
+
+
+class FakeReddit:
+    def __init__(self, rate=100.0, seed=42, num_users=1000):
+        self.rate = rate
+        self.seed = seed
+        self.users = [f"fake_user_{i}" for i in range(num_users)]
+
+    def subreddit(self, name):
+        seed = f"{self.seed}-{name}"
+        return SimpleNamespace(stream=FakeStream(name, self.rate, seed, self.users))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream subreddit activity.")
+    parser.add_argument("--subreddits", nargs="+", default=SUBREDDITS)
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    parser.add_argument("--segment-max-events", type=int, default=SEGMENT_MAX_EVENTS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--max-events", type=int, default=None)
+    parser.add_argument(
+        "--replay-from",
+        type=int,
+        default=None,
+        help="Rebuild user state from this log offset before streaming.",
+    )
+    parser.add_argument("--replay-only", action="store_true")
+    parser.add_argument(
+        "--fake", action="store_true", help="Use the local fake stream generator."
+    )
+    parser.add_argument("--fake-rate", type=float, default=100.0)
+    parser.add_argument("--features-file", default=f"{DIRECTORY}/stream_features.csv")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = datetime.now()
+
+    log = EventLog(args.log_dir, args.segment_max_events)
+    state_file = os.path.join(args.log_dir, "user_state.json")
+    if args.replay_from is not None:
+        user_state, offset = {}, args.replay_from
+    else:
+        user_state, offset = load_state(state_file)
+    replay_log(log, user_state, offset)
+
+    if not args.replay_only:
+        reddit = FakeReddit(args.fake_rate) if args.fake else get_reddit()
+        stats = run_stream(
+            reddit,
+            args.subreddits,
+            log,
+            user_state,
+            args.max_events,
+            args.queue_size,
+            state_file,
+        )
+        print(f"Streamed {stats['events']} events")
+    log.close()
+
+    user_state_to_df(user_state).to_csv(args.features_file, index=False)
+    print(f"User features saved to {args.features_file}")
+    print(f"Time elapsed: {datetime.now() - start}")
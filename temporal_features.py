@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+BURST_SECONDS = 60
+HOURS_PER_DAY = 24
+
+
+# Per-user sorted timestamp index
+def to_epoch_seconds(dates):
+    dates = pd.to_datetime(dates, errors="coerce", utc=True)
+    seconds = (dates - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    return seconds
+
+
+# Merged data can hold one comment twice, from the subreddit listing and from
+# the user history, so each comment id and post name is counted once
+def unique_events(frame, id_column):
+    if id_column not in frame.columns:
+        return frame[["username", "date"]]
+    duplicated = frame[id_column].duplicated() & frame[id_column].notna()
+    return frame.loc[~duplicated, ["username", "date"]]
+
+
+def build_user_time_index(comments_df, posts_df=None):
+    frames = [unique_events(comments_df, "id")]
+    if posts_df is not None:
+        frames.append(unique_events(posts_df, "name"))
+    events = pd.concat(frames, ignore_index=True)
+
+    seconds = to_epoch_seconds(events["date"])
+    valid = events["username"].notna().to_numpy() & seconds.notna().to_numpy()
+    codes, usernames = pd.factorize(events["username"][valid])
+    timestamps = seconds[valid].to_numpy(dtype=np.int64)
+
+    # Single sort by user, then by time within user
+    order = np.lexsort((timestamps, codes))
+    codes = codes[order]
+    timestamps = timestamps[order]
+
+    counts = np.bincount(codes, minlength=len(usernames))
+    offsets = np.zeros(len(usernames) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return np.asarray(usernames), offsets, codes, timestamps
+
+
+# Segment reductions over the index
+def segment_sum(values, codes, n_segments):
+    return np.bincount(codes, weights=values, minlength=n_segments)
+
+
+def segment_min(values, offsets, empty_value=np.nan):
+    result = np.full(len(offsets) - 1, empty_value, dtype=np.float64)
+    non_empty = offsets[1:] > offsets[:-1]
+    if len(values) and non_empty.any():
+        starts = offsets[:-1][non_empty]
+        result[non_empty] = np.minimum.reduceat(values, starts)
+    return result
+
+
+def inter_arrival_stats(offsets, codes, timestamps):
+    n_users = len(offsets) - 1
+
+    # Gaps between consecutive events of the same user
+    same_user = codes[1:] == codes[:-1]
+    gaps = np.diff(timestamps)[same_user].astype(np.float64)
+    gap_codes = codes[1:][same_user]
+
+    gap_counts = np.bincount(gap_codes, minlength=n_users)
+    gap_offsets = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(gap_counts, out=gap_offsets[1:])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gap_sum = segment_sum(gaps, gap_codes, n_users)
+        gap_sq_sum = segment_sum(gaps**2, gap_codes, n_users)
+        mean_gap = gap_sum / gap_counts
+        variance = np.maximum(gap_sq_sum / gap_counts - mean_gap**2, 0)
+        cv_gap = np.sqrt(variance) / mean_gap
+    cv_gap[mean_gap == 0] = 0.0
+
+    bursts = np.bincount(
+        gap_codes, weights=(gaps <= BURST_SECONDS), minlength=n_users
+    )
+    min_gap = segment_min(gaps, gap_offsets)
+
+    return mean_gap, cv_gap, bursts, min_gap
+
+
+def hour_entropy(codes, timestamps, n_users):
+    hours = (timestamps // 3600) % HOURS_PER_DAY
+    counts = np.bincount(
+        codes * HOURS_PER_DAY + hours, minlength=n_users * HOURS_PER_DAY
+    ).reshape(n_users, HOURS_PER_DAY)
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = counts / totals
+        entropy = -np.where(p > 0, p * np.log2(p), 0).sum(axis=1)
+    entropy[totals[:, 0] == 0] = np.nan
+    return entropy
+
+
+def add_temporal_features(df, comments_df, posts_df=None):
+    usernames, offsets, codes, timestamps = build_user_time_index(
+        comments_df, posts_df
+    )
+    n_users = len(usernames)
+
+    mean_gap, cv_gap, bursts, min_gap = inter_arrival_stats(
+        offsets, codes, timestamps
+    )
+    temporal_df = pd.DataFrame(
+        {
+            "username": usernames,
+            "mean_inter_arrival": mean_gap,
+            "cv_inter_arrival": cv_gap,
+            "hour_entropy": hour_entropy(codes, timestamps, n_users),
+            "burst_count": bursts,
+            "min_inter_arrival": min_gap,
+        }
+    )
+    df = df.merge(temporal_df, on="username", how="left")
+    print(
+        "Features mean_inter_arrival, cv_inter_arrival, hour_entropy, burst_count, "
+        "min_inter_arrival created successfully."
+    )
+
+    return df
@@ -0,0 +1,56 @@
+import random
+
+from username_families import username_families
+
+WORDS = """
+amber anchor apple arrow autumn badger basil beacon birch blaze bold bramble breeze
+brook cactus canyon cedar cinder clover cobalt comet copper coral crane crimson dawn
+delta desert drift ember falcon fern flint frost garnet ginger glacier granite harbor
+hazel heron indigo iris jasper juniper kestrel lantern lemon lotus lunar maple marble
+meadow mango nebula nimble oak ocean olive onyx orbit otter pebble pepper pine plum
+quartz quill raven river rocket saffron sage shadow silver sparrow spruce storm summit
+tiger timber topaz tulip velvet violet walnut willow winter zephyr
+""".split()
+
+
+# Real-looking usernames: pairs of words written the ways people register
+# them, some with a number appended
+def ordinary_usernames():
+    rng = random.Random(0)
+    names = set()
+    for first in WORDS:
+        for second in WORDS:
+            if first == second or rng.random() > 0.15:
+                continue
+            style = rng.random()
+            if style < 0.3:
+                name = first + second
+            elif style < 0.6:
+                name = first.capitalize() + second.capitalize()
+            else:
+                name = f"{first}_{second}"
+            if rng.random() < 0.3:
+                name += str(int(rng.random() * 1000))
+            names.add(name[:20])
+    return sorted(names)
+
+
+def test_ordinary_names_do_not_collapse_into_one_family():
+    names = ordinary_usernames()
+    families = username_families(names)
+    assert len(names) > 1000
+    assert families["username_family_size"].max() < 20
+    assert families["username_family"].nunique() > 0.9 * len(names)
+
+
+def test_generated_names_form_one_family():
+    farm = [f"spambot{i}" for i in range(40)] + [f"SpamBot{i}" for i in range(10)]
+    families = username_families(ordinary_usernames() + farm).set_index("username")
+    assert families.loc[farm, "username_family"].nunique() == 1
+    assert (families.loc[farm, "username_family_size"] == len(farm)).all()
+
+
+def test_family_ids_agree_with_family_sizes():
+    names = ["abcdefx", "abcdefy", "abcdefz", "abcdegx", "abcdehx", "abcdeix", "abcdejx"]
+    families = username_families(names)
+    assert (families.groupby("username_family")["username_family_size"].nunique() == 1).all()
@@ -0,0 +1,383 @@
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from distributed_features import SHARDS, shard_of
+from feature_cache import hash_frame
+
+FORMAT_VERSION = 1
+TEXT_ARCHIVE_DIR = "data/text_archive"
+TEXT_COLUMNS = ["body", "post_title"]
+# Comments per compressed block: small blocks keep single-user reads cheap,
+# the shared dictionary keeps them compressing well
+BLOCK_ROWS = 512
+DICTIONARY_SIZE = 112 * 1024
+DICTIONARY_SAMPLES = 100_000
+COMPRESSION_LEVEL = 9
+ARRAYS = [
+    "body_lengths",
+    "title_codes",
+    "block_rows",
+    "block_offsets",
+    "partition_blocks",
+    "user_rows",
+    "title_offsets",
+]
+
+# Layout of an archive directory:
+#   meta.json, dictionary.bin     format, counts and the trained zstd dictionary
+#   rows.parquet                  every other comment column, in archive order
+#   bodies.zst                    compressed blocks of concatenated bodies
+#   block_rows.npy, block_offsets.npy   first row and byte offset of each block
+#   body_lengths.npy              UTF-8 length of each body, -1 when missing
+#   titles.zst, title_offsets.npy, title_codes.npy   deduplicated post titles
+#   users.json, user_rows.npy     first row of each user
+#   partition_blocks.npy          first block of each user partition
+
+
+def encode_texts(texts):
+    encoded = [
+        b"" if text is None or text != text else str(text).encode("utf-8")
+        for text in texts
+    ]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    missing = np.fromiter(
+        (text is None or text != text for text in texts), dtype=bool, count=len(encoded)
+    )
+    return encoded, np.where(missing, -1, lengths)
+
+
+def split_texts(data, lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(np.maximum(lengths, 0), out=offsets[1:])
+    texts = np.empty(len(lengths), dtype=object)
+    for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+        texts[i] = data[start:stop].decode("utf-8") if lengths[i] >= 0 else None
+    return texts
+
+
+def train_dictionary(encoded, size=DICTIONARY_SIZE, samples=DICTIONARY_SAMPLES, seed=0):
+    import zstandard
+
+    sample = [encoded[i] for i in np.random.default_rng(seed).permutation(len(encoded))[:samples]]
+    try:
+        return zstandard.train_dictionary(size, [text for text in sample if text]).as_bytes()
+    except zstandard.ZstdError:
+        # Too little text to train on; blocks are compressed without one
+        return b""
+
+
+# Block boundaries every block_rows rows, restarting at each partition so a
+# partition reads only its own blocks
+def block_boundaries(partition_rows, block_rows):
+    starts = [
+        np.arange(start, stop, block_rows)
+        for start, stop in zip(partition_rows[:-1], partition_rows[1:])
+    ]
+    block_starts = np.concatenate(starts + [partition_rows[-1:]]).astype(np.int64)
+    partition_blocks = np.searchsorted(block_starts, partition_rows)
+    return block_starts, partition_blocks
+
+
+def build_text_archive(
+    comments_df,
+    path=TEXT_ARCHIVE_DIR,
+    block_rows=BLOCK_ROWS,
+    partitions=SHARDS,
+    dictionary=True,
+    level=COMPRESSION_LEVEL,
+):
+    import zstandard
+
+    os.makedirs(path, exist_ok=True)
+    # Users are contiguous and grouped by the shard distributed_features
+    # assigns them, so users and shards map to ranges of blocks
+    df = comments_df.reset_index(drop=True)
+    partition = shard_of(df["username"], partitions)
+    order = np.lexsort((df["username"].fillna("").to_numpy(dtype=str), partition))
+    df = df.iloc[order].reset_index(drop=True)
+    partition = partition[order]
+
+    user_codes, users = pd.factorize(df["username"].fillna(""), sort=False)
+    user_rows = np.append(
+        np.flatnonzero(np.diff(user_codes, prepend=-1) != 0), len(df)
+    ).astype(np.int64)
+    partition_rows = np.searchsorted(partition, np.arange(partitions + 1), side="left")
+    block_starts, partition_blocks = block_boundaries(partition_rows, block_rows)
+
+    encoded, body_lengths = encode_texts(df["body"].tolist())
+    dictionary_data = train_dictionary(encoded) if dictionary else b""
+    compressor = zstandard.ZstdCompressor(
+        level=level,
+        dict_data=zstandard.ZstdCompressionDict(dictionary_data) if dictionary_data else None,
+    )
+    block_offsets = np.zeros(len(block_starts), dtype=np.int64)
+    with open(os.path.join(path, "bodies.zst"), "wb") as file:
+        for i, (start, stop) in enumerate(zip(block_starts[:-1], block_starts[1:])):
+            file.write(compressor.compress(b"".join(encoded[start:stop])))
+            block_offsets[i + 1] = file.tell()
+
+    title_codes, titles = pd.factorize(df["post_title"])
+    encoded_titles, title_lengths = encode_texts(list(titles))
+    title_offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+    np.cumsum(title_lengths, out=title_offsets[1:])
+    with open(os.path.join(path, "titles.zst"), "wb") as file:
+        file.write(compressor.compress(b"".join(encoded_titles)))
+
+    arrays = {
+        "body_lengths": body_lengths.astype(np.int32),
+        "title_codes": title_codes.astype(np.int32),
+        "block_rows": block_starts,
+        "block_offsets": block_offsets,
+        "partition_blocks": partition_blocks.astype(np.int64),
+        "user_rows": user_rows,
+        "title_offsets": title_offsets,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    df.drop(columns=TEXT_COLUMNS).to_parquet(os.path.join(path, "rows.parquet"), index=False)
+    with open(os.path.join(path, "dictionary.bin"), "wb") as file:
+        file.write(dictionary_data)
+    with open(os.path.join(path, "users.json"), "w") as file:
+        json.dump([str(user) for user in users], file)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump(
+            {
+                "version": FORMAT_VERSION,
+                "comments": len(df),
+                "blocks": len(block_starts) - 1,
+                "titles": len(titles),
+                "partitions": partitions,
+                "level": level,
+                "columns": list(comments_df.columns),
+                "hash": hash_frame(comments_df),
+            },
+            file,
+        )
+    print(
+        f"Text archive with {len(df)} comments in {len(block_starts) - 1} blocks "
+        f"and {len(titles)} titles saved to {path}"
+    )
+    return TextArchive(path)
+
+
+class TextArchive:
+    def __init__(self, path=TEXT_ARCHIVE_DIR):
+        import zstandard
+
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(path, "users.json"), "r") as file:
+            self.usernames = json.load(file)
+        self.user_index = {name: i for i, name in enumerate(self.usernames)}
+        with open(os.path.join(path, "dictionary.bin"), "rb") as file:
+            dictionary_data = file.read()
+        self.decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary_data) if dictionary_data else None
+        )
+        self.bodies_file = open(os.path.join(path, "bodies.zst"), "rb")
+        with open(os.path.join(path, "titles.zst"), "rb") as file:
+            titles = self.decompressor.decompress(file.read())
+        self.titles = np.append(
+            split_texts(titles, np.diff(self.title_offsets)), None
+        )
+        self._rows = None
+
+    def __len__(self):
+        return self.meta["comments"]
+
+    @property
+    def num_blocks(self):
+        return self.meta["blocks"]
+
+    # Non-text columns, read once on first use
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = pd.read_parquet(os.path.join(self.path, "rows.parquet"))
+        return self._rows
+
+    def block_bodies(self, block):
+        start, stop = self.block_offsets[block], self.block_offsets[block + 1]
+        self.bodies_file.seek(start)
+        data = self.decompressor.decompress(self.bodies_file.read(stop - start))
+        return split_texts(
+            data, self.body_lengths[self.block_rows[block] : self.block_rows[block + 1]]
+        )
+
+    # Bodies of the given rows, decompressing only the blocks they fall in
+    def bodies(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        bodies = np.empty(len(rows), dtype=object)
+        blocks = np.searchsorted(self.block_rows, rows, side="right") - 1
+        for block in np.unique(blocks):
+            selected = np.flatnonzero(blocks == block)
+            bodies[selected] = self.block_bodies(block)[
+                rows[selected] - self.block_rows[block]
+            ]
+        return bodies
+
+    def user_rows_of(self, usernames):
+        indexes = [self.user_index[name] for name in usernames if name in self.user_index]
+        ranges = [
+            np.arange(self.user_rows[i], self.user_rows[i + 1]) for i in sorted(indexes)
+        ]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def partition_rows_of(self, partition):
+        start_block = self.partition_blocks[partition]
+        stop_block = self.partition_blocks[partition + 1]
+        return np.arange(self.block_rows[start_block], self.block_rows[stop_block])
+
+    def frame(self, rows):
+        df = self.rows.iloc[rows].reset_index(drop=True)
+        df["body"] = self.bodies(rows)
+        df["post_title"] = self.titles[self.title_codes[rows]]
+        return df[self.meta["columns"]]
+
+    # Comments of some users or of one partition (a distributed_features
+    # shard when the partition counts match), or everything
+    def read(self, usernames=None, partition=None):
+        if usernames is not None:
+            return self.frame(self.user_rows_of(usernames))
+        if partition is not None:
+            return self.frame(self.partition_rows_of(partition))
+        return self.frame(np.arange(len(self)))
+
+    # Block by block, so a stage can stream the comments in bounded memory
+    def iter_blocks(self, blocks=None):
+        for block in range(self.num_blocks) if blocks is None else blocks:
+            rows = np.arange(self.block_rows[block], self.block_rows[block + 1])
+            df = self.rows.iloc[rows].reset_index(drop=True)
+            df["body"] = self.block_bodies(block)
+            df["post_title"] = self.titles[self.title_codes[rows]]
+            yield df[self.meta["columns"]]
+
+    def nbytes(self):
+        return sum(
+            os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)
+        )
+
+    def close(self):
+        self.bodies_file.close()
+
+
+# Reuses the archive at path when it was built from the same comments and
+# partitions
+def open_text_archive(path, comments_df, partitions=SHARDS):
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.isfile(meta_path):
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        if (
+            meta["version"] == FORMAT_VERSION
+            and meta["partitions"] == partitions
+            and meta["hash"] == hash_frame(comments_df)
+        ):
+            print(f"Loading text archive from {path}")
+            return TextArchive(path)
+    return build_text_archive(comments_df, path, partitions=partitions)
+
+
+def file_size(write):
+    buffer = io.BytesIO()
+    write(buffer)
+    return buffer.tell()
+
+
+# Compression ratio, decode throughput and single-user read latency of the
+# archive against CSV and pickle, for a few block sizes
+def benchmark(comments_df, path, block_sizes=(128, BLOCK_ROWS, 4096), users=200, seed=0):
+    text_bytes = sum(
+        len(text.encode("utf-8"))
+        for column in TEXT_COLUMNS
+        for text in comments_df[column].dropna().astype(str)
+    )
+    csv_size = file_size(lambda buffer: comments_df.to_csv(buffer, index=False))
+    pickle_size = file_size(lambda buffer: comments_df.to_pickle(buffer, compression=None))
+    print(
+        f"{len(comments_df)} comments, {text_bytes / 1024**2:.1f} MB of body and title "
+        f"text; CSV {csv_size / 1024**2:.1f} MB, pickle {pickle_size / 1024**2:.1f} MB"
+    )
+    rng = np.random.default_rng(seed)
+    sample_users = rng.choice(
+        comments_df["username"].dropna().unique(),
+        size=min(users, comments_df["username"].nunique()),
+        replace=False,
+    )
+    results = []
+    for block_rows in block_sizes:
+        for dictionary in (True, False):
+            archive_path = os.path.join(path, f"blocks{block_rows}-{'dict' if dictionary else 'plain'}")
+            start = time.perf_counter()
+            archive = build_text_archive(
+                comments_df, archive_path, block_rows, dictionary=dictionary
+            )
+            build_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for block in range(archive.num_blocks):
+                archive.block_bodies(block)
+            decode_seconds = time.perf_counter() - start
+
+            archive.rows
+            start = time.perf_counter()
+            for username in sample_users:
+                archive.read(usernames=[username])
+            user_seconds = (time.perf_counter() - start) / len(sample_users)
+
+            text_size = sum(
+                os.path.getsize(os.path.join(archive_path, name))
+                for name in ["bodies.zst", "titles.zst", "dictionary.bin", "title_codes.npy"]
+            )
+            results.append(
+                {
+                    "block_rows": block_rows,
+                    "dictionary": dictionary,
+                    "text_ratio": text_bytes / text_size,
+                    "archive_mb": archive.nbytes() / 1024**2,
+                    "vs_csv": csv_size / archive.nbytes(),
+                    "build_s": build_seconds,
+                    "decode_mb_s": text_bytes / 1024**2 / decode_seconds,
+                    "user_read_ms": user_seconds * 1000,
+                }
+            )
+            archive.close()
+    results_df = pd.DataFrame(results)
+    print(results_df.to_string(index=False, float_format="{:.2f}".format))
+    return results_df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compressed archive of comment text.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Archive a comments file.")
+    build_parser.add_argument("comments_file", help="Comments CSV or pickle.")
+    build_parser.add_argument("path", nargs="?", default=TEXT_ARCHIVE_DIR)
+    build_parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    build_parser.add_argument("--partitions", type=int, default=SHARDS)
+    bench_parser = subparsers.add_parser("bench", help="Benchmark block sizes.")
+    bench_parser.add_argument("comments_file", help="Comments CSV or pickle.")
+    bench_parser.add_argument("path", help="Scratch directory for the archives.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.comments_file.endswith(".pkl"):
+        comments_df = pd.read_pickle(args.comments_file)
+    else:
+        comments_df = pd.read_csv(args.comments_file)
+    comments_df = comments_df.dropna(subset=["body"]).drop_duplicates()
+    if args.command == "build":
+        build_text_archive(comments_df, args.path, args.block_rows, args.partitions)
+    else:
+        benchmark(comments_df, args.path)
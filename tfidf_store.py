@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+TFIDF_STORE_DIR = "data/.tfidf_store"
+HASH_FEATURES = 2**18
+
+
+# Vocabulary and document frequencies that persist across runs.
+# Columns [0, n_hash) are hash buckets for terms outside the vocabulary,
+# vocabulary terms follow in the order they were first seen, so the columns
+# of earlier vectors never move until the store is pruned.
+class TfidfStore:
+    def __init__(self, path=None, max_features=None, n_hash=HASH_FEATURES):
+        self.path = path
+        self.max_features = max_features
+        self.n_hash = n_hash
+        self.terms = []
+        self.vocabulary = {}
+        self.df = np.zeros(n_hash, dtype=np.int64)
+        self.n_docs = 0
+        self.seen = np.zeros(0, dtype=np.uint64)
+        self.generation = 0
+        if path is not None and os.path.isfile(os.path.join(path, "meta.json")):
+            self.load()
+
+    @property
+    def n_features(self):
+        return self.n_hash + len(self.terms)
+
+    def _batch_counts(self, texts):
+        from scipy import sparse
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        vectorizer = CountVectorizer()
+        try:
+            counts = vectorizer.fit_transform(texts)
+        except ValueError:
+            # Batch without a single token
+            return sparse.csr_matrix((len(texts), 0), dtype=np.int64), []
+        return counts.tocsr(), vectorizer.get_feature_names_out()
+
+    def _columns(self, terms, add=False):
+        from sklearn.utils import murmurhash3_32
+
+        columns = np.empty(len(terms), dtype=np.int64)
+        for i, term in enumerate(terms):
+            index = self.vocabulary.get(term)
+            if index is None and add and (
+                self.max_features is None or len(self.terms) < self.max_features
+            ):
+                index = len(self.terms)
+                self.vocabulary[term] = index
+                self.terms.append(term)
+            if index is None:
+                columns[i] = murmurhash3_32(term, positive=True) % self.n_hash
+            else:
+                columns[i] = self.n_hash + index
+        return columns
+
+    # Cost is proportional to the batch, not to the documents seen so far
+    def partial_fit(self, texts, keys=None):
+        counts, terms = self._batch_counts(list(texts))
+        # Rows of a CSR count matrix hold each term at most once
+        doc_freq = np.bincount(counts.indices, minlength=len(terms))
+        # Frequent terms claim the free vocabulary slots first
+        order = np.argsort(-doc_freq, kind="stable")
+        columns = np.empty(len(terms), dtype=np.int64)
+        columns[order] = self._columns([terms[i] for i in order], add=True)
+        if len(self.df) < self.n_features:
+            self.df = np.concatenate(
+                [self.df, np.zeros(self.n_features - len(self.df), dtype=np.int64)]
+            )
+        np.add.at(self.df, columns, doc_freq)
+        self.n_docs += counts.shape[0]
+        if keys is not None:
+            self.seen = np.union1d(self.seen, np.asarray(keys, dtype=np.uint64))
+        return self
+
+    # Reduce step for stores fitted on disjoint shards of the documents
+    def merge(self, other):
+        if other.n_hash != self.n_hash:
+            raise ValueError("Cannot merge TF-IDF stores with different n_hash")
+        other_df = other.df[other.n_hash :]
+        order = np.argsort(-other_df, kind="stable")
+        columns = np.empty(len(other.terms), dtype=np.int64)
+        columns[order] = self._columns([other.terms[i] for i in order], add=True)
+        if len(self.df) < self.n_features:
+            self.df = np.concatenate(
+                [self.df, np.zeros(self.n_features - len(self.df), dtype=np.int64)]
+            )
+        self.df[: self.n_hash] += other.df[: other.n_hash]
+        np.add.at(self.df, columns, other_df)
+        self.n_docs += other.n_docs
+        self.seen = np.union1d(self.seen, other.seen)
+        return self
+
+    def idf(self):
+        # Same smoothing as TfidfVectorizer(smooth_idf=True)
+        return np.log((1 + self.n_docs) / (1 + self.df)) + 1
+
+    def transform(self, texts):
+        from scipy import sparse
+        from sklearn.preprocessing import normalize
+
+        counts, terms = self._batch_counts(list(texts))
+        columns = self._columns(terms)
+        mapping = sparse.csr_matrix(
+            (np.ones(len(terms)), (np.arange(len(terms)), columns)),
+            shape=(len(terms), self.n_features),
+        )
+        matrix = (counts @ mapping) @ sparse.diags(self.idf())
+        return normalize(matrix).tocsr()
+
+    def fit_transform(self, texts):
+        texts = list(texts)
+        return self.partial_fit(texts).transform(texts)
+
+    def new_documents(self, keys):
+        return ~np.isin(np.asarray(keys, dtype=np.uint64), self.seen)
+
+    # Rare terms fall back to their hash bucket; changes column indexes
+    def prune(self, min_df):
+        vocabulary_df = self.df[self.n_hash :]
+        keep = vocabulary_df >= min_df
+        df = self.df[: self.n_hash].copy()
+        dropped = np.flatnonzero(~keep)
+        if len(dropped):
+            from sklearn.utils import murmurhash3_32
+
+            buckets = [
+                murmurhash3_32(self.terms[i], positive=True) % self.n_hash
+                for i in dropped
+            ]
+            np.add.at(df, buckets, vocabulary_df[dropped])
+        self.terms = [term for term, kept in zip(self.terms, keep) if kept]
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.df = np.concatenate([df, vocabulary_df[keep]])
+        self.generation += 1
+        print(f"Pruned {len(dropped)} terms with df < {min_df}")
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps([self.generation, self.n_docs, self.n_hash]).encode()
+        )
+        digest.update(self.df.tobytes())
+        return digest.hexdigest()
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        for name, value in [("df", self.df), ("seen", self.seen)]:
+            tmp_path = os.path.join(path, f"{name}.tmp.npy")
+            np.save(tmp_path, value)
+            os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+        meta = {
+            "n_docs": self.n_docs,
+            "n_hash": self.n_hash,
+            "max_features": self.max_features,
+            "generation": self.generation,
+            "terms": self.terms,
+        }
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+    def load(self, path=None):
+        path = path or self.path
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            meta = json.load(file)
+        self.n_docs = meta["n_docs"]
+        self.n_hash = meta["n_hash"]
+        self.generation = meta["generation"]
+        if self.max_features is None:
+            self.max_features = meta["max_features"]
+        self.terms = meta["terms"]
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.df = np.load(os.path.join(path, "df.npy"))
+        self.seen = np.load(os.path.join(path, "seen.npy"))
+
+    def print_stats(self):
+        print(
+            f"TF-IDF store: {self.n_docs} documents, {len(self.terms)} terms, "
+            f"{self.n_hash} hash buckets, generation {self.generation}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect or prune a TF-IDF store.")
+    parser.add_argument("path", nargs="?", default=TFIDF_STORE_DIR)
+    parser.add_argument(
+        "--prune", type=int, default=None, help="Drop terms with a lower df."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = TfidfStore(args.path)
+    if args.prune is not None:
+        store.prune(args.prune)
+        store.save()
+    store.print_stats()
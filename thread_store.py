@@ -0,0 +1,243 @@
+import argparse
+import json
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+from feature_cache import hash_frame
+
+FORMAT_VERSION = 1
+# Every column the store keeps, so edited or rescored comments rebuild it
+THREAD_COLUMNS = ["post_title", "id", "parent_id", "username", "body", "score", "date"]
+ARRAYS = [
+    "comment_ids",
+    "parents",
+    "parent_ids",
+    "parent_is_comment",
+    "authors",
+    "scores",
+    "created",
+    "text_offsets",
+    "thread_offsets",
+    "title_offsets",
+]
+
+
+def decode_base36(values):
+    return np.array(
+        [int(value, 36) if isinstance(value, str) and value else -1 for value in values],
+        dtype=np.int64,
+    )
+
+
+# Row of each comment's parent within its thread, -1 for top-level or unknown
+def thread_parents(thread_codes, comment_ids, parent_ids, parent_is_comment):
+    keys = pd.MultiIndex.from_arrays([thread_codes, comment_ids])
+    last = ~keys.duplicated(keep="last")
+    lookup = keys[last]
+    positions = np.flatnonzero(last)
+    found = lookup.get_indexer(pd.MultiIndex.from_arrays([thread_codes, parent_ids]))
+    return np.where((found >= 0) & parent_is_comment, positions[found], -1)
+
+
+# Number of t1_ links followed from each comment, as add_average_thread_depth
+# counts them: ancestors in the thread plus one hop to a missing parent comment
+def thread_depths(parents, parent_is_comment):
+    depths = parent_is_comment.astype(np.int64)
+    current = np.arange(len(parents))
+    active = np.flatnonzero(parents >= 0)
+    for _ in range(len(parents)):
+        if len(active) == 0:
+            break
+        current[active] = parents[current[active]]
+        depths[active] += parent_is_comment[current[active]]
+        active = active[parents[current[active]] >= 0]
+    return depths
+
+
+def write_text(path, texts):
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(path, "wb") as file:
+        for i, text in enumerate(texts):
+            data = ("" if pd.isna(text) else str(text)).encode("utf-8")
+            file.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    return offsets
+
+
+# Comments without a post title or id belong to no thread and are left out
+def build_thread_store(comments_df, path):
+    os.makedirs(path, exist_ok=True)
+    df = comments_df.dropna(subset=["post_title", "id"])
+    thread_codes, titles = pd.factorize(df["post_title"], sort=True)
+    order = np.argsort(thread_codes, kind="stable")
+    df = df.iloc[order]
+    thread_codes = thread_codes[order]
+
+    parent_ids = df["parent_id"].fillna("").astype(str)
+    parent_is_comment = parent_ids.str.startswith("t1_").to_numpy()
+    comment_ids = decode_base36(df["id"].astype(str).to_numpy())
+    parent_comment_ids = decode_base36(parent_ids.str[3:].to_numpy())
+    author_codes, authors = pd.factorize(df["username"])
+
+    counts = np.bincount(thread_codes, minlength=len(titles))
+    thread_offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+    np.cumsum(counts, out=thread_offsets[1:])
+
+    created = pd.to_datetime(df["date"], errors="coerce", utc=True)
+    created_seconds = (
+        (created - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    ).fillna(-1)
+
+    arrays = {
+        "comment_ids": comment_ids,
+        "parents": thread_parents(
+            thread_codes, comment_ids, parent_comment_ids, parent_is_comment
+        ).astype(np.int64),
+        "parent_ids": parent_comment_ids,
+        "parent_is_comment": parent_is_comment.astype(np.bool_),
+        "authors": author_codes.astype(np.int32),
+        "scores": pd.to_numeric(df["score"], errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype=np.int32),
+        "created": created_seconds.to_numpy(dtype=np.int64),
+        "text_offsets": write_text(os.path.join(path, "text.bin"), df["body"].tolist()),
+        "thread_offsets": thread_offsets,
+        "title_offsets": write_text(os.path.join(path, "titles.bin"), list(titles)),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+    with open(os.path.join(path, "authors.json"), "w") as file:
+        json.dump([str(author) for author in authors], file)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump(
+            {
+                "version": FORMAT_VERSION,
+                "threads": len(titles),
+                "comments": len(df),
+                "hash": hash_frame(comments_df, THREAD_COLUMNS),
+            },
+            file,
+        )
+    print(f"Thread store with {len(titles)} threads and {len(df)} comments saved to {path}")
+    return ThreadStore(path)
+
+
+class Thread:
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.start = int(store.thread_offsets[index])
+        self.stop = int(store.thread_offsets[index + 1])
+
+    def __len__(self):
+        return self.stop - self.start
+
+    # Array views into the memory-mapped store, no copies
+    @property
+    def comment_ids(self):
+        return self.store.comment_ids[self.start : self.stop]
+
+    @property
+    def authors(self):
+        return self.store.authors[self.start : self.stop]
+
+    @property
+    def scores(self):
+        return self.store.scores[self.start : self.stop]
+
+    @property
+    def created(self):
+        return self.store.created[self.start : self.stop]
+
+    @property
+    def parents(self):
+        parents = self.store.parents[self.start : self.stop]
+        return np.where(parents >= 0, parents - self.start, -1)
+
+    @property
+    def title(self):
+        return self.store.title(self.index)
+
+    def body_bytes(self, i):
+        return self.store.text_bytes(self.start + i)
+
+    def body(self, i):
+        return bytes(self.body_bytes(i)).decode("utf-8")
+
+
+class ThreadStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(path, "authors.json"), "r") as file:
+            self.author_names = np.array(json.load(file), dtype=object)
+        self.text = self._map(os.path.join(path, "text.bin"))
+        self.titles = self._map(os.path.join(path, "titles.bin"))
+
+    @staticmethod
+    def _map(path):
+        if os.path.getsize(path) == 0:
+            return memoryview(b"")
+        with open(path, "rb") as file:
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.thread_offsets) - 1
+
+    @property
+    def num_comments(self):
+        return len(self.comment_ids)
+
+    def text_bytes(self, row):
+        return self.text[self.text_offsets[row] : self.text_offsets[row + 1]]
+
+    def title(self, index):
+        start, stop = self.title_offsets[index], self.title_offsets[index + 1]
+        return bytes(self.titles[start:stop]).decode("utf-8")
+
+    def thread(self, index):
+        return Thread(self, index)
+
+    def threads(self):
+        for index in range(len(self)):
+            yield Thread(self, index)
+
+    def usernames(self):
+        names = np.append(self.author_names, None)
+        return names[self.authors]
+
+
+# Reuses the store at path when it was built from the same comments
+def open_thread_store(path, comments_df):
+    comments_hash = hash_frame(comments_df, THREAD_COLUMNS)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.isfile(meta_path):
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        if meta["version"] == FORMAT_VERSION and meta["hash"] == comments_hash:
+            print(f"Loading thread store from {path}")
+            return ThreadStore(path)
+    return build_thread_store(comments_df, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a compact comment-thread store.")
+    parser.add_argument("comments_file", help="Comments CSV or pickle.")
+    parser.add_argument("path", help="Output directory.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.comments_file.endswith(".pkl"):
+        comments_df = pd.read_pickle(args.comments_file)
+    else:
+        comments_df = pd.read_csv(args.comments_file)
+    build_thread_store(comments_df.dropna(subset=["body"]).drop_duplicates(), args.path)
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+# Reddit usernames are at most 20 characters of [A-Za-z0-9_-]
+MAX_LENGTH = 20
+# Shorter names are only grouped by their template, not linked by edits
+MIN_FAMILY_LENGTH = 6
+BASE = np.uint64(0x100000001B3)
+# Odd multiplier that spreads (shape, position) over the key bits
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# Character classes: 0 padding, 1 upper, 2 lower, 3 digit, 4 "_", 5 "-", 6 other
+CLASSES = np.full(256, 6, dtype=np.uint8)
+CLASSES[0] = 0
+CLASSES[ord("A") : ord("Z") + 1] = 1
+CLASSES[ord("a") : ord("z") + 1] = 2
+CLASSES[ord("0") : ord("9") + 1] = 3
+CLASSES[ord("_")] = 4
+CLASSES[ord("-")] = 5
+
+
+# Fixed-width byte matrix, one row per name, zero padded
+def encode_usernames(usernames):
+    encoded = pd.Series(usernames, dtype=object).astype(str).str.encode("ascii", "replace")
+    data = np.array(encoded.tolist(), dtype=f"S{MAX_LENGTH}")
+    return data.view(np.uint8).reshape(len(data), MAX_LENGTH)
+
+
+def row_keys(matrix):
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(f"V{matrix.shape[1]}").ravel()
+
+
+def previous_classes(classes):
+    previous = np.zeros_like(classes)
+    previous[:, 1:] = classes[:, :-1]
+    return previous
+
+
+# Kept symbols moved to the front in order, so equal sequences give equal rows
+def compact(values, keep):
+    values = np.where(keep, values, 0).astype(np.uint8)
+    order = np.argsort(~keep, axis=1, kind="stable")
+    return np.take_along_axis(values, order, axis=1)
+
+
+# Shape signature: the class runs of the name, where letter runs collapse to
+# their case ("Aa" for a capitalised word) and digits keep their count, so
+# Adjective_Noun_1234 names share "Aa_Aa_9999"
+def shape_signatures(chars):
+    classes = CLASSES[chars]
+    letter = (classes == 1) | (classes == 2)
+    keep = (classes > 0) & ~(letter & (classes == previous_classes(classes)))
+    return compact(classes, keep)
+
+
+# Token pattern: the name in lowercase with each digit run replaced by "#",
+# so spambot7 and SpamBot123 share "spambot#"
+def token_patterns(chars):
+    classes = CLASSES[chars]
+    digit = classes == 3
+    pattern = np.where(classes == 1, chars + 32, np.where(digit, ord("#"), chars))
+    keep = (classes > 0) & ~(digit & (previous_classes(classes) == 3))
+    return compact(pattern, keep)
+
+
+# Polynomial hash of each row and of each row with one character deleted:
+# h(s without s_p) = P_p + (H - P_{p+1}) / BASE, with BASE odd so it is
+# invertible modulo 2**64
+def deletion_hashes(pattern):
+    powers = np.ones(MAX_LENGTH, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(1, MAX_LENGTH):
+            powers[i] = powers[i - 1] * BASE
+        inverse = np.uint64(pow(int(BASE), -1, 2**64))
+        terms = pattern.astype(np.uint64) * powers
+        prefix = np.zeros((len(pattern), MAX_LENGTH + 1), dtype=np.uint64)
+        np.cumsum(terms, axis=1, out=prefix[:, 1:])
+        full = prefix[:, -1:]
+        deleted = prefix[:, :-1] + (full - prefix[:, 1:]) * inverse
+    return full.ravel(), deleted
+
+
+# Largest bucket of names sharing a key, for each name in a bucket of two or
+# more. Ties go to the bucket whose smallest member sorts first
+def largest_buckets(owners, keys, rank):
+    buckets, _ = pd.factorize(keys)
+    sizes = np.bincount(buckets)[buckets]
+    shared = sizes > 1
+    owners, buckets, sizes = owners[shared], buckets[shared], sizes[shared]
+    first = pd.Series(rank[owners]).groupby(buckets).transform("min").to_numpy()
+    order = np.lexsort((first, -sizes, owners))
+    chosen = order[np.diff(owners[order], prepend=-1) != 0]
+    return owners[chosen], sizes[chosen], keys[shared][chosen]
+
+
+def username_families(usernames):
+    usernames = np.asarray(pd.unique(pd.Series(usernames).dropna()), dtype=object)
+    chars = encode_usernames(usernames)
+    lengths = (chars > 0).sum(axis=1)
+
+    template_codes, _ = pd.factorize(row_keys(shape_signatures(chars)))
+    template_size = np.bincount(template_codes)[template_codes]
+
+    # A family is a bucket of names with the same pattern shape that share
+    # either their whole pattern or their pattern minus the character at one
+    # position, so every two members are within one edit. Buckets are not
+    # chained: each name reports the largest bucket it belongs to
+    patterns = token_patterns(chars)
+    pattern_shapes, _ = pd.factorize(row_keys(shape_signatures(patterns)))
+    full, deleted = deletion_hashes(patterns)
+    rows = np.flatnonzero(lengths >= MIN_FAMILY_LENGTH)
+    within = np.arange(MAX_LENGTH) < (patterns[rows] > 0).sum(axis=1)[:, None]
+    owners = np.concatenate([rows, np.repeat(rows, within.sum(axis=1))])
+    positions = np.concatenate([np.full(len(rows), -1), np.nonzero(within)[1]])
+    # Keys only match within the same pattern shape and deleted position
+    with np.errstate(over="ignore"):
+        salt = (pattern_shapes[owners] * (MAX_LENGTH + 1) + positions + 1).astype(np.uint64)
+        keys = np.concatenate([full[rows], deleted[rows][within]]) ^ (salt * MIX)
+
+    order = np.argsort(chars.view(f"S{MAX_LENGTH}").ravel(), kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    # Family ids are the key of the chosen bucket, so names sharing an id
+    # share a bucket and its size. Names without a family are families of
+    # their own, named after their hash
+    family_id = pd.util.hash_array(usernames)
+    family_size = np.ones(len(usernames), dtype=np.int64)
+    linked, sizes, bucket_keys = largest_buckets(owners, keys, rank)
+    family_id[linked] = bucket_keys
+    family_size[linked] = sizes
+    family_id = family_id.view(np.int64)
+    return pd.DataFrame(
+        {
+            "username": usernames,
+            "username_template_size": template_size,
+            "username_family": family_id,
+            "username_family_size": family_size,
+        }
+    )
+
+
+def add_username_families(df, comments_df, posts_df=None):
+    frames = [df["username"], comments_df["username"]]
+    if posts_df is not None:
+        frames.append(posts_df["username"])
+    families_df = username_families(pd.concat(frames, ignore_index=True))
+    df = df.merge(families_df, on="username", how="left")
+    print(
+        "Features username_template_size, username_family, username_family_size "
+        "created successfully."
+    )
+
+    return df